@@ -19,13 +19,13 @@ __version__ = "1.0"
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-import sqlite3
 from collections import namedtuple
 
 from pyquaternion import Quaternion
 
 from lbrsys.settings import dbfile, robot_name
 from lbrsys.robdrivers.calibration import Calibration, CalibrationSetting
+from lbrsys.robexec import robconfig
 
 # Named tuple definitions are used across lbrsys to build objects for
 # communicating commands, state and feedback or telemetry between modules
@@ -50,6 +50,8 @@ mpuData     = namedtuple('mpuData', 'gyro accel mag heading temp time quat qangl
                                    0.))
 
 euler       = namedtuple('euler', 'roll pitch yaw')
+headingEstimate = namedtuple('headingEstimate', 'heading rate bias time',
+                             defaults=(0., 0., 0., 0.))  # fused heading, see robops/headingfilter.py
 
 observeTurn = namedtuple('observeTurn', 'angle')
 executeTurn = namedtuple('executeTurn', 'angle')
@@ -64,9 +66,11 @@ move_config = namedtuple('move_config', [
                            'm1_direction',
                            'm2_direction',
                            'm3_direction',
-                           'm4_direction'],
-                           defaults=(17.78, 130, -1, 1, 0, 0)
+                           'm4_direction',
+                           'wheel_base'],   # cm between the drive wheels
+                           defaults=(17.78, 130, -1, 1, 0, 0, 40.64)
                            )
+pose        = namedtuple('pose', 'x y theta v omega time', defaults=(0., 0., 0., 0., 0., 0.))
 
 distance    = namedtuple('distance', 'n s e w t')
 
@@ -77,6 +81,8 @@ dance       = namedtuple('dance', 'song')
 speech      = namedtuple('speech','msg save', defaults=('',))
 feedback    = namedtuple('feedback','info')
 exec_report = namedtuple('exec_report', 'name info', defaults=('telemetry', {}))
+ready       = namedtuple('ready', 'name time info', defaults=(0., {}))  # service initialized
+telemetryRate = namedtuple('telemetryRate', 'subscriber key rate')  # rate in Hz, 0 to unsubscribe
 screen      = namedtuple('screen', 'power')
 iot         = namedtuple('iot', 'msg')
 select_camera = namedtuple('select_camera', 'name')
@@ -91,6 +97,7 @@ channelMap = {
         distance, nav, observeRange,
         motorCommandResult,
         calibrateMagnetometer,
+        telemetryRate,
     },
     'Speech': {speech},
     'Application': {feedback, exec_report, dict},
@@ -115,19 +122,14 @@ command_map = {
     'm': {3: {calibrateMagnetometer: [int, str]}},
     'report': {2: {exec_report: [str]}},
     'camera': {2: {select_camera: [str]}},
+    'telemetry': {4: {telemetryRate: [str, str, float]}},
 }
 
 
 def get_robot_id(name):
     r_id = None
     try:
-        with sqlite3.connect(dbfile) as con:
-            con.row_factory = sqlite3.Row
-            cursor = con.cursor()
-            robot_record = cursor.execute(
-                "SELECT robot_id FROM robot \
-                WHERE robot.name=?", (name,))
-            r_id = robot_record.fetchone()['robot_id']
+        r_id = robconfig.snapshot(dbfile, name)['robot']['robot_id']
 
     except Exception as e:
         print(f"Error getting robot id: {e}")
@@ -135,30 +137,35 @@ def get_robot_id(name):
     return r_id
 
 
-robot_id = get_robot_id(robot_name)
-
-
 def get_move_config(robot_id):
     robot_move_config = move_config()
     try:
-        with sqlite3.connect(dbfile) as con:
-            con.row_factory = sqlite3.Row
-            cursor = con.cursor()
-            config_rec = cursor.execute(
-                "SELECT * FROM move_config \
-                WHERE move_config.robot_id=?", (robot_id,))
-            config_record = config_rec.fetchone()
+        config_record = [m for m in robconfig.snapshot(dbfile, robot_name)['move_config']
+                         if m['robot_id'] == robot_id][0]
         robot_move_config = move_config(float(config_record['wheel_diameter']),
                                         int(config_record['counts_per_rev']),
                                         int(config_record['m1_direction']),
-                                        int(config_record['m2_direction']), 0, 0)
+                                        int(config_record['m2_direction']), 0, 0,
+                                        float(config_record.get('wheel_base') or
+                                              move_config._field_defaults['wheel_base']))
     except Exception as e:
         print(f"Error getting move configuration for robot {robot_name}: {e}")
 
     return robot_move_config
 
 
-robot_move_config = get_move_config(robot_id)
-# print(f"Move Configuration: {str(robot_move_config)}")
+# Robot configuration is loaded on first use, from the config snapshot
+#   rather than the database where possible (see robexec/robconfig.py)
+_lazyConfig = {
+    'robot_id': lambda: get_robot_id(robot_name),
+    'robot_move_config': lambda: get_move_config(get_robot_id(robot_name)),
+    'robot_calibrations': Calibration,
+}
+
 
-robot_calibrations = Calibration()
+def __getattr__(name):
+    if name in _lazyConfig:
+        value = _lazyConfig[name]()
+        globals()[name] = value
+        return value
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
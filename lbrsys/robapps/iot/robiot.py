@@ -35,8 +35,9 @@ from threading import Thread
 import logging
 import multiprocessing
 import queue
+import time
 
-from lbrsys import feedback
+from lbrsys import feedback, ready
 from lbrsys.settings import iotLogFile
 
 from robcom import robhttp2
@@ -87,6 +88,9 @@ class RobIoTService(object):
         # self.command_thread.daemon = True
         self.command_thread.start()
 
+        self.broadcastQ.put(ready(multiprocessing.current_process().name, time.time(),
+                                  {'robotClient': self.args.robot_client is not None}))
+
 
     def setup_env(self):
         try:
@@ -109,6 +113,9 @@ class RobIoTService(object):
             user = os.environ['ROBOT_USER']
             token = os.environ['ROBOT_APITOKEN']
             self.args.robot_client = robhttp2.Client(self.args.thing_name, self.args.robot_url, user, token)
+            # the shadow is updated every 5 seconds
+            for key in ('MPU', 'Ranges', 'amperages', 'Bat'):
+                self.args.robot_client.subscribeTelemetry(key, 0.2)
 
             """
             print("\t{}\n\t{}\n\t{}\n\t{}\n\t{}\n\t{}\n\t{}".format(
@@ -206,6 +206,8 @@ class FSMExec(robhttp2.Client):
         self.stop = False
         # self.sampleInterval = 0.5
         self.sampleInterval = 1.5
+        for key in ('MPU', 'Ranges', 'amperages', 'Bat'):
+            self.subscribeTelemetry(key, 1. / self.sampleInterval)
         self.machine = RobStateMachine(getTelemetry=self.getTelemetry,
                                        stateFileName=self.stateFileName,
                                        doOutputs=self.doOutputs)
@@ -0,0 +1,200 @@
+"""
+msgcatalog.py - Standard message catalog for speech and other services
+    The message table is compiled into a binary catalog file: a header, an
+    open addressed hash table of fixed size slots keyed on (name, language),
+    and the key and text strings the slots point to.  Readers mmap the file and
+    look up a message by hashing its key and probing slots, so nothing is
+    parsed or imported at startup and lookups are O(1).
+
+    The header carries a digest of the messages it was built from, and the
+    catalog is only rewritten when the message table changes.  New catalogs are
+    written to a temporary file and renamed into place, so readers never see a
+    partial catalog.
+"""
+
+__author__ = "Tal G. Ball"
+__copyright__ = "Copyright (C) 2024 Tal G. Ball"
+__license__ = "Apache License, Version 2.0"
+__version__ = "1.0"
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import os
+import mmap
+import struct
+import hashlib
+
+from lbrsys.settings import MESSAGE_CATALOG
+
+
+MAGIC = b'LBRMSG1\0'
+HEADER = struct.Struct('<8s8sI')    # magic, digest of the messages, number of slots
+SLOT = struct.Struct('<QIHIH')      # key hash, key offset, key length, text offset, text length
+
+
+def keyBytes(name, language):
+    return ("%s\0%s" % (name, language)).encode()
+
+
+def keyHash(key):
+    # never 0, which marks an empty slot
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little') or 1
+
+
+def digest(messages):
+    """Digest of the catalog content of message table rows"""
+    content = sorted((m['name'], m['language'], m['text'] or '') for m in messages)
+    return hashlib.blake2b(repr(content).encode(), digest_size=8).digest()
+
+
+def fileDigest(filename):
+    try:
+        with open(filename, 'rb') as f:
+            magic, d, numSlots = HEADER.unpack(f.read(HEADER.size))
+        return d if magic == MAGIC else None
+    except (OSError, struct.error):
+        return None
+
+
+def build(messages, filename=MESSAGE_CATALOG):
+    """
+    Write the catalog for message table rows, unless the existing catalog was
+    built from the same messages.  Returns True if the catalog was written.
+    """
+    d = digest(messages)
+    if fileDigest(filename) == d:
+        return False
+
+    entries = {keyBytes(m['name'], m['language']): (m['text'] or '').encode() for m in messages}
+    numSlots = 8
+    while numSlots < 2 * len(entries):
+        numSlots *= 2
+
+    slots = [None] * numSlots
+    strings = bytearray()
+    stringsOffset = HEADER.size + numSlots * SLOT.size
+    for key, text in entries.items():
+        h = keyHash(key)
+        i = h & (numSlots - 1)
+        while slots[i] is not None:
+            i = (i + 1) & (numSlots - 1)
+        keyOffset = stringsOffset + len(strings)
+        strings += key
+        slots[i] = (h, keyOffset, len(key), keyOffset + len(key), len(text))
+        strings += text
+
+    data = bytearray(HEADER.pack(MAGIC, d, numSlots))
+    for s in slots:
+        data += SLOT.pack(*(s or (0, 0, 0, 0, 0)))
+    data += strings
+
+    tmpfile = "%s.%d" % (filename, os.getpid())
+    with open(tmpfile, 'wb') as f:
+        f.write(data)
+    os.replace(tmpfile, filename)
+    return True
+
+
+class MessageCatalog:
+    def __init__(self, filename=MESSAGE_CATALOG):
+        self.filename = filename
+        self.mm = None
+        self.stat = None
+        self.open()
+
+    def open(self):
+        self.close()
+        with open(self.filename, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.digest, self.numSlots = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("%s is not a message catalog" % (self.filename,))
+
+    def refresh(self):
+        """Reopen the catalog if it has been rebuilt"""
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return
+        if (st.st_ino, st.st_mtime_ns) != (self.stat.st_ino, self.stat.st_mtime_ns):
+            self.open()
+
+    def text(self, name, language='English', default=None):
+        key = keyBytes(name, language)
+        h = keyHash(key)
+        mm = self.mm
+        i = h & (self.numSlots - 1)
+        while True:
+            sh, keyOffset, keyLength, textOffset, textLength = \
+                SLOT.unpack_from(mm, HEADER.size + i * SLOT.size)
+            if sh == 0:
+                return default
+            if sh == h and mm[keyOffset:keyOffset + keyLength] == key:
+                return mm[textOffset:textOffset + textLength].decode()
+            i = (i + 1) & (self.numSlots - 1)
+
+    def keys(self):
+        """(name, language) for each message"""
+        keys = []
+        for i in range(self.numSlots):
+            sh, keyOffset, keyLength, textOffset, textLength = \
+                SLOT.unpack_from(self.mm, HEADER.size + i * SLOT.size)
+            if sh != 0:
+                keys.append(tuple(self.mm[keyOffset:keyOffset + keyLength].decode().split('\0')))
+        return sorted(keys)
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+
+_catalog = None
+
+
+def catalog():
+    """The process's catalog, built from the robot configuration if there isn't one yet"""
+    global _catalog
+    if _catalog is None:
+        if not os.path.exists(MESSAGE_CATALOG):
+            from lbrsys.robexec import robconfig
+            build(robconfig.snapshot()['messages'])
+        _catalog = MessageCatalog()
+    else:
+        _catalog.refresh()
+    return _catalog
+
+
+if __name__ == '__main__':
+    import tempfile
+    import timeit
+
+    from lbrsys.robexec import robconfig
+
+    messages = robconfig.snapshot()['messages']
+    filename = os.path.join(tempfile.mkdtemp(), 'messages.cat')
+    print("built: %s, rebuilt unchanged: %s" % (build(messages, filename), build(messages, filename)))
+
+    c = MessageCatalog(filename)
+    for m in messages:
+        assert c.text(m['name'], m['language']) == (m['text'] or ''), m
+    assert c.text('NoSuchMessage') is None
+    print("%d messages, %d slots, %d bytes" % (len(c.keys()), c.numSlots, os.path.getsize(filename)))
+
+    iterations = 100000
+    t = timeit.timeit(lambda: c.text('Hello', 'English'), number=iterations)
+    print("lookup: %.2fus" % (t / iterations * 1e6,))
+    c.close()
@@ -64,7 +64,7 @@ sys.path.insert(1, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 sys.path.insert(2, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 sys.path.insert(3, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
 
-from lbrsys import select_camera
+from lbrsys import select_camera, ready
 from lbrsys.settings import robcamLogFile, USE_SSL, CAMERAS
 # USE_SSL = False
 from lbrsys.robdrivers import camera
@@ -289,6 +289,9 @@ def start_service(commandq, broadcastq):
         logging.debug(msg)
         print(msg)
 
+    broadcastq.put(ready(multiprocessing.current_process().name, time.time(),
+                         {'camera': default_camera_started}))
+
     while True:
         task = commandq.get()
 
@@ -0,0 +1,230 @@
+"""
+robcodec.py - Compact binary encoding for lbrsys messages
+    Each registered message type is packed into a fixed struct layout behind
+    a one byte type tag.  Types that are not registered, or whose text fields
+    don't fit their layout, are pickled behind tag 0, so any message can be
+    encoded.
+
+    EncodedQueue wraps a JoinableQueue so that the queue carries the encoded
+    bytes while producers and consumers continue to put and get messages.
+    Channels use it when their protocol is 'EncodedQueue'.
+"""
+
+__author__ = "Tal G. Ball"
+__copyright__ = "Copyright (C) 2024 Tal G. Ball"
+__license__ = "Apache License, Version 2.0"
+__version__ = "1.0"
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import pickle
+import struct
+import multiprocessing
+
+from pyquaternion import Quaternion
+
+from lbrsys import power, nav, voltages, amperages, batlevel, count
+from lbrsys import gyro, accel, mag, mpuData, euler, distance
+from lbrsys import observeTurn, executeTurn, observeHeading, executeHeading, observeRange
+
+
+PICKLED = 0
+
+codecsByType = {}
+codecsByTag = {}
+
+
+class Codec:
+    def __init__(self, msgType, tag, fmt, flatten, build):
+        self.msgType = msgType
+        self.tag = tag
+        self.struct = struct.Struct('<B' + fmt)
+        self.flatten = flatten  # message -> tuple of struct fields
+        self.build = build      # tuple of struct fields -> message
+
+    def encode(self, msg):
+        return self.struct.pack(self.tag, *self.flatten(msg))
+
+    def decode(self, data):
+        return self.build(self.struct.unpack(data)[1:])
+
+
+def register(msgType, tag, fmt, flatten=tuple, build=None):
+    if tag == PICKLED or tag in codecsByTag:
+        raise ValueError("Codec tag %d for %s is reserved or in use" % (tag, msgType.__name__))
+    if build is None:
+        build = lambda fields: msgType(*fields)
+
+    codec = Codec(msgType, tag, fmt, flatten, build)
+    codecsByType[msgType] = codec
+    codecsByTag[tag] = codec
+    return codec
+
+
+def encode(msg):
+    codec = codecsByType.get(type(msg))
+    if codec is not None:
+        try:
+            return codec.encode(msg)
+        except (ValueError, TypeError, AttributeError, struct.error):
+            pass  # doesn't fit the layout, so fall back to pickle
+
+    return bytes((PICKLED,)) + pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+
+
+def decode(data):
+    if data[0] == PICKLED:
+        return pickle.loads(data[1:])
+
+    return codecsByTag[data[0]].decode(data)
+
+
+def text(s, size):
+    """Encode a str field, refusing any that wouldn't survive the fixed size"""
+    b = s.encode()
+    if len(b) > size:
+        raise ValueError("text field longer than %d bytes" % size)
+    return b
+
+
+def untext(b):
+    return b.rstrip(b'\0').decode()
+
+
+def flattenNav(n):
+    return n.power.level, n.power.angle, n.range, text(n.sensor, 16), n.interval
+
+
+def buildNav(f):
+    return nav(power(f[0], f[1]), f[2], untext(f[3]), f[4])
+
+
+def flattenMpu(m):
+    q = m.quat.elements if isinstance(m.quat, Quaternion) else m.quat
+    return (*m.gyro, *m.accel, *m.mag, m.heading, m.temp, m.time, *q, m.qangle)
+
+
+def buildMpu(f):
+    return mpuData(gyro(*f[0:4]), accel(*f[4:7]), mag(*f[7:10]),
+                   f[10], f[11], f[12], Quaternion(*f[13:17]), f[17])
+
+
+# asctime strings are 24 characters
+register(power,             1, 'dd')
+register(nav,               2, 'ddd16sd', flattenNav, buildNav)
+register(voltages,          3, 'ddd24s',
+         lambda v: (v.mainBattery, v.internal, v.vout, text(v.time, 24)),
+         lambda f: voltages(f[0], f[1], f[2], untext(f[3])))
+register(amperages,         4, 'dd24s',
+         lambda a: (a.channel1, a.channel2, text(a.time, 24)),
+         lambda f: amperages(f[0], f[1], untext(f[2])))
+register(batlevel,          5, 'dd8s',
+         lambda b: (b.voltage, b.level, text(b.source, 8)),
+         lambda f: batlevel(f[0], f[1], untext(f[2])))
+register(count,             6, 'qqd')
+register(gyro,              7, 'dddd')
+register(accel,             8, 'ddd')
+register(mag,               9, 'ddd')
+register(mpuData,          10, 'd' * 18, flattenMpu, buildMpu)
+register(euler,            11, 'ddd')
+register(distance,         12, 'ddddd')
+register(observeTurn,      13, 'd')
+register(executeTurn,      14, 'd')
+register(observeHeading,   15, 'd')
+register(executeHeading,   16, 'd')
+register(observeRange,     17, 'ddd16sd',
+         lambda o: flattenNav(o.nav),
+         lambda f: observeRange(buildNav(f)))
+
+
+class EncodedQueue:
+    """JoinableQueue carrying encoded messages"""
+    def __init__(self, q=None):
+        self.q = multiprocessing.JoinableQueue() if q is None else q
+
+    @property
+    def _reader(self):
+        return self.q._reader
+
+    def put(self, msg, block=True, timeout=None):
+        self.q.put(encode(msg), block, timeout)
+
+    def put_nowait(self, msg):
+        self.q.put_nowait(encode(msg))
+
+    def get(self, block=True, timeout=None):
+        return decode(self.q.get(block, timeout))
+
+    def get_nowait(self):
+        return decode(self.q.get_nowait())
+
+    def empty(self):
+        return self.q.empty()
+
+    def qsize(self):
+        return self.q.qsize()
+
+    def task_done(self):
+        self.q.task_done()
+
+    def join(self):
+        self.q.join()
+
+
+if __name__ == '__main__':
+    import time
+    import timeit
+
+    samples = [
+        power(0.25, 90.),
+        nav(power(0.3, 0.), 40, 'Forward', 5),
+        voltages(12.6, 12.5, 5.11, time.asctime()),
+        amperages(1.2, 1.3, time.asctime()),
+        batlevel(12.6, 0.9, 'BAT'),
+        count(1234, -1187, time.time()),
+        gyro(0.1, -0.2, 12.5, time.time()),
+        accel(0.01, -0.02, 1.0),
+        mag(-10.7, -10.6, -31.6),
+        mpuData(gyro(0.1, -0.2, 12.5, time.time()), accel(0.01, -0.02, 1.0),
+                mag(-10.7, -10.6, -31.6), 315., 28.4, time.time(),
+                Quaternion(0.7071, 0., 0., 0.7071), 90.),
+        euler(0.1, 0.2, 90.),
+        distance(50., 40., 30., 20., time.time()),
+        observeTurn(90.),
+        executeTurn(-45.),
+        observeHeading(180.),
+        executeHeading(270.),
+        observeRange(nav(power(0.3, 0.), 40, 'Forward', 5)),
+        {'Ranges': {'Forward': 67, 'Left': 18, 'Right': 55, 'Back': 18, 'Bottom': -1, 'Deltat': 12},
+         'Timestamp': time.time()},
+        'Shutdown',
+    ]
+
+    iterations = 20000
+    print("%-16s %6s %6s %10s %10s %10s %10s" %
+          ('message', 'pickle', 'codec', 'p enc(us)', 'c enc(us)', 'p dec(us)', 'c dec(us)'))
+    for msg in samples:
+        p = pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+        c = encode(msg)
+        decoded = decode(c)
+        assert decoded == msg, (decoded, msg)
+
+        pEnc = timeit.timeit(lambda: pickle.dumps(msg, pickle.HIGHEST_PROTOCOL), number=iterations)
+        cEnc = timeit.timeit(lambda: encode(msg), number=iterations)
+        pDec = timeit.timeit(lambda: pickle.loads(p), number=iterations)
+        cDec = timeit.timeit(lambda: decode(c), number=iterations)
+        print("%-16s %6d %6d %10.2f %10.2f %10.2f %10.2f" %
+              (type(msg).__name__, len(p), len(c),
+               pEnc / iterations * 1e6, cEnc / iterations * 1e6,
+               pDec / iterations * 1e6, cDec / iterations * 1e6))
@@ -30,11 +30,15 @@ import sys
 import time
 import threading
 import queue
+import itertools
 
 from lbrsys.robcom import publisher
 
 
 class Client(object):
+    renewalInterval = 20.   # s between telemetry subscription renewals, within the robot's ttl
+    instances = itertools.count(1)
+
     def __init__(self, robot=None, robot_url=None, user=None, token=None):
         self.robot = robot
         self.robot_url = robot_url
@@ -55,6 +59,13 @@ class Client(object):
 
         self.publisher = publisher.Publisher("Robot http Client Publisher")
 
+        self.telemetrySubscriptions = {}   # key: rate in Hz
+        # clients of the same robot, e.g. the fsm and iot apps, each keep their own subscriptions
+        self.subscriberId = "%s:%s:%d:%d" % (robot, type(self).__name__, os.getpid(), next(self.instances))
+        # so the robot doesn't also subscribe this client at its rates for polling clients
+        self.headers['Telemetry-Subscriber'] = self.subscriberId
+        self.lastRenewal = 0.
+
         self.postQ = queue.Queue()
         self.postThread = threading.Thread(target=self.postService,
                                            name="Post Service Thread")
@@ -84,9 +95,25 @@ class Client(object):
         """ Establish synonym for subscribe.  Considering refactor"""
         self.subscriber(payload)
 
+    def subscribeTelemetry(self, key, rate):
+        """Ask the robot to report key at rate Hz, renewed by get. rate 0 unsubscribes."""
+        if rate > 0:
+            self.telemetrySubscriptions[key] = rate
+        else:
+            self.telemetrySubscriptions.pop(key, None)
+        self.postQ.put((json.dumps({'subscriber': self.subscriberId, 'key': key, 'rate': rate}),
+                        '/telemetry'))
+
+    def renewTelemetrySubscriptions(self):
+        if time.time() - self.lastRenewal >= self.renewalInterval:
+            self.lastRenewal = time.time()
+            for key, rate in self.telemetrySubscriptions.items():
+                self.subscribeTelemetry(key, rate)
+
     def get(self):
         response = ''
         responseJ = ''
+        self.renewTelemetrySubscriptions()
 
         try:
             response = requests.get(self.robot_url + '/telemetry', data='\r\n',
@@ -143,7 +170,11 @@ class Client(object):
 
             if self.response != '':           
                 if self.response.status_code == 200 or self.response.status_code == 204:
-                    
+
+                    if self.response.status_code == 204 or not self.response.content:
+                        # status only, e.g. a telemetry subscription, so nothing to publish
+                        continue
+
                     try:
                         responseJ  = [self.response.json()]
                     except ValueError as e:
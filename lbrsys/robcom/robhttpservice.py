@@ -46,7 +46,11 @@ import threading
 from pyquaternion import Quaternion
 
 from lbrsys.settings import robhttpLogFile, robhttpAddress, USE_SSL, CAMERAS
-from lbrsys import feedback, exec_report
+try:
+    from lbrsys.settings import TELEMETRY_POLL_RATES
+except ImportError:
+    TELEMETRY_POLL_RATES = {}
+from lbrsys import feedback, exec_report, ready, telemetryRate
 
 from lbrsys.robcom import robauth
 
@@ -60,6 +64,7 @@ if proc.name == "Robot Http Service" :
 class RobHTTPService(ThreadingMixIn, HTTPServer):
     allow_reuse_address = True
     daemon_threads = True
+    pollRenewalInterval = 20.   # s between renewals of a polling client's subscriptions
 
     def __init__(self, address, handler, receiveQ, sendQ):
         HTTPServer.__init__(self, address, handler)
@@ -72,6 +77,7 @@ class RobHTTPService(ThreadingMixIn, HTTPServer):
         self.telemetry_sent = 0
         self.heartbeat_thread = None
         self.heartbeat = False
+        self.pollSubscriptions = {}     # polling client: time its subscriptions were renewed
         self.dockSignal_state = {
             'time_to_live': 3.0,
             'left': 0.0,    # timestamp of last left signal
@@ -98,6 +104,21 @@ class RobHTTPService(ThreadingMixIn, HTTPServer):
 
         return
 
+    def subscribePoll(self, handler):
+        """
+        Count a client polling for telemetry as subscribed at the poll rates,
+            unless it manages its own subscriptions
+        """
+        if handler.headers['Telemetry-Subscriber']:
+            return
+        subscriber = "poll:%s@%s" % (handler.headers['User'], handler.client_address[0])
+        now = time.time()
+        if now - self.pollSubscriptions.get(subscriber, 0.) < self.pollRenewalInterval:
+            return
+        self.pollSubscriptions[subscriber] = now
+        for key, rate in TELEMETRY_POLL_RATES.items():
+            self.sendQ.put(telemetryRate(subscriber, key, rate))
+
     def set_security_mode(self):
         try:
             if USE_SSL:
@@ -255,6 +276,7 @@ class RobHandler(BaseHTTPRequestHandler):
         self.end_headers()
         buffer = json.dumps(self.server.currentTelemetry, default=str).encode()
         self.wfile.write(buffer)
+        self.server.subscribePoll(self)
 
         if self.server.motors_powered > 0:
             # todo track heartbeats on a per client basis, otherwise client 2 could accidentally keep alive client 1
@@ -283,6 +305,7 @@ class RobHandler(BaseHTTPRequestHandler):
         # self.http_buffer_log.write(buffer)
 
         self.server.telemetry_sent = time.time()
+        self.server.subscribePoll(self)
         # print("GET path: %s" % self.path)
 
     def handle_cameras(self):
@@ -302,6 +325,22 @@ class RobHandler(BaseHTTPRequestHandler):
         self.end_headers()
         return
 
+    def handle_telemetry_rate(self, msgD):
+        """
+        subscribe to a telemetry key at a rate in Hz, e.g. {"key": "Ranges", "rate": 2},
+            rate 0 to unsubscribe.  Subscriptions lapse unless renewed.
+        """
+        try:
+            subscriber = msgD.get('subscriber') or "%s@%s" % (self.headers['User'], self.client_address[0])
+            self.server.sendQ.put(telemetryRate(subscriber, msgD['key'], float(msgD['rate'])))
+            self.send_response(204)
+        except (KeyError, TypeError, ValueError) as e:
+            logging.info("Bad telemetry rate post: %s, %s" % (str(msgD), str(e)))
+            self.send_response(400)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        return
+
     def handle_say_noreply(self, msgD):
         try:
             if 'text' in msgD['speech']:
@@ -394,7 +433,8 @@ class RobHandler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Credentials', 'true')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'X-Requested-With, Content-type, User, Authorization')
+        self.send_header('Access-Control-Allow-Headers',
+                         'X-Requested-With, Content-type, User, Authorization, Telemetry-Subscriber')
         self.end_headers()
         return
 
@@ -436,6 +476,7 @@ class RobHandler(BaseHTTPRequestHandler):
         """
         post power, turn or heading json for operating the motors
         post to /docksignal path to communicate receipt of docking signals
+        post to /telemetry path to subscribe to a telemetry key at a rate
 
          post replies:
            200 - post reply contains telemetry data
@@ -468,6 +509,9 @@ class RobHandler(BaseHTTPRequestHandler):
         elif self.path == '/say':
             self.handle_say(msgD)
 
+        elif self.path == '/telemetry':
+            self.handle_telemetry_rate(msgD)
+
         elif self.path == '/wakeup':
             self.handle_wakeup(msgD)
 
@@ -485,7 +529,8 @@ def startService(receiveQ, sendQ, addr=robhttpAddress):
                                        name = "TelemetryUpdateThread")
     logging.debug("Starting Telemetry Updater.")
     telUpdateThread.start()
-    
+
+    sendQ.put(ready(multiprocessing.current_process().name, time.time()))
     logging.debug("Starting robot http gateway service.")
     server.serve_forever()
     telUpdateThread.join()
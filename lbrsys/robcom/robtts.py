@@ -28,7 +28,7 @@ import pyttsx3
 from pydub import AudioSegment
 from pydub.playback import play
 
-from robcom.robmsgdict import messageDict
+from lbrsys.robcom import msgcatalog
 from robcom import publisher
 from lbrsys.settings import AUDIO_DIR
 
@@ -50,7 +50,9 @@ class Robtts:
     #
     def getText(self, msgKey, language):
         try:
-            text = messageDict[msgKey][language]['text']
+            text = msgcatalog.catalog().text(msgKey, language)
+            if text is None:
+                raise KeyError(msgKey)
         except:
             print("Error finding standard message from key:", msgKey)
             text = ""
@@ -104,8 +106,9 @@ def main(testSentences, tts=None):
         # tts.sayNow(s)
         print(s)
 
-    for mk in messageDict.keys():
-        tts.sayStdNow(mk, 'English')
+    for mk, language in msgcatalog.catalog().keys():
+        if language == 'English':
+            tts.sayStdNow(mk, 'English')
 
 
 #externalize later
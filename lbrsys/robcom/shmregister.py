@@ -0,0 +1,233 @@
+"""
+shmregister.py - Latest value registers in shared memory
+    A register holds the most recent reading from a sensor process so that
+    other processes can use the freshest value at any time without queue
+    traffic.  There is one writer per register, and any number of readers.
+
+    Consistency is maintained seqlock style:  the writer makes the sequence
+    number odd, writes the value, then makes it even again.  A reader retries
+    if the sequence is odd or has changed while it was copying the value.
+
+    Python has no memory barriers, so the seqlock alone relies on the stores
+    and loads to the shared buffer being seen in program order.  That holds on
+    x86, but not on ARM, such as the Raspberry Pi, where a reader could see the
+    new sequence number with part of an older value.  So the writer also
+    stores a CRC32 of the sequence number and value after them, and a reader
+    only accepts a copy whose checksum matches, retrying otherwise.
+"""
+
+__author__ = "Tal G. Ball"
+__copyright__ = "Copyright (C) 2024 Tal G. Ball"
+__license__ = "Apache License, Version 2.0"
+__version__ = "1.0"
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import struct
+import sys
+import zlib
+from time import time as robtimer
+from multiprocessing import shared_memory, resource_tracker
+
+from pyquaternion import Quaternion
+
+from lbrsys import gyro, accel, mag, mpuData, count, headingEstimate
+from lbrsys.settings import RANGE_REGISTER, MPU_REGISTER, COUNT_REGISTER, HEADING_REGISTER
+
+
+SEQ = struct.Struct('<Q')
+CHECK = struct.Struct('<I')     # CRC32 of the sequence number and value
+
+
+def attachShared(name):
+    """
+    Attach to an existing segment without the resource tracker taking ownership,
+    so a reader exiting neither unlinks it nor warns that it leaked.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    shm = shared_memory.SharedMemory(name)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class Register:
+    attachInterval = 1.0  # seconds between attempts to find a register not yet created
+
+    def __init__(self, name, fmt, create=False):
+        self.name = name
+        self.struct = struct.Struct('<' + fmt)
+        self.checked = SEQ.size + self.struct.size     # bytes covered by the checksum
+        self.size = self.checked + CHECK.size
+        self.create = create
+        self.shm = None
+        self.lastAttachTime = 0.
+        self.retries = 0            # reads that overlapped a write
+        self.checksumErrors = 0     # of those, the ones only the checksum caught
+        self.attach()
+
+    def attach(self):
+        self.lastAttachTime = robtimer()
+        try:
+            if self.create:
+                try:
+                    self.shm = shared_memory.SharedMemory(self.name, create=True, size=self.size)
+                except FileExistsError:
+                    # left over from a previous run, so take it over
+                    self.shm = shared_memory.SharedMemory(self.name)
+                SEQ.pack_into(self.shm.buf, 0, 0)
+            else:
+                self.shm = attachShared(self.name)
+        except FileNotFoundError:
+            self.shm = None
+
+        return self.shm is not None
+
+    def write(self, values):
+        buf = self.shm.buf
+        seq = SEQ.unpack_from(buf, 0)[0]
+        SEQ.pack_into(buf, 0, seq + 1)  # odd - write in progress
+        data = SEQ.pack(seq + 2) + self.struct.pack(*values)
+        buf[SEQ.size:self.checked] = data[SEQ.size:]
+        CHECK.pack_into(buf, self.checked, zlib.crc32(data))
+        SEQ.pack_into(buf, 0, seq + 2)
+
+    def read(self, maxTries=100):
+        """Return the latest values as a tuple, or None if nothing has been written"""
+        if self.shm is None:
+            if robtimer() - self.lastAttachTime < self.attachInterval or not self.attach():
+                return None
+
+        buf = self.shm.buf
+        for i in range(maxTries):
+            seq = SEQ.unpack_from(buf, 0)[0]
+            if seq == 0:
+                return None
+            if seq & 1:
+                self.retries += 1
+                continue
+            data = bytes(buf[:self.size])
+            if SEQ.unpack_from(buf, 0)[0] != seq or SEQ.unpack_from(data, 0)[0] != seq:
+                self.retries += 1
+                continue
+            if CHECK.unpack_from(data, self.checked)[0] != zlib.crc32(data[:self.checked]):
+                # the sequence looked stable, but the stores weren't seen in order
+                self.retries += 1
+                self.checksumErrors += 1
+                continue
+            return self.struct.unpack_from(data, SEQ.size)
+
+        return None
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            if self.create:
+                try:
+                    self.shm.unlink()
+                except FileNotFoundError:
+                    pass
+            self.shm = None
+
+
+class RangeRegister(Register):
+    """Latest ranges in the P8X32 reading format"""
+    sensors = ('Forward', 'Left', 'Right', 'Back', 'Bottom', 'Deltat')
+
+    def __init__(self, name=RANGE_REGISTER, create=False):
+        super().__init__(name, 'd' * (len(self.sensors) + 1), create)
+
+    def write(self, ranges):
+        r = ranges['Ranges']
+        super().write([r.get(s, -1) for s in self.sensors] + [ranges['Timestamp']])
+
+    def read(self, maxTries=100):
+        values = super().read(maxTries)
+        if values is None:
+            return None
+        return {'Ranges': dict(zip(self.sensors, values[:-1])), 'Timestamp': values[-1]}
+
+
+class MpuRegister(Register):
+    """Latest mpuData reading"""
+
+    def __init__(self, name=MPU_REGISTER, create=False):
+        super().__init__(name, 'd' * 18, create)
+
+    def write(self, m):
+        q = m.quat.elements if isinstance(m.quat, Quaternion) else m.quat
+        super().write((*m.gyro, *m.accel, *m.mag, m.heading, m.temp, m.time, *q, m.qangle))
+
+    def read(self, maxTries=100):
+        v = super().read(maxTries)
+        if v is None:
+            return None
+        return mpuData(gyro(*v[0:4]), accel(*v[4:7]), mag(*v[7:10]),
+                       v[10], v[11], v[12], Quaternion(*v[13:17]), v[17])
+
+
+class CountRegister(Register):
+    """Latest encoder count"""
+
+    def __init__(self, name=COUNT_REGISTER, create=False):
+        super().__init__(name, 'qqd', create)
+
+    def write(self, c):
+        super().write((int(c.left), int(c.right), c.time))
+
+    def read(self, maxTries=100):
+        v = super().read(maxTries)
+        return None if v is None else count(*v)
+
+
+class HeadingRegister(Register):
+    """Latest fused headingEstimate"""
+
+    def __init__(self, name=HEADING_REGISTER, create=False):
+        super().__init__(name, 'd' * len(headingEstimate._fields), create)
+
+    def read(self, maxTries=100):
+        v = super().read(maxTries)
+        return None if v is None else headingEstimate(*v)
+
+
+if __name__ == '__main__':
+    import multiprocessing
+    import time
+
+    def writer(n):
+        r = RangeRegister('lbr_test_range', create=True)
+        for i in range(n):
+            r.write({'Ranges': {s: float(i) for s in RangeRegister.sensors}, 'Timestamp': float(i)})
+        time.sleep(0.5)
+        r.close()
+
+    n = 200000
+    w = multiprocessing.Process(target=writer, args=(n,))
+    w.start()
+    time.sleep(0.2)
+
+    reader = RangeRegister('lbr_test_range')
+    reads = torn = 0
+    while w.is_alive():
+        v = reader.read()
+        if v is not None:
+            reads += 1
+            # every field of a consistent reading holds the same value
+            if len(set(v['Ranges'].values()) | {v['Timestamp']}) != 1:
+                torn += 1
+    w.join()
+    print("reads: %d, torn: %d, retries: %d, checksum errors: %d" % (
+        reads, torn, reader.retries, reader.checksumErrors))
+    reader.close()
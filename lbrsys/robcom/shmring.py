@@ -0,0 +1,222 @@
+"""
+shmring.py - Shared memory ring buffer channel for high rate sensor streams
+    A single producer writes fixed size records into a ring in shared memory,
+    and any number of consumers read them at their own pace without locks.
+    Each consumer keeps its own read position.  A consumer that falls more than
+    a ring's length behind skips ahead to the oldest record still available
+    and counts the records it lost as overruns.  The counts of records written
+    and of records too large for a slot are kept in the shared header, so any
+    process can report them, but each consumer's read position and overruns
+    are its own.
+
+    get waits for a record by polling, backing off from pollInterval to
+    maxPollInterval while the ring stays empty, so an idle consumer wakes up
+    tens of times a second rather than a thousand.
+
+    Records hold messages encoded by robcodec, so a RingBuffer can stand in for
+    a JoinableQueue in a channel.  Channels use it when their protocol is
+    'RingBuffer'.
+
+    Each slot carries its own sequence number, seqlock style, so that a consumer
+    can detect a slot being overwritten while it is reading.
+"""
+
+__author__ = "Tal G. Ball"
+__copyright__ = "Copyright (C) 2024 Tal G. Ball"
+__license__ = "Apache License, Version 2.0"
+__version__ = "1.0"
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import queue
+import struct
+import time
+from time import time as robtimer
+from multiprocessing import shared_memory
+
+from lbrsys.robcom import robcodec
+from lbrsys.robcom.shmregister import attachShared
+
+
+HEADER = struct.Struct('<QQ')     # number of records written, records dropped
+SLOT = struct.Struct('<QH')       # slot sequence, record length
+
+
+class RingBuffer:
+    capacity = 1024     # records
+    recordSize = 160    # bytes, enough for an encoded mpuData
+    pollInterval = 0.001        # s, first wait for a record
+    maxPollInterval = 0.020     # s, longest wait while the ring is empty
+
+    def __init__(self, name, capacity=None, recordSize=None, create=False):
+        self.name = name
+        if capacity is not None:
+            self.capacity = capacity
+        if recordSize is not None:
+            self.recordSize = recordSize
+        self.slotSize = SLOT.size + self.recordSize
+        self.create = create
+        self.readCount = 0
+        self.overruns = 0   # records lost by this consumer
+        self.shm = None
+
+        size = HEADER.size + self.capacity * self.slotSize
+        if create:
+            try:
+                self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+            except FileExistsError:
+                self.shm = shared_memory.SharedMemory(name)
+            self.shm.buf[:size] = bytes(size)
+        else:
+            self.shm = attachShared(name)
+
+    def __getstate__(self):
+        # processes get their own attachment and read position
+        return {'name': self.name, 'capacity': self.capacity,
+                'recordSize': self.recordSize, 'readCount': self.readCount}
+
+    def __setstate__(self, state):
+        self.__init__(state['name'], state['capacity'], state['recordSize'])
+        self.readCount = state['readCount']
+
+    def writeCount(self):
+        return HEADER.unpack_from(self.shm.buf, 0)[0]
+
+    def dropCount(self):
+        """Records too large for a slot, never written"""
+        return HEADER.unpack_from(self.shm.buf, 0)[1]
+
+    def put(self, msg, block=True, timeout=None):
+        data = robcodec.encode(msg)
+        buf = self.shm.buf
+        i, dropped = HEADER.unpack_from(buf, 0)
+        if len(data) > self.recordSize:
+            HEADER.pack_into(buf, 0, i, dropped + 1)
+            return
+
+        offset = HEADER.size + (i % self.capacity) * self.slotSize
+        SLOT.pack_into(buf, offset, 2 * i + 1, len(data))  # odd - write in progress
+        buf[offset + SLOT.size:offset + SLOT.size + len(data)] = data
+        SLOT.pack_into(buf, offset, 2 * i + 2, len(data))
+        HEADER.pack_into(buf, 0, i + 1, dropped)
+
+    put_nowait = put
+
+    def get_nowait(self):
+        buf = self.shm.buf
+        while True:
+            w = self.writeCount()
+            if self.readCount >= w:
+                raise queue.Empty
+
+            if w - self.readCount > self.capacity:
+                self.overruns += w - self.capacity - self.readCount
+                self.readCount = w - self.capacity
+
+            i = self.readCount
+            offset = HEADER.size + (i % self.capacity) * self.slotSize
+            seq, length = SLOT.unpack_from(buf, offset)
+            if seq == 2 * i + 2:
+                data = bytes(buf[offset + SLOT.size:offset + SLOT.size + length])
+                if SLOT.unpack_from(buf, offset)[0] == seq:
+                    self.readCount += 1
+                    return robcodec.decode(data)
+
+            # the producer lapped this consumer during the read
+            self.overruns += 1
+            self.readCount += 1
+
+    def get(self, block=True, timeout=None):
+        if not block:
+            return self.get_nowait()
+
+        t0 = robtimer()
+        interval = self.pollInterval
+        while True:
+            try:
+                return self.get_nowait()
+            except queue.Empty:
+                if timeout is not None and robtimer() - t0 >= timeout:
+                    raise
+                time.sleep(interval)
+                interval = min(interval * 2., self.maxPollInterval)
+
+    def empty(self):
+        return self.readCount >= self.writeCount()
+
+    def qsize(self):
+        return min(self.writeCount() - self.readCount, self.capacity)
+
+    def task_done(self):
+        pass
+
+    def join(self):
+        pass
+
+    def stats(self):
+        """The shared counts, and this consumer's reads and overruns"""
+        return {'name': self.name, 'written': self.writeCount(), 'dropped': self.dropCount(),
+                'read': self.readCount, 'overruns': self.overruns}
+
+    def sharedStats(self):
+        """The counts kept in the ring itself, the same from any process"""
+        return {'name': self.name, 'written': self.writeCount(), 'dropped': self.dropCount()}
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            if self.create:
+                try:
+                    self.shm.unlink()
+                except FileNotFoundError:
+                    pass
+            self.shm = None
+
+
+if __name__ == '__main__':
+    import multiprocessing
+    from lbrsys import gyro
+
+    def producer(ring, n, rate):
+        for i in range(n):
+            ring.put(gyro(0., 0., float(i), robtimer()))
+            time.sleep(1. / rate)
+        ring.put('Shutdown')
+
+    def consumer(ring, delay, results):
+        n = 0
+        while True:
+            msg = ring.get()
+            if msg == 'Shutdown':
+                break
+            n += 1
+            time.sleep(delay)  # a slow consumer
+        results.put((delay, n, ring.overruns))
+
+    ring = RingBuffer('lbr_test_ring', capacity=64, create=True)
+    results = multiprocessing.Queue()
+    consumers = [multiprocessing.Process(target=consumer, args=(ring, d, results))
+                 for d in (0., 0.004, 0.010)]
+    for c in consumers:
+        c.start()
+
+    n = 1000
+    t0 = robtimer()
+    producer(ring, n, 200)
+    print("produced %d records at %.0fHz" % (n, n / (robtimer() - t0)))
+    for c in consumers:
+        c.join()
+    while not results.empty():
+        print("consumer delay %.3fs: read %d, overruns %d" % results.get())
+    ring.close()
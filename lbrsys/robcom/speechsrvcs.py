@@ -30,7 +30,7 @@ import queue
 from datetime import datetime
 
 from lbrsys.settings import SPEECH_SERVICE, AUDIO_DIR, speechLogFile
-from lbrsys import speech
+from lbrsys import speech, ready
 
 if SPEECH_SERVICE == 'aws_polly':
     from robcom import robttspolly as robtts
@@ -58,6 +58,7 @@ class SpeechService:
         startmsg = "\n\n%s: Starting Speech Operations" % (ta,)
         #print startmsg
         logging.debug(startmsg)
+        self.broadcastQ.put(ready(multiprocessing.current_process().name, robtimer()))
         self.start()
 
 
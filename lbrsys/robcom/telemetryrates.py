@@ -0,0 +1,106 @@
+"""
+telemetryrates.py - telemetry report rates negotiated by subscription
+    Consumers ask for the rate they need for a telemetry key by sending a
+    telemetryRate(subscriber, key, rate) message, rate in Hz, 0 to
+    unsubscribe.  Each producer keeps a RateSubscriptions and reports a key at
+    the highest rate any subscriber wants, or at the key's floor rate when
+    nobody is subscribed.  Subscriptions expire after ttl seconds unless
+    renewed, so a consumer that goes away doesn't hold a rate up.
+"""
+
+__author__ = "Tal G. Ball"
+__copyright__ = "Copyright (C) 2024 Tal G. Ball"
+__license__ = "Apache License, Version 2.0"
+__version__ = "1.0"
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+from time import time as robtimer
+
+from lbrsys.settings import TELEMETRY_FLOOR_RATES, TELEMETRY_SUBSCRIPTION_TTL
+
+
+class RateSubscriptions:
+    defaultFloor = 0.1      # Hz, for keys without a configured floor
+    expireInterval = 1.     # s between sweeps for expired subscriptions
+
+    def __init__(self, floors=None, ttl=TELEMETRY_SUBSCRIPTION_TTL):
+        self.floors = dict(TELEMETRY_FLOOR_RATES if floors is None else floors)
+        self.ttl = ttl
+        self.subscriptions = {}     # key: {subscriber: (rate, time)}
+        self.rates = {}             # key: current rate
+        self.lastExpire = robtimer()
+
+    def subscribe(self, msg):
+        """Apply a telemetryRate message. Returns True if the key's rate changed."""
+        subscribers = self.subscriptions.setdefault(msg.key, {})
+        if msg.rate > 0:
+            subscribers[msg.subscriber] = (msg.rate, robtimer())
+        else:
+            subscribers.pop(msg.subscriber, None)
+        return self.update(msg.key)
+
+    def update(self, key):
+        subscribers = self.subscriptions.get(key, {})
+        floor = self.floors.get(key, self.defaultFloor)
+        rate = max([floor] + [r for r, t in subscribers.values()])
+        changed = rate != self.rates.get(key, floor)
+        self.rates[key] = rate
+        return changed
+
+    def expire(self):
+        """Drop subscriptions that weren't renewed in time. Returns the keys whose rates changed."""
+        now = robtimer()
+        self.lastExpire = now
+        changed = []
+        for key, subscribers in self.subscriptions.items():
+            for subscriber, (rate, t) in list(subscribers.items()):
+                if now - t > self.ttl:
+                    del subscribers[subscriber]
+            if self.update(key):
+                changed.append(key)
+        return changed
+
+    def rate(self, key):
+        if robtimer() - self.lastExpire >= self.expireInterval:
+            self.expire()
+        return self.rates.get(key, self.floors.get(key, self.defaultFloor))
+
+    def subscribed(self, key):
+        """True if anyone is subscribed to key"""
+        self.rate(key)
+        return bool(self.subscriptions.get(key))
+
+    def interval(self, key):
+        """Seconds between reports of key"""
+        return 1. / self.rate(key)
+
+    def stats(self):
+        return {key: {'rate': self.rate(key), 'subscribers': {s: r for s, (r, t) in subs.items()}}
+                for key, subs in self.subscriptions.items()}
+
+
+if __name__ == '__main__':
+    from lbrsys import telemetryRate
+
+    r = RateSubscriptions({'Ranges': 0.1}, ttl=0.5)
+    print("idle Ranges interval: %.1fs" % (r.interval('Ranges'),))
+    r.subscribe(telemetryRate('http', 'Ranges', 2.))
+    r.subscribe(telemetryRate('fsm', 'Ranges', 5.))
+    print("subscribed: %.1fs" % (r.interval('Ranges'),))
+    r.subscribe(telemetryRate('fsm', 'Ranges', 0))
+    print("fsm unsubscribed: %.1fs" % (r.interval('Ranges'),))
+    import time
+    time.sleep(0.6)
+    print("expired: changed %s, %.1fs" % (r.expire(), r.interval('Ranges')))
@@ -25,21 +25,15 @@ from dataclasses import dataclass, field
 from typing import List, Any
 
 from lbrsys.settings import robot_name, dbfile
+from lbrsys.robexec import robconfig
 
 
 def load_calibrations():
     calibrations = []
     try:
-        with sqlite3.connect(dbfile) as con:
-            con.row_factory = sqlite3.Row
-            cursor = con.cursor()
-            calibration_records = cursor.execute(
-                "SELECT * FROM calibration \
-                JOIN robot ON calibration.robot_id=robot.robot_id \
-                WHERE robot.name=?", (robot_name,))
-
-            calibrations = [CalibrationSetting(c['robot_id'], c['name'], c['value'], c['id'])
-                            for c in calibration_records]
+        # the snapshot is reread when the database changes, e.g. after a save
+        calibrations = [CalibrationSetting(c['robot_id'], c['name'], c['value'], c['id'])
+                        for c in robconfig.snapshot(dbfile, robot_name)['calibrations']]
 
     except Exception as e:
         print(f"Error loading calibrations: {e}")
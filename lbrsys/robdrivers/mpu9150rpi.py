@@ -12,6 +12,16 @@ Driver for InvenSense mpu9150 9 axis motion processor
     for soft iron distoritions requires an expression to be developed, as opposed to
     constants.  The function MPU9150_A.adjustIron would need an update to implement
     soft iron compensation.
+
+    With fifo enabled, the MPU9150 samples accel, temperature and gyro into its
+    on-chip FIFO at fifoRate, and readFifo drains it in bulk block reads and
+    decodes all of the samples at once, so none are lost between reads.  A
+    batched caller, such as mpbatch's BatchSampler, takes the samples from
+    readFifo.  read, for callers that want one reading per call, returns the
+    mean of the samples drained since the last read, so the FIFO still
+    averages out noise between reads rather than having all but its newest
+    sample thrown away.
+    Run with --fake to test against a simulated device on a fake smbus.
 """
 
 __author__ = "Tal G. Ball"
@@ -34,7 +44,10 @@ __version__ = "1.0"
 
 import os
 if os.uname()[0] == 'Linux':
-    import smbus
+    try:
+        import smbus
+    except ImportError:
+        smbus = None    # a bus must then be passed to MPU9150_A, e.g. FakeSMBus
 else:
     print(("Unsupported OS: %s" % str(os.uname())))
     raise Exception()
@@ -46,11 +59,17 @@ import time
 from time import time as robtimer # legacy naming issue
 
 from math import *
+import numpy as np
 from robcom import publisher
 
 from lbrsys import robot_id, gyro, accel, mag, mpuData
 from lbrsys.settings import LOG_DIR
 from lbrsys.settings import MPU9150_ADDRESS # typically 0x68
+try:
+    from lbrsys.settings import MPU9150_FIFO, MPU9150_FIFO_RATE
+except ImportError:
+    MPU9150_FIFO = False
+    MPU9150_FIFO_RATE = 200.
 from lbrsys.settings import X_Convention, Y_Convention, Z_Convention
 from lbrsys.settings import magCalibrationLogFile
 from robdrivers.calibration import Calibration, CalibrationSetting
@@ -61,6 +80,9 @@ POWER_MGMT_1        = 0x6b
 GYRO_CONFIG         = 0x1b
 ACCEL_CONFIG        = 0x1c
 SAMPLE_RATE_DIVIDER = 0x19
+CONFIG              = 0x1a  # bits 0-2 DLPF_CFG, 1 for 184Hz bandwidth at a 1kHz gyro rate
+FIFO_EN             = 0x23  # bit 7 temp, bits 6-4 gyro x, y, z, bit 3 accel
+INT_STATUS          = 0x3a  # bit 4 is FIFO_OFLOW_INT, cleared by reading
 READINGS_START_REG  = 0x3b
 READINGS_LEN        = 22
 INT_PIN_CFG         = 0x37  # bit 1 is i2c_BYPASS_EN (set for host access)
@@ -69,6 +91,23 @@ MAG                 = 0x25
 MAG_REGISTER        = 0x26
 MAG_CTRL            = 0x27  # bit 7 is enable, bits 0-4 length
 WRITE_TO_MAG        = 0x63
+FIFO_COUNTH         = 0x72  # then FIFO_COUNTL
+FIFO_R_W            = 0x74
+
+USER_CTRL_FIFO_EN   = 0x40
+USER_CTRL_FIFO_RST  = 0x04
+FIFO_OFLOW_INT      = 0x10
+FIFO_SENSORS        = 0xf8  # accel, temp and gyro, stored in register order
+FIFO_SAMPLE_LEN     = 14    # bytes
+FIFO_SIZE           = 1024  # bytes
+FIFO_CHUNK          = 28    # smbus block reads are limited to 32 bytes, so 2 samples at a time
+GYRO_RATE           = 1000. # Hz with the DLPF enabled
+
+# decoded FIFO samples in standard units
+FIFO_DTYPE = np.dtype([('time', 'f8'),
+                       ('ax', 'f8'), ('ay', 'f8'), ('az', 'f8'),
+                       ('temp', 'f8'),
+                       ('gx', 'f8'), ('gy', 'f8'), ('gz', 'f8')])
 
 # slave registers
 MAG_WAI             = 0x00  # device id fixed at 0x48
@@ -82,7 +121,7 @@ MAG_CNTL            = 0x0A  # set to 1 for a single measurement
 
 
 class MPU9150_A:
-    bus = smbus.SMBus(1)
+    bus = None  # shared smbus.SMBus(1), opened by the first instance
 
     #timeout        = 0 #non-blocking mode
     zeroGyroResult  = gyro(0.0,0.0,0.0,0.0)
@@ -97,9 +136,13 @@ class MPU9150_A:
 
 
     # def __init__(self, port=MPU9150_ADDRESS, hix=-17.9244, hiy=-15.01645):
-    def __init__(self, port=MPU9150_ADDRESS):
+    def __init__(self, port=MPU9150_ADDRESS, bus=None, fifo=MPU9150_FIFO, fifoRate=MPU9150_FIFO_RATE):
 
         self.port = port
+        if bus is not None:
+            self.bus = bus
+        elif MPU9150_A.bus is None:
+            MPU9150_A.bus = smbus.SMBus(1)
         # hard iron offsets in uT measured on 2019-01-28 for lbr2a
         # for an untested device, set the default values to
         # hix = 0, hiy = 0
@@ -146,6 +189,13 @@ class MPU9150_A:
         self.unitConTime = 0
         self.numReads    = 0
 
+        self.fifo           = fifo
+        self.fifoDivider    = max(int(round(GYRO_RATE / fifoRate)) - 1, 0)
+        self.fifoPeriod     = (self.fifoDivider + 1) / GYRO_RATE
+        self.fifoCapacity   = FIFO_SIZE // FIFO_SAMPLE_LEN
+        self.fifoStats      = {'drains': 0, 'samples': 0, 'blockReads': 0,
+                               'overflows': 0, 'decodeTime': 0.}
+
         self.setup()
 
     def setup(self):
@@ -188,6 +238,9 @@ class MPU9150_A:
             # queue up the first sensor run
             self.bus.write_byte_data(self.mag, MAG_CNTL, 0x01)
 
+            if self.fifo:
+                self.setupFifo()
+
         except:
             print("Unexpected error initializing MPU:", sys.exc_info()[0])
             raise  
@@ -200,6 +253,18 @@ class MPU9150_A:
         #todo set accel range
 
 
+    def setupFifo(self):
+        """Sample accel, temp and gyro into the FIFO at 1kHz / (1 + fifoDivider)"""
+        self.bus.write_byte_data(self.mpu, CONFIG, 0x01)
+        self.bus.write_byte_data(self.mpu, SAMPLE_RATE_DIVIDER, self.fifoDivider)
+        self.bus.write_byte_data(self.mpu, FIFO_EN, FIFO_SENSORS)
+        self.resetFifo()
+
+    def resetFifo(self):
+        # keep bypass mode, USER_CTRL i2c_MST_EN stays clear
+        self.bus.write_byte_data(self.mpu, USER_CTRL, USER_CTRL_FIFO_RST)
+        self.bus.write_byte_data(self.mpu, USER_CTRL, USER_CTRL_FIFO_EN)
+
     def reset(self):
         self.close()
         self.read_errors = 0
@@ -317,6 +382,12 @@ class MPU9150_A:
             slave mode easier, should the need arise.)
         """
 
+        if self.fifo and self.mpu_enabled:
+            # the mean of the samples since the last read, or the previous
+            #   reading if none has arrived since
+            self.readFifo(average=True)
+            return self.lastsu
+
         if not self.mpu_enabled:
             return self.mpusu_zero
 
@@ -361,6 +432,98 @@ class MPU9150_A:
 
         return mpusu
 
+    def readFifo(self, average=False):
+        """
+        Drain the FIFO in block reads and decode all of its samples at once.
+        Returns a FIFO_DTYPE array, oldest sample first, and publishes the newest
+        sample, or with average the mean of the samples, with the latest
+        magnetometer reading, as the current reading.
+
+        The FIFO doesn't timestamp samples, so they are spaced fifoPeriod apart,
+        back from the time of the drain.  If the FIFO overflowed, sample boundaries
+        are lost, so it is reset and the drain returns no samples.
+        """
+
+        if not self.mpu_enabled:
+            return np.zeros(0, dtype=FIFO_DTYPE)
+
+        if self.read_errors > self.error_limit:
+            print("Resetting MPU due to excessive read errors")
+            self.reset()
+            return np.zeros(0, dtype=FIFO_DTYPE)
+
+        data = bytearray()
+        try:
+            if self.bus.read_byte_data(self.mpu, INT_STATUS) & FIFO_OFLOW_INT:
+                self.fifoStats['overflows'] += 1
+                self.resetFifo()
+                return np.zeros(0, dtype=FIFO_DTYPE)
+
+            counth, countl = self.bus.read_i2c_block_data(self.mpu, FIFO_COUNTH, 2)
+            remaining = (counth << 8 | countl) // FIFO_SAMPLE_LEN * FIFO_SAMPLE_LEN
+            while remaining > 0:
+                chunk = min(FIFO_CHUNK, remaining)
+                data += bytes(self.bus.read_i2c_block_data(self.mpu, FIFO_R_W, chunk))
+                remaining -= chunk
+                self.fifoStats['blockReads'] += 1
+        except IOError:
+            self.read_errors += 1
+            print("Unexpected MPU FIFO read error:", sys.exc_info()[0])
+            self.resetFifo()
+            return np.zeros(0, dtype=FIFO_DTYPE)
+
+        t = robtimer()
+        t0 = time.process_time()
+        samples = self.decodeFifo(data, t)
+        n = len(samples)
+        self.fifoStats['drains'] += 1
+        self.fifoStats['samples'] += n
+        self.fifoStats['decodeTime'] += time.process_time() - t0
+
+        if n > 0:
+            if average:
+                s = {name: samples[name].mean() for name in FIFO_DTYPE.names}
+                s = {name: round(float(v), 4 if name[0] == 'a' else 3) for name, v in s.items()}
+                s['temp'] = round(s['temp'], 1)
+            else:
+                s = samples[-1]
+            m = self.zeroMagResult
+            try:
+                m = self.readMagnetometer()
+            except Exception:
+                self.read_errors += 1
+                print("Magnetometer exception", sys.exc_info()[0])
+            mpusu = mpuData(gyro(float(s['gx']), float(s['gy']), float(s['gz']), round(t, 4)),
+                            accel(float(s['ax']), float(s['ay']), float(s['az'])),
+                            m, round(self.calcHeading(m), 2), float(s['temp']), round(t, 4))
+            self.mpuPub.publish(mpusu)
+            self.gyroPub.publish(mpusu.gyro)
+            self.lastsu = mpusu
+            self.numReads += n
+
+        return samples
+
+    def decodeFifo(self, data, t):
+        """Big endian accel, temp and gyro samples to a FIFO_DTYPE array in standard units"""
+        raw = np.frombuffer(bytes(data), dtype='>i2').reshape(-1, FIFO_SAMPLE_LEN // 2)
+        n = len(raw)
+        samples = np.empty(n, dtype=FIFO_DTYPE)
+        samples['time'] = np.round(t - self.fifoPeriod * np.arange(n - 1, -1, -1), 4)
+
+        a = np.round(raw[:, 0:3] / 16384., 4)
+        samples['ax'], samples['ay'], samples['az'] = a.T
+        samples['temp'] = np.round(raw[:, 3] / 340. + 35, 1)
+
+        cal = self.gyroCalibration
+        g = (raw[:, 4:7] / 131. - (cal.x, cal.y, cal.z)) * (X_Convention, Y_Convention, Z_Convention)
+        g[np.abs(g) < self.gyroSquelch] = 0.0
+        samples['gx'], samples['gy'], samples['gz'] = np.round(g, 3).T
+        return samples
+
+    def getStats(self):
+        return {'reads': self.numReads, 'readErrors': self.read_errors,
+                'fifo': dict(self.fifoStats)}
+
     def twos_comp(self, val, bits=16):
         """compute the 2's complement of int value val"""
         if (val & (1 << (bits - 1))) != 0:  # if sign bit is set e.g., 8bit: 128-255
@@ -463,7 +626,19 @@ class MPU9150_A:
             heading = -1
         '''
         # This version of the algorithm does not tilt compensate
+        heading = self.calcHeading(m)
+
+        #print 'heading: %.0f' % heading
+        su = mpuData(g, a, m, round(heading,2), temperature, round(t,4))
 
+        deltat = robtimer()-t0
+        self.unitConTime += deltat
+        
+        return su
+
+
+    def calcHeading(self, m):
+        """Compass heading from a magnetometer reading, without tilt compensation"""
         heading = -1
         if m.y == 0:
             if m.x <= 0:
@@ -477,14 +652,7 @@ class MPU9150_A:
                 heading = round((270. + rawAngle), 0)
             else:
                 heading = round((90. + rawAngle), 0)
-
-        #print 'heading: %.0f' % heading
-        su = mpuData(g, a, m, round(heading,2), temperature, round(t,4))
-
-        deltat = robtimer()-t0
-        self.unitConTime += deltat
-        
-        return su
+        return heading
 
 
     def calibrateGyro(self):
@@ -625,7 +793,134 @@ class MPU9150_A:
             print(msg)
 
 
-if __name__ == '__main__':
+class FakeSMBus:
+    """
+    Stand in for the i2c bus with a simulated MPU9150 and magnetometer.  The
+    device fills its FIFO at the configured sample rate as time passes, turning
+    at turnRate deg/s about z, and overflows like the real one if not drained.
+    """
+    def __init__(self, turnRate=0.):
+        self.turnRate = turnRate
+        self.regs = {}
+        self.fifo = bytearray()
+        self.lastFill = robtimer()
+        self.generated = 0
+        self.transactions = 0
+
+    def sampleRate(self):
+        gyroRate = GYRO_RATE if self.regs.get(CONFIG, 0) & 0x07 else 8000.
+        return gyroRate / (1 + self.regs.get(SAMPLE_RATE_DIVIDER, 0))
+
+    def fill(self):
+        now = robtimer()
+        enabled = self.regs.get(USER_CTRL, 0) & USER_CTRL_FIFO_EN and self.regs.get(FIFO_EN)
+        n = int((now - self.lastFill) * self.sampleRate())
+        if not enabled or n == 0:
+            if not enabled:
+                self.lastFill = now
+            return
+        self.lastFill += n / self.sampleRate()
+        sample = np.array([0, 0, 16384, 0, 0, 0, int(self.turnRate * 131.)], dtype='>i2').tobytes()
+        for i in range(n):
+            if len(self.fifo) + FIFO_SAMPLE_LEN > FIFO_SIZE:
+                # the oldest byte is overwritten, so samples no longer line up
+                self.regs[INT_STATUS] = self.regs.get(INT_STATUS, 0) | FIFO_OFLOW_INT
+                del self.fifo[:FIFO_SAMPLE_LEN + 1]
+            self.fifo += sample
+            self.generated += 1
+
+    def write_byte_data(self, addr, reg, value):
+        self.transactions += 1
+        if addr == MPU9150_ADDRESS and reg == USER_CTRL and value & USER_CTRL_FIFO_RST:
+            self.fifo = bytearray()
+            self.lastFill = robtimer()
+            value &= ~USER_CTRL_FIFO_RST
+        self.regs[reg] = value
+
+    def read_byte_data(self, addr, reg):
+        self.transactions += 1
+        if addr == MAG_ADDRESS:
+            return {MAG_STATUS1: 1, MAG_CNTL: 0}.get(reg, 0)
+        if reg == INT_STATUS:
+            self.fill()
+            status = self.regs.get(INT_STATUS, 0)
+            self.regs[INT_STATUS] = 0
+            return status
+        return self.regs.get(reg, 0)
+
+    def read_i2c_block_data(self, addr, reg, length):
+        self.transactions += 1
+        if addr == MAG_ADDRESS:
+            if reg == MAG_SENS_ADJ:
+                return [128] * length
+            return list(np.array([200, 0, -100], dtype='<i2').tobytes()) + [0]
+        if reg == FIFO_COUNTH:
+            self.fill()
+            return [len(self.fifo) >> 8, len(self.fifo) & 0xff]
+        if reg == FIFO_R_W:
+            data, self.fifo = self.fifo[:length], self.fifo[length:]
+            return list(data)
+        # one sample's registers, for the non-FIFO read
+        return list(np.array([0, 0, 16384, 0, 0, 0, int(self.turnRate * 131.)], dtype='>i2').tobytes()) + \
+               [0] * (length - FIFO_SAMPLE_LEN)
+
+
+def testFifo(seconds=2., loopTime=0.100):
+    """Compare per sample reads with FIFO drains from a loop that runs every loopTime"""
+    for fifo in (False, True):
+        bus = FakeSMBus()
+        mpu = MPU9150_A(bus=bus, fifo=fifo)
+        bus.turnRate = 45.
+        bus.transactions = 0
+        mpu.fifoStats.update(drains=0, samples=0, blockReads=0, decodeTime=0.)
+        generated = bus.generated
+        samples = 0
+        angle = 0.
+        cpu = 0.
+        t0 = robtimer()
+        while robtimer() - t0 < seconds:
+            c0 = time.process_time()
+            if fifo:
+                s = mpu.readFifo()
+                samples += len(s)
+                angle += s['gz'].sum() * mpu.fifoPeriod
+            else:
+                r = mpu.read()
+                samples += 1
+                angle += r.gyro.z * loopTime
+            cpu += time.process_time() - c0
+            time.sleep(loopTime)
+        elapsed = robtimer() - t0
+        print("%s: %d samples in %.2fs, %d of %d produced by the device, "
+              "%.1f bus transactions/s, %.1fus cpu/sample, integrated %.1f deg" % (
+                  'fifo' if fifo else 'per sample', samples, elapsed,
+                  samples, bus.generated - generated if fifo else elapsed / mpu.fifoPeriod,
+                  bus.transactions / elapsed, cpu / max(samples, 1) * 1e6, angle))
+        if fifo:
+            # one averaged reading per loop, as MPservice reads without batching
+            samples0 = mpu.fifoStats['samples']
+            angle = 0.
+            t0 = robtimer()
+            while robtimer() - t0 < seconds:
+                angle += mpu.read().gyro.z * loopTime
+                time.sleep(loopTime)
+            print("    fifo read(): %d samples averaged into %d readings, integrated %.1f deg" % (
+                mpu.fifoStats['samples'] - samples0, int(round(seconds / loopTime)), angle))
+        if fifo:
+            stats = mpu.fifoStats
+            print("    fifo stats: %s, decode %.2fus/sample" % (
+                stats, stats['decodeTime'] / max(stats['samples'], 1) * 1e6))
+            time.sleep(0.5)
+            mpu.readFifo()
+            print("    after a 0.5s stall: overflows %d" % (mpu.fifoStats['overflows'],))
+        mpu.close()
+
+
+if __name__ == '__main__' and '--fake' in sys.argv:
+    # python mpu9150rpi.py --fake to test FIFO reads against a simulated device
+    testFifo()
+
+elif __name__ == '__main__':
     mpu = MPU9150_A() # note: can optionally pass a port name to the constructor
     # k = input("Press return to continue")
     rl = []
@@ -53,6 +53,7 @@ class P8X32:
     stopbits = serial.STOPBITS_ONE
     timeout = 1 #second
     #timeout = 0 #non-blocking mode
+    ackTimeout = 3. #seconds to wait for the mcu to acknowledge the ranging command
 
     buffer = '' #keeping a copy for various debug purposes
     defaultRangeLine = b'{"Ranges":{"Forward":-1,"Bottom":-1,"Left":-1,"Right":-1,"Back":-1,"Deltat":0}}'
@@ -77,6 +78,16 @@ class P8X32:
         # Enable ranging - Introduced for lbr6, where arduino is controlling ranging.
         #  todo Needs testing on lbr2a, where parallax controller does not range if port not open)
         self.controller.write("g\n".encode())
+        self.acked = self.waitForAck(b"received: g")
+
+    def waitForAck(self, ack):
+        """Read lines until the mcu acknowledges a command, skipping any range lines"""
+        t0 = time.time()
+        while time.time() - t0 < self.ackTimeout:
+            line = self.controller.readline()
+            if line.strip() == ack:
+                return True
+        return False
 
     def flush(self):
         self.controller.flushInput()
@@ -4,6 +4,20 @@
         For this driver, importing PyRoboteq package, which is still under development
         as noted on its pypi.org page.  todo investigate why partial resulsts from RIOX
         are sometimes returned, resulting in driver read errors.  Ignored for now.
+
+    Once connected, serial I/O goes through a SerialTransport (see serialio.py).
+    read_mems writes the AHRS quaternion query and the MEMS query back to back
+    and then waits for both replies, so a sample costs one round trip instead of
+    two.  The AHRS is only queried at ahrsRate, independent of the MEMS rate.
+    In streaming mode, the RIOX repeats the MEMS query on its own at memsRate.
+    streamLine queues the streamed lines, and read_mems parses the newest one
+    on the caller's thread, so each streamed reading is returned at most once
+    and a caller slower than the stream, such as MPservice's 10Hz loop, never
+    falls behind it.  The readings passed over are counted as skipped.  When
+    no new reading arrives within about a stream interval, read_mems returns
+    mpusu_none, whose gyro z is None, so callers skip it as a bad reading
+    instead of filtering the previous reading again.  getStats reports the
+    read error counters.
 """
 
 
@@ -27,10 +41,12 @@ __version__ = "1.0"
 import os
 import sys
 import time
+import queue
 from math import *
 import logging
 import numpy as np
 import PyRoboteq
+from serial import SerialException
 
 from pyquaternion import Quaternion
 
@@ -40,10 +56,17 @@ from lbrsys.settings import LOG_DIR
 from lbrsys.settings import X_Convention, Y_Convention, Z_Convention
 from lbrsys.settings import magCalibrationLogFile
 from lbrsys.settings import RIOX_1216AHRS_Port
+try:
+    from lbrsys.settings import RIOX_STREAMING, RIOX_MEMS_RATE, RIOX_AHRS_RATE
+except ImportError:
+    RIOX_STREAMING = False
+    RIOX_MEMS_RATE = 10.
+    RIOX_AHRS_RATE = 10.
 
 from lbrsys.robdrivers.calibration import Calibration, CalibrationSetting
 from lbrsys.robdrivers.magcal import get_samples, make_plot, get_mag_corrections, save_samples
 from lbrsys.robdrivers.magcal import Magcal
+from lbrsys.robdrivers import serialio
 
 # Commands for RIOX not covered by PyRoboteq, as it was designed for a motor controller
 READ_ALL_MEMS = '?ML'
@@ -57,10 +80,19 @@ class RIOX(PyRoboteq.RoboteqHandler):
     zeroMagResult = mag(0.0,0.0,0.0)
     defaultQuaternion = Quaternion()
     defaultEuler = euler(0., 0., 0.)
+    timeout = 0.250
+    streamBacklog = 10      # streamed readings queued between reads, older ones are dropped
 
-    def __init__(self, port=RIOX_1216AHRS_Port):
+    def __init__(self, port=RIOX_1216AHRS_Port, memsRate=RIOX_MEMS_RATE,
+                 ahrsRate=RIOX_AHRS_RATE, streaming=RIOX_STREAMING):
         super(RIOX, self).__init__(debug_mode=False, exit_on_interrupt=False)
         self.port = port
+        self.memsRate = memsRate        # Hz of streamed MEMS readings
+        self.ahrsInterval = 1. / ahrsRate
+        self.lastAhrsTime = 0.
+        self.pendingAhrs = None         # Future for the AHRS query's reply
+        self.errorStats = {'malformed': 0, 'valueErrors': 0, 'noReply': 0,
+                           'ahrsErrors': 0, 'serialErrors': 0}
 
         # self.hix = -34.35
         # self.hiy = -8.85
@@ -108,6 +140,12 @@ class RIOX(PyRoboteq.RoboteqHandler):
                                   self.zeroMagResult,
                                   0., 0., 0.,
                                   self.defaultQuaternion, 0.)
+        # no new reading
+        self.mpusu_none = mpuData(gyro(None, None, None, 0.),
+                                  self.zeroAccelResult,
+                                  self.zeroMagResult,
+                                  0., 0., 0.,
+                                  self.defaultQuaternion, 0.)
 
         self.lastRawAngle = -1
         self.unitConTime = 0
@@ -134,6 +172,64 @@ class RIOX(PyRoboteq.RoboteqHandler):
             print(f"Error connecting to RIOX on {port}")
             raise e
 
+        self.transport = None
+        if self.connected:
+            self.transport = serialio.SerialTransport(self.ser, self.timeout,
+                                                      unsolicited=self.unsolicitedLine,
+                                                      name="RIOX Serial I/O")
+        else:
+            self.mpu_enabled = False
+
+        self.streaming = False
+        self.streamInterval = 1. / self.memsRate
+        self.streamQ = queue.Queue(self.streamBacklog)     # (line, time received)
+        self.streamStats = {'lines': 0, 'mems': 0, 'unparsed': 0, 'dropped': 0,
+                            'skipped': 0, 'noSample': 0}
+        if streaming and self.connected:
+            self.startStreaming()
+
+    def startStreaming(self, memsRate=None):
+        """Have the RIOX repeat the MEMS query every 1/memsRate seconds"""
+        if self.streaming:
+            return
+        self.streaming = True
+        self.streamInterval = 1. / (memsRate or self.memsRate)
+        # clear the query history, then set it and its repeat rate
+        self.transport.write(b'# C_%s_# %d\r' % (READ_ALL_MEMS.encode(),
+                                                 int(round(self.streamInterval * 1000.))))
+
+    def stopStreaming(self):
+        if not self.streaming:
+            return
+        self.transport.write(b'# C\r').result(self.timeout)
+        self.streaming = False
+
+    def unsolicitedLine(self, line):
+        """Lines that answer no request: the stream, or late replies"""
+        if self.streaming:
+            self.streamLine(line)
+        else:
+            logging.debug("RIOX unsolicited: %s" % (line,))
+
+    def streamLine(self, line):
+        """Queue one streamed MEMS reading for read_mems, on the transport's thread"""
+        self.streamStats['lines'] += 1
+        line = line.decode(errors='replace').strip()
+        if not line.startswith(READ_ALL_MEMS[1:] + '='):
+            self.streamStats['unparsed'] += 1
+            return
+        self.streamStats['mems'] += 1
+        try:
+            self.streamQ.put_nowait((line, time.time()))
+        except queue.Full:
+            # the caller has fallen behind, so keep the newest readings
+            try:
+                self.streamQ.get_nowait()
+                self.streamStats['dropped'] += 1
+            except queue.Empty:
+                pass
+            self.streamQ.put_nowait((line, time.time()))
+
     def read(self):
         if self.mems_enabled:
             return self.read_mems()
@@ -147,54 +243,108 @@ class RIOX(PyRoboteq.RoboteqHandler):
         if not self.mpu_enabled:
             return self.mpusu_zero
 
-        if self.ahrs_enabled:
-            # mpuData does not currently support 'Euler, even though read_ahrs does'
-            self.current_quaternion = self.read_ahrs(units='Quaternion')
-        else:
-            self.current_quaternion = self.defaultQuaternion
-
-        mems = self.read_value(READ_ALL_MEMS)
+        if self.streaming:
+            # the MEMS reading is streamed, so only the AHRS is queried here
+            self.requestAhrs()
+            self.collectAhrs(wait=False)
+            try:
+                # allow for jitter in the stream before reporting no new reading
+                line, t = self.streamQ.get(timeout=self.streamInterval * 1.5)
+            except queue.Empty:
+                self.streamStats['noSample'] += 1
+                return self.mpusu_none
+            # use the newest reading, so a slow caller doesn't fall behind the stream
+            while True:
+                try:
+                    line, t = self.streamQ.get_nowait()
+                except queue.Empty:
+                    break
+                self.streamStats['skipped'] += 1
+            mpusu = self.parseMems(line, t)
+            return mpusu if mpusu is not None else self.mpusu_none
+
+        # write both queries before waiting for either reply
+        self.requestAhrs()
+        mems = self.transport.request(READ_ALL_MEMS.encode() + b'\r')
+        self.collectAhrs(wait=True)
+        try:
+            reply = mems.result()
+        except SerialException:
+            self.errorStats['serialErrors'] += 1
+            self.read_errors += 1
+            return self.lastsu
         t = time.time()
-        # print(mems)
-
-        if mems.startswith(READ_ALL_MEMS[1:]):
-            lsb = mems[len(READ_ALL_MEMS):].split(':')
-            if len(lsb) != 10:
-                self.read_errors += 1
-                # print(f"Malformed mpu read: {mems}", file=sys.stderr)
-                return self.lastsu
 
-            try:
-                lsb = list(map(lambda x: int(x), lsb))
-            except ValueError as e:
-                self.read_errors += 1
-                print(f"ValueError: {e}", file=sys.stderr)
-                return self.lastsu
+        if reply is None:
+            self.errorStats['noReply'] += 1
+            self.read_errors += 1
+            return self.lastsu
 
-            lsb += (t,)
-            # print(f"lsb = {lsb}", file=sys.stderr)
+        mpusu = self.parseMems(reply.decode(errors='replace').strip(), t)
+        return mpusu if mpusu is not None else self.lastsu
 
-            mpusu = self.lsb2su(lsb)
-            # print(f"mpusu = {mpusu}", file=sys.stderr)
+    def parseMems(self, mems, t):
+        """Publish and return the reading in a MEMS reply, or None if it's malformed"""
+        if not mems.startswith(READ_ALL_MEMS[1:]):
+            self.errorStats['malformed'] += 1
+            self.read_errors += 1
+            # print(f"Malformed mpu read: {mems}", file=sys.stderr)
+            return None
 
-            self.mpuPub.publish(mpusu)
-            self.gyroPub.publish(mpusu.gyro) # publish separately for legacy reasons..
-            self.lastsu = mpusu
+        lsb = mems[len(READ_ALL_MEMS):].split(':')
+        if len(lsb) != 10:
+            self.errorStats['malformed'] += 1
+            self.read_errors += 1
+            return None
 
-            self.numReads += 1
-        else:
+        try:
+            lsb = list(map(lambda x: int(x), lsb))
+        except ValueError as e:
+            self.errorStats['valueErrors'] += 1
             self.read_errors += 1
-            if self.read_errors > self.error_limit:
-                pass
-                # print("Resetting MPU due to excessive read errors")
-                # self.reset()
-                # print(f"MPU errors:{self.read_errors}, limit: {self.error_limit}", file=sys.stderr)
-                # print(f"\t{mems}", file=sys.stderr)
+            print(f"ValueError: {e}", file=sys.stderr)
+            return None
+
+        lsb += (t,)
+        # print(f"lsb = {lsb}", file=sys.stderr)
 
-            mpusu = self.lastsu
+        mpusu = self.lsb2su(lsb)
+        # print(f"mpusu = {mpusu}", file=sys.stderr)
 
+        self.mpuPub.publish(mpusu)
+        self.gyroPub.publish(mpusu.gyro) # publish separately for legacy reasons..
+        self.lastsu = mpusu
+
+        self.numReads += 1
         return mpusu
 
+    def requestAhrs(self):
+        """Queue the AHRS quaternion query if it's due at ahrsRate"""
+        if not self.ahrs_enabled:
+            # mpuData does not currently support 'Euler, even though read_ahrs does'
+            self.current_quaternion = self.defaultQuaternion
+            return
+        now = time.time()
+        if self.pendingAhrs is None and now - self.lastAhrsTime >= self.ahrsInterval:
+            self.lastAhrsTime = now
+            self.pendingAhrs = self.transport.request(READ_AHRS_QUATERNION.encode() + b'\r')
+
+    def collectAhrs(self, wait=True):
+        """Update current_quaternion from the pending AHRS query's reply"""
+        f = self.pendingAhrs
+        if f is None or (not wait and not f.done()):
+            return
+        self.pendingAhrs = None
+        try:
+            reply = f.result()
+        except SerialException:
+            self.errorStats['serialErrors'] += 1
+            return
+        if reply is None:
+            self.errorStats['noReply'] += 1
+            return
+        self.parseAhrs(reply.decode(errors='replace'), 'Quaternion')
+
     def lsb2su(self, lsb):
         """
         local sensor bus (LSB) to standard units (SI)
@@ -397,15 +547,26 @@ class RIOX(PyRoboteq.RoboteqHandler):
             print(f"Invalid units for read_ahrs: {units}")
             return self.current_quaternion
 
-        ahrs_out = self.current_quaternion if units == 'Quaternion' else self.current_euler
-
         cmd = READ_AHRS_QUATERNION if units == 'Quaternion' else READ_AHRS_DEGREES
         try:
-            ahrs = self.read_value(cmd)
+            reply = self.transport.request(cmd.encode() + b'\r').result()
+        except SerialException:
+            self.errorStats['serialErrors'] += 1
+            reply = None
+        else:
+            if reply is None:
+                self.errorStats['noReply'] += 1
+        if reply is None:
+            return self.current_quaternion if units == 'Quaternion' else self.current_euler
+
+        return self.parseAhrs(reply.decode(errors='replace'), units)
+
+    def parseAhrs(self, ahrs, units='Quaternion'):
+        ahrs_out = self.current_quaternion if units == 'Quaternion' else self.current_euler
+        try:
             ahrs = list(map(int, ahrs.split('=')[1].split(':')))
-        except IndexError:
-            return ahrs_out
-        except ValueError:
+        except (IndexError, ValueError):
+            self.errorStats['ahrsErrors'] += 1
             return ahrs_out
 
         if units == 'Quaternion':
@@ -414,6 +575,7 @@ class RIOX(PyRoboteq.RoboteqHandler):
                 self.current_quaternion = ahrs_out
             else:
                 # print(f"Invalid AHRS for Quaternion: {ahrs}")
+                self.errorStats['ahrsErrors'] += 1
                 ahrs_out = self.current_quaternion
         else:
             if len(ahrs) == 3:
@@ -421,11 +583,25 @@ class RIOX(PyRoboteq.RoboteqHandler):
                 self.current_euler = ahrs_out
             else:
                 # print(f"Invalid AHRS for Euler Angles: {ahrs}")
+                self.errorStats['ahrsErrors'] += 1
                 ahrs_out = self.current_euler
 
         return ahrs_out
 
+    def getStats(self):
+        """Read error counters, and serial and stream statistics"""
+        stats = {'reads': self.numReads, 'readErrors': self.read_errors,
+                 'errors': dict(self.errorStats)}
+        if self.streaming:
+            stats['stream'] = dict(self.streamStats)
+        if self.transport is not None:
+            stats['serial'] = self.transport.stats()
+        return stats
+
     def close(self):
+        if self.transport is not None:
+            self.stopStreaming()
+            self.transport.close()
         return self.ser.close()
 
 
@@ -447,7 +623,120 @@ def test(n=10, units='Quaternion'):
         return results
 
 
-if __name__ == '__main__':
+def fakeRiox(fd, stop, latency=0.004):
+    """
+    Stand in for a RIOX on the master side of a pty: echo queries, and answer
+    each one latency seconds after it arrives, as the USB round trip would.
+    Streams the MEMS reading when asked.
+    """
+    import heapq
+    os.set_blocking(fd, False)
+    replies = []        # (due time, sequence, line)
+    interval = None
+    buffer = b''
+    lastStream = 0.
+    n = 0
+    while not stop.is_set():
+        try:
+            buffer += os.read(fd, 256)
+        except BlockingIOError:
+            pass
+
+        now = time.time()
+        while b'\r' in buffer:
+            cmd, buffer = buffer.split(b'\r', 1)
+            os.write(fd, cmd + b'\r')
+            n += 1
+            if cmd == READ_ALL_MEMS.encode():
+                heapq.heappush(replies, (now + latency, n, b'ML=10:-20:16384:100:0:0:%d:200:0:-100\r' % (n % 50,)))
+            elif cmd == READ_AHRS_QUATERNION.encode():
+                heapq.heappush(replies, (now + latency, n, b'QO=16834:0:0:0\r'))
+            for part in cmd.split(b'_'):
+                if part == b'# C':
+                    interval = None
+                elif part.startswith(b'# ') and part[2:].isdigit():
+                    interval = int(part[2:]) / 1000.
+
+        while replies and replies[0][0] <= now:
+            os.write(fd, heapq.heappop(replies)[2])
+
+        if interval and now - lastStream >= interval:
+            lastStream = now
+            os.write(fd, b'ML=10:-20:16384:100:0:0:0:200:0:-100\r')
+        time.sleep(0.0005)
+
+
+def fakePort():
+    """Device name of a pty served by fakeRiox, and the Event that stops it"""
+    import pty
+    import tty
+    import threading
+
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    stop = threading.Event()
+    threading.Thread(target=fakeRiox, args=(master, stop), daemon=True).start()
+    return os.ttyname(slave), stop
+
+
+def testAcquisition(n=100):
+    """Time per sample for sequential, pipelined and streamed acquisition"""
+    port, stop = fakePort()
+    controller = RIOX(port=port, ahrsRate=1000.)
+
+    # as read_mems did before pipelining: one round trip after the other
+    t0 = time.time()
+    for i in range(n):
+        controller.read_ahrs()
+        controller.transport.request(READ_ALL_MEMS.encode() + b'\r').result()
+    sequential = (time.time() - t0) / n
+    print("sequential AHRS + MEMS: %.2fms/sample" % (sequential * 1000.,))
+
+    t0 = time.time()
+    for i in range(n):
+        r = controller.read_mems()
+    pipelined = (time.time() - t0) / n
+    print("pipelined AHRS + MEMS: %.2fms/sample (%.0f%% of sequential)" % (
+        pipelined * 1000., pipelined / sequential * 100.))
+    print(r)
+
+    controller.ahrsInterval = 1. / 10.
+    t0 = time.time()
+    for i in range(n):
+        controller.read_mems()
+    print("AHRS at 10Hz: %.2fms/sample" % ((time.time() - t0) / n * 1000.,))
+
+    controller.startStreaming(100.)
+    readings = []
+    t0 = time.time()
+    while time.time() - t0 < 1.:
+        r = controller.read_mems()
+        if r.gyro.z is not None:
+            readings.append(r)
+    stats = controller.getStats()
+    print("streamed at 100Hz for 1s: %d readings, %d distinct times, %s" % (
+        len(readings), len(set(r.time for r in readings)), stats['stream'],))
+
+    ages = []
+    t0 = time.time()
+    while time.time() - t0 < 1.:
+        time.sleep(0.1)     # as MPservice's loop
+        r = controller.read_mems()
+        if r.gyro.z is not None:
+            ages.append(time.time() - r.time)
+    stats = controller.getStats()
+    print("read at 10Hz for 1s: %d readings, max age %.1fms, %s" % (
+        len(ages), max(ages) * 1000., stats['stream'],))
+    print("errors: %s, serial: %s" % (stats['errors'], stats['serial']['counts']))
+    controller.close()
+    stop.set()
+
+
+if __name__ == '__main__' and '--fake' in sys.argv:
+    # python riox_1216ahrs.py --fake to time acquisition against a simulated RIOX
+    testAcquisition()
+
+elif __name__ == '__main__':
     controller = RIOX()
 
     results_q = test(10, 'Quaternion')
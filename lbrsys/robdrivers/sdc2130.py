@@ -8,6 +8,25 @@ driver module for Roboteq sdc2130 high performance motor controller
     this driver.
 
     Note that independent motor control mode is assumed.
+
+    All serial I/O goes through a SerialTransport (see serialio.py), whose
+    thread writes commands and matches the controller's echoes and replies to
+    them.  Motor commands return a Future for their motorCommandResult, and
+    checkController issues the queries that are due and picks up the replies
+    to earlier ones, so neither blocks the operations loop on the port.
+
+    A motor command is only written when it differs from the last one written
+    or when keepaliveInterval has passed since, which is often enough to keep
+    the controller's watchdog from stopping the motors.  Repeats of the
+    current command, such as checkController's keepalive on every loop, are
+    otherwise skipped, and getStats reports the writes saved per second.
+
+    In streaming mode, the controller is asked to repeat the queries whose
+    queryRates are close to the fastest one, normally just the count, on its
+    own at that rate.  Slower queries, such as amps and voltage, are still
+    polled by checkController at their own rates.  The transport hands the
+    streamed lines, which answer no request, to streamLine, which only queues
+    them; checkController parses and publishes them on the caller's thread.
 """
 
 
@@ -32,7 +51,12 @@ __version__ = "1.0"
 import sys
 import io
 import time
+import queue
 import logging
+import threading
+import collections
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 from serial import Serial, SerialException
 from serial import EIGHTBITS, PARITY_NONE, STOPBITS_ONE
@@ -40,8 +64,13 @@ from serial import EIGHTBITS, PARITY_NONE, STOPBITS_ONE
 sys.path.insert(0, '..')
 
 from lbrsys.settings import SDC2130_Port
+try:
+    from lbrsys.settings import SDC2130_STREAMING
+except ImportError:
+    SDC2130_STREAMING = False
 from lbrsys import voltages, amperages, count, motorCommandResult
 from robcom import publisher
+from lbrsys.robdrivers import serialio
 
 
 # Master Control - False prevents motor activation (for testing)
@@ -56,10 +85,24 @@ class SDC2130:
     #timeout = 1 #second
     #timeout = 0 #non-blocking mode
     STOP_MOTOR_COMMAND = b'!M 0 0\r'
-    
 
-    def __init__(self, port=SDC2130_Port):
+    # checkController query rates in Hz, so serial time goes to the readings that need it
+    queryRates = {'count': 50., 'amps': 5., 'voltage': 0.2}
+    queryCommands = {'count': b'?C\r', 'amps': b'?A\r', 'voltage': b'?V\r'}
+
+    # streamed lines kept for checkController, older ones are dropped
+    streamBacklog = 200
+
+    # seconds after which an unchanged motor command is re-sent, well inside
+    # the controller's 1000ms default watchdog timeout (RWD)
+    keepaliveInterval = 0.5
+
+
+    def __init__(self, port=SDC2130_Port, queryRates=None, streaming=SDC2130_STREAMING):
         self.port = port
+        self.queryRates = dict(self.queryRates)
+        if queryRates:
+            self.queryRates.update(queryRates)
         try:
             self.controller = Serial(
                 self.port, self.baudrate, self.bytesize,
@@ -70,6 +113,10 @@ class SDC2130:
             raise
         
         self.motorCommand = self.STOP_MOTOR_COMMAND
+        self.lastWritten = None     # the last motor command written and acknowledged so far
+        self.lastWriteTime = 0.
+        self.keepaliveStats = {'commands': 0, 'writes': 0, 'keepalives': 0, 'saved': 0,
+                               'start': time.time()}
         self.messagePub = publisher.Publisher("SDC21xx Message Publisher")
         self.voltagePub = publisher.Publisher("SDC21xx Voltage Publisher")
         self.ampsPub    = publisher.Publisher("SDC21xx Amperage Publisher")
@@ -77,10 +124,122 @@ class SDC2130:
         self.count_pub = publisher.Publisher("SDC21xx Encoder Count Publisher")
 
         self.lastVoltages = voltages(12.0, 12.0, 5.11, time.asctime())
+        self.lastAmps = amperages(0., 0., time.asctime())
         self.last_count = count(0, 0, time.time())
-    
+
+        self.lastQueryTimes = {q: 0. for q in self.queryRates}
+        self.checkStats = {'checks': 0, 'totalSerialTime': 0., 'maxSerialTime': 0.,
+                           'lastSerialTime': 0., 'queries': {q: 0 for q in self.queryRates}}
+
+        self.pendingQueries = {}                    # query: Future for its reply line
+        self.pendingResults = collections.deque()   # motor command result Futures to publish
+        self.transport = serialio.SerialTransport(self.controller, self.timeout,
+                                                  unsolicited=self.unsolicitedLine,
+                                                  name="SDC2130 Serial I/O")
+
+        self.streaming = False
+        self.streamed = ()      # the queries in the controller's history
+        self.streamQ = queue.Queue(self.streamBacklog)     # (line, time received)
+        self.streamStats = {'lines': 0, 'count': 0, 'amps': 0, 'voltage': 0,
+                            'acks': 0, 'nacks': 0, 'unparsed': 0, 'dropped': 0}
+        if streaming:
+            self.startStreaming()
+
+    def startStreaming(self, interval=None):
+        """
+        Have the controller stream the queries within a factor of 2 of the
+        fastest query rate, every interval ms, by default at that rate
+        """
+        if self.streaming:
+            return
+        fastest = max(self.queryRates.values())
+        self.streamed = tuple(q for q in self.queryCommands
+                              if self.queryRates.get(q, 0.) >= fastest / 2.)
+        if interval is None:
+            interval = int(round(1000. / fastest))
+        self.streaming = True
+        # clear the query history, then set it and its repeat rate
+        history = b'_'.join(self.queryCommands[q].strip() for q in self.streamed)
+        self.transport.write(b'# C_%s_# %d\r' % (history, interval))
+
+    def stopStreaming(self):
+        if not self.streaming:
+            return
+        self.transport.write(b'# C\r').result(self.timeout)
+        self.streaming = False
+        self.streamed = ()
+
+    def unsolicitedLine(self, line):
+        """Lines that answer no request: the stream, or late replies"""
+        if self.streaming:
+            self.streamLine(line)
+        else:
+            logging.debug("SDC2130 unsolicited: %s" % (line,))
+
+    def streamLine(self, line):
+        """Queue one line of the stream for checkController, on the transport's thread"""
+        self.streamStats['lines'] += 1
+        item = (line, time.time())
+        try:
+            self.streamQ.put_nowait(item)
+        except queue.Full:
+            # the caller has fallen behind, so keep the newest lines
+            try:
+                self.streamQ.get_nowait()
+                self.streamStats['dropped'] += 1
+            except queue.Empty:
+                pass
+            self.streamQ.put_nowait(item)
+
+    def collectStream(self):
+        """Parse and publish the queued stream lines, in order, on the caller's thread"""
+        while True:
+            try:
+                line, t = self.streamQ.get_nowait()
+            except queue.Empty:
+                return
+            self.parseStreamLine(line, t)
+
+    def parseStreamLine(self, line, t):
+        stats = self.streamStats
+        line = line.strip()
+        if line == b'+':
+            stats['acks'] += 1
+            return
+        if line == b'-':
+            stats['nacks'] += 1
+            self.messagePub.publish(time.asctime() + " Controller rejected a command")
+            return
+
+        key, sep, values = line.partition(b'=')
+        try:
+            readings = [float(r) for r in values.split(b':')] if sep else []
+        except ValueError:
+            readings = []
+
+        if key == b'C' and len(readings) == 2:
+            stats['count'] += 1
+            self.last_count = count(int(readings[0]), int(readings[1]), t)
+            self.count_pub.publish(self.last_count)
+        elif key == b'A' and len(readings) == 2:
+            stats['amps'] += 1
+            self.lastAmps = self.makeAmps(readings)
+            self.ampsPub.publish(self.lastAmps)
+        elif key == b'V' and len(readings) == 3:
+            stats['voltage'] += 1
+            self.lastVoltages = self.makeVoltages(readings)
+            self.voltagePub.publish(self.lastVoltages)
+        else:
+            stats['unparsed'] += 1
+
     def closeController(self):
         try:
+            # the stop has to be written before the transport goes away, or
+            #   only the controller's watchdog would stop the motors
+            self.stopMotors()
+            self.waitResults(self.timeout * 2)
+            self.stopStreaming()
+            self.transport.close()
             self.controller.close()
             self.messagePub.publish(time.asctime() + " Controller Closed")
         except:
@@ -110,33 +269,24 @@ class SDC2130:
             
         return tuple(values)
 
-    def get_count(self):
-        """Retrieve sdc2160 encoder counts (added 20230212)"""
-        readBuffer = b''
+    def queryReply(self, query):
+        """Send a query and wait for its reply line, b'' if there isn't one"""
         try:
-            # self.controller.flush()
-            self.controller.write(b'?C\r')  # query for the voltages'
-            self.controller.flush()
-
-            # read the good echo, then the result
-            readBuffer = self.controller.read_until(b'?C\r')
-            if readBuffer == b'?C\r':
-                readBuffer = self.controller.read_until(b'\r')
-            else:
-                print(f"Expected readBuffer '?C\r', got '{readBuffer}'")
-                readBuffer = b''
-
-        except:
-            msg = time.asctime() + ' Error getting count'
+            return self.transport.request(self.queryCommands[query]).result() or b''
+        except SerialException as e:
+            msg = time.asctime() + ' Error getting %s: %s' % (query, e)
             self.messagePub.publish(msg)
             print(msg)
+            return b''
 
+    def get_count(self):
+        """Retrieve sdc2160 encoder counts (added 20230212)"""
+        return self.setCount(self.queryReply('count'))
+
+    def setCount(self, readBuffer):
         readings = ()
         if len(readBuffer) > 3:
             readings = self.parseQueryResults(readBuffer, 'C')
-        else:
-            # print "Skipped bad readBuffer in get_count"
-            pass
 
         if len(readings) == 2:
             left = int(readings[0])
@@ -156,38 +306,15 @@ class SDC2130:
             5V output voltage
             first 2 are 10x, third one is in millivolts
         """
-        readBuffer = b''
-        try:
-            # self.controller.flush()
-            self.controller.write(b'?V\r')   # query for the voltages'
-            self.controller.flush()
-
-            # read the good echo, then the result
-            readBuffer = self.controller.read_until(b'?V\r')
-            if readBuffer == b'?V\r':
-                readBuffer = self.controller.read_until(b'\r')
-            else:
-                print(f"Expected readBuffer '?V\r', got '{readBuffer}'")
-                readBuffer = b''
-
-        except:
-            msg = time.asctime() + ' Error getting voltages'
-            self.messagePub.publish(msg)
-            print(msg)
+        return self.setVoltages(self.queryReply('voltage'))
 
+    def setVoltages(self, readBuffer):
         readings = ()
         if len(readBuffer) > 3:
             readings = self.parseQueryResults(readBuffer,'V')
-        else:
-            #print "Skipped bad readBuffer in getVoltages"
-            pass
-        
+
         if len(readings) == 3:
-            mainBatVolts = readings[1] / 10.0
-            internalVolts = readings[0] / 10.0 #order different for sdc2130
-            outputVolts = readings[2] / 1000.0
-            v = voltages(mainBatVolts, internalVolts,outputVolts,
-                         time.asctime())
+            v = self.makeVoltages(readings)
             self.lastVoltages = v
         else:
             # v = voltages(0.,0.,0.,time.asctime())
@@ -197,6 +324,15 @@ class SDC2130:
         
         return v
 
+    def makeVoltages(self, readings):
+        mainBatVolts = readings[1] / 10.0
+        internalVolts = readings[0] / 10.0 #order different for sdc2130
+        outputVolts = readings[2] / 1000.0
+        return voltages(mainBatVolts, internalVolts, outputVolts, time.asctime())
+
+    def makeAmps(self, readings):
+        return amperages(readings[0] / 10.0, readings[1] / 10.0, time.asctime())
+
 
     def getAmps(self):
         """
@@ -204,39 +340,18 @@ class SDC2130:
         docs indicate that return value must be divided by 10
             in amps to get the actual value
         """
-        readBuffer = b''
-        try:
-            # self.controller.flush()
-            self.controller.write(b'?A\r')   # query for the amp readings
-            self.controller.flush()
-
-            # read the good echo, then read the result
-            readBuffer = self.controller.read_until(b'?A\r')
-            if readBuffer == b'?A\r':
-                readBuffer = self.controller.read_until(b'\r')
-            else:
-                print(f"Expected readBuffer '?V\r', got '{readBuffer}'")
-                readBuffer = b''
-
-        except:
-            msg = time.asctime() + ' Error getting amperages'
-            self.messagePub.publish(msg)
-            print(msg)
+        return self.setAmps(self.queryReply('amps'))
 
-        #logging.debug("getAmps parsing buffer: "+readBuffer)
-        #print "getAmps parsing buffer: %s" % (readBuffer,)
-        #see comment in getVoltages re serial issue
+    def setAmps(self, readBuffer):
         readings = ()
         if len(readBuffer) > 3:
             readings = self.parseQueryResults(readBuffer,'A')
         if len(readings) == 2:
-            ampsChannel1 = readings[0] / 10.0
-            ampsChannel2 = readings[1] / 10.0
+            amps = self.makeAmps(readings)
         else:
-            ampsChannel1 = 0.
-            ampsChannel2 = 0.
+            amps = amperages(0., 0., time.asctime())
 
-        amps = amperages(ampsChannel1, ampsChannel2, time.asctime())
+        self.lastAmps = amps
         self.ampsPub.publish(amps)
 
         return amps
@@ -250,14 +365,12 @@ class SDC2130:
         """
         try:
             self.stopMotors()
-            self.controller.write(b'%RESET 321654987\r')
-            self.controller.flush()
-            resetResult = self.controller.read_until(b'\r')
+            resetResult = self.transport.request(b'%RESET 321654987\r').result() or b''
         except:
             print('error reseting controller')
             resetResult = "Error"
 
-        self.messagePub.publish(time.asctime() + " " + resetResult)
+        self.messagePub.publish(time.asctime() + " " + str(resetResult))
 
         return resetResult
 
@@ -280,7 +393,7 @@ class SDC2130:
         :param motorCommand: - If motorCommand is passed to the function,
         it is sent returned without modification.  This approach provides the
         ability for the user to supply an alternative mapping algorithm.
-        :return: motorCommandResult - namedtuple
+        :return: Future for a motorCommandResult - namedtuple
         """
         m1 = speed + direction
         if m1 > 1000:
@@ -322,36 +435,68 @@ class SDC2130:
             self.motorCommand = motorCommand
         
         t = time.asctime()
+        command = self.motorCommand
+        result = Future()
+        stats = self.keepaliveStats
+        self.publishResults()   # a failed write clears lastWritten, so it's repeated
+        stats['commands'] += 1
+        now = time.time()
+        if executionEnabled and command == self.lastWritten:
+            if now - self.lastWriteTime < self.keepaliveInterval:
+                stats['saved'] += 1
+                result.set_result(motorCommandResult('Unchanged', command, b'', t))
+                return result
+            stats['keepalives'] += 1
+
         if executionEnabled:
-            try:
-                self.controller.write(self.motorCommand)
-                reply = self.controller.read_until(b'\r') # first get echo
-                reply = self.controller.read_until(b'\r')
-                if reply == b'':
-                    commandReply = b''
-                else:
-                    commandReply = reply[0]
-            except SerialException as e:
-                print('\t***error writing motor command: %s to %s' % (self.motorCommand,self.port))
-                print('\tSerial Exception: {}'.format(str(e)))
-                commandReply = b''
-
-            if chr(commandReply) == '+':
-                result = motorCommandResult('Success',
-                                            self.motorCommand, commandReply, t)
-            elif chr(commandReply) == '-':
-                result = motorCommandResult('Failure',
-                          self.motorCommand, commandReply, t)
-            else:
-                result = motorCommandResult('Unacknowledged',
-                          self.motorCommand, commandReply, t)
+            stats['writes'] += 1
+            self.lastWritten = command
+            self.lastWriteTime = now
+            reply = self.transport.request(command)
+            reply.add_done_callback(lambda r: result.set_result(self.makeResult(r, command, t)))
         else:
-            result = motorCommandResult('Disabled',
-                                        self.motorCommand, '', t)
+            result.set_result(motorCommandResult('Disabled', command, '', t))
+
+        self.pendingResults.append(result)
+        self.publishResults()
+        return result
 
-        self.motorControlPub.publish(result)
-        logging.debug(result)
-        return result 
+    def makeResult(self, reply, command, t):
+        """motorCommandResult for the Future of a motor command's reply line, on the transport's thread"""
+        try:
+            line = reply.result()
+        except SerialException as e:
+            print('\t***error writing motor command: %s to %s' % (command, self.port))
+            print('\tSerial Exception: {}'.format(str(e)))
+            line = None
+
+        if line == b'+\r':
+            return motorCommandResult('Success', command, line[0], t)
+        if line == b'-\r':
+            return motorCommandResult('Failure', command, line[0], t)
+        else:
+            return motorCommandResult('Unacknowledged', command, b'', t)
+
+    def publishResults(self):
+        """Publish completed motor command results, in order, on the caller's thread"""
+        while self.pendingResults and self.pendingResults[0].done():
+            result = self.pendingResults.popleft().result()
+            if result.status in ('Failure', 'Unacknowledged') and result.command == self.lastWritten:
+                # make sure the next command is written, whether or not it's a repeat
+                self.lastWritten = None
+            self.motorControlPub.publish(result)
+            logging.debug(result)
+
+    def waitResults(self, timeout):
+        """Wait up to timeout seconds for the pending motor commands, then publish their results"""
+        deadline = time.time() + timeout
+        for result in list(self.pendingResults):
+            try:
+                result.result(max(deadline - time.time(), 0.))
+            except FutureTimeoutError:
+                logging.warning("SDC2130 motor command still pending after %.3fs" % (timeout,))
+                break
+        self.publishResults()
 
 
     def stopMotors(self):
@@ -364,38 +509,216 @@ class SDC2130:
         return(result)            
 
 
+    def queryDue(self, query, now):
+        rate = self.queryRates.get(query)
+        if not rate or now - self.lastQueryTimes[query] < 1. / rate:
+            return False
+        self.lastQueryTimes[query] = now
+        self.checkStats['queries'][query] += 1
+        return True
+
     def checkController(self):
         """
-        gathers the readings (todo figure out publishing)
+        publishes the replies to queries issued on earlier calls and issues
+        the queries that are due at their query rates, returning the most
+        recent values without waiting on the controller
+        (todo figure out publishing)
         Note that the sdc2130, unlike the ax500 predecessor, requires
         a ! command in order to keep the watchdog alive
         :return:
         """
-        v = self.getVoltages()
-        a = self.getAmps()
-        c = self.get_count()
-
-        # for now, just re-issue the current motor command
-        # could flash an led or take any other runtime action
-        # to keep watchdog alive
+        t0 = time.time()
+        self.collectQueries()
+        self.collectStream()
+        for query in self.queryCommands:
+            # the controller repeats the streamed queries on its own
+            if query in self.streamed:
+                continue
+            if query not in self.pendingQueries and self.queryDue(query, t0):
+                self.pendingQueries[query] = self.transport.request(self.queryCommands[query])
+
+        # re-issue the current motor command, which is only written if the
+        # watchdog needs it.  could flash an led or take any other runtime
+        # action to keep watchdog alive
         if self.motorCommand != self.STOP_MOTOR_COMMAND:
             self.mixMotorCommand(0, 0, motorCommand=self.motorCommand)
+        self.publishResults()
 
-        return v, a, c
+        serialTime = time.time() - t0
+        stats = self.checkStats
+        stats['checks'] += 1
+        stats['totalSerialTime'] += serialTime
+        stats['maxSerialTime'] = max(stats['maxSerialTime'], serialTime)
+        stats['lastSerialTime'] = serialTime
+
+        return self.lastVoltages, self.lastAmps, self.last_count
         # todo - add power, etc.
 
+    def collectQueries(self):
+        """Apply and publish the replies that have arrived for pending queries"""
+        setters = {'count': self.setCount, 'amps': self.setAmps, 'voltage': self.setVoltages}
+        for query, reply in list(self.pendingQueries.items()):
+            if reply.done():
+                del self.pendingQueries[query]
+                try:
+                    line = reply.result() or b''
+                except SerialException as e:
+                    self.messagePub.publish(time.asctime() + ' Error getting %s: %s' % (query, e))
+                    line = b''
+                setters[query](line)
+
+    def getStats(self):
+        """Time spent per checkController call, queries made and serial latencies"""
+        stats = dict(self.checkStats)
+        stats['avgSerialTime'] = stats['totalSerialTime'] / max(stats['checks'], 1)
+        stats['queryRates'] = dict(self.queryRates)
+        if self.streaming:
+            stats['stream'] = dict(self.streamStats)
+        stats['serial'] = self.transport.stats()
+        stats['keepalive'] = self.getKeepaliveStats()
+        return stats
+
+    def getKeepaliveStats(self):
+        stats = dict(self.keepaliveStats)
+        elapsed = max(time.time() - stats.pop('start'), 1e-6)
+        stats['savedPerSecond'] = stats['saved'] / elapsed
+        stats['writesPerSecond'] = stats['writes'] / elapsed
+        return stats
+
+
+def fakeController(fd, stop):
+    """
+    Stand in for a controller on the master side of a pty: echo commands,
+    acknowledge motor commands, answer queries and stream the query history
+    when asked.
+    """
+    import os
+    os.set_blocking(fd, False)
+    interval = None
+    history = []
+    buffer = b''
+    lastStream = 0.
+    n = 0
+    while not stop.is_set():
+        try:
+            buffer += os.read(fd, 256)
+        except BlockingIOError:
+            pass
 
-if __name__ == "__main__":
+        while b'\r' in buffer:
+            cmd, buffer = buffer.split(b'\r', 1)
+            os.write(fd, cmd + b'\r')
+            if cmd.startswith(b'!'):
+                os.write(fd, b'+\r')
+            elif cmd == b'?C':
+                n += 1
+                os.write(fd, b'C=%d:%d\r' % (n, -n))
+            elif cmd == b'?A':
+                os.write(fd, b'A=12:13\r')
+            elif cmd == b'?V':
+                os.write(fd, b'V=120:126:5110\r')
+            for part in cmd.split(b'_'):
+                if part == b'# C':
+                    interval = None
+                    history = []
+                elif part.startswith(b'# ') and part[2:].isdigit():
+                    interval = int(part[2:]) / 1000.
+                elif part.startswith(b'?') and interval is None:
+                    # queries are only recorded until the repeat starts
+                    history.append(part)
+
+        if interval and time.time() - lastStream >= interval:
+            lastStream = time.time()
+            for query in history:
+                if query == b'?C':
+                    n += 1
+                    os.write(fd, b'C=%d:%d\r' % (n, -n))
+                elif query == b'?A':
+                    os.write(fd, b'A=12:13\r')
+                elif query == b'?V':
+                    os.write(fd, b'V=120:126:5110\r')
+        time.sleep(0.001)
+
+
+def fakePort():
+    """Device name of a pty served by fakeController, and the Event that stops it"""
+    import os
+    import pty
+    import tty
+
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    stop = threading.Event()
+    threading.Thread(target=fakeController, args=(master, stop), daemon=True).start()
+    return os.ttyname(slave), stop
+
+
+def testPolling(seconds=2.):
+    port, stop = fakePort()
+    c = SDC2130(port=port)
+
+    result = c.mixMotorCommand(100, 0)
+    print("motor command: %s" % (result.result(1.).status,))
+    maxCheck = 0.
+    t0 = time.time()
+    while time.time() - t0 < seconds:
+        t = time.time()
+        c.mixMotorCommand(100, 0)     # as the ops loop re-sends an unchanged task
+        c.checkController()
+        maxCheck = max(maxCheck, time.time() - t)
+        time.sleep(0.020)
+    c.stopMotors().result(1.)
+    print("last count: %s, max checkController time: %.3fms" % (str(c.last_count), maxCheck * 1000.))
+    for command, h in c.getStats()['serial']['latency'].items():
+        print("%s: %s" % (command, h))
+    print("keepalive: %s" % (c.getKeepaliveStats(),))
+    c.closeController()
+    stop.set()
+
+
+def testStreaming(seconds=2.):
+    port, stop = fakePort()
+    received = {'count': 0, 'amps': 0, 'voltage': 0}
+    c = SDC2130(port=port, streaming=True)
+    c.count_pub.addSubscriber(lambda m: received.update(count=received['count'] + 1))
+    c.ampsPub.addSubscriber(lambda m: received.update(amps=received['amps'] + 1))
+    c.voltagePub.addSubscriber(lambda m: received.update(voltage=received['voltage'] + 1))
+
+    t0 = time.time()
+    result = c.mixMotorCommand(100, 0)
+    print("motor command queued in %.3fms: %s" % ((time.time() - t0) * 1000., result.result(1.).status))
+    print("streaming %s" % (c.streamed,))
+    t0 = time.time()
+    while time.time() - t0 < seconds:
+        c.checkController()
+        time.sleep(0.1)     # as the ops loop, slower than the stream
+    c.stopMotors().result(1.)
+    c.checkController()
+    print("last count: %s" % (str(c.last_count),))
+    print("published per second: %s" % ({k: v / seconds for k, v in received.items()},))
+    print("stream stats: %s" % (c.streamStats,))
+    print("serial stats: %s" % (c.transport.stats()['counts'],))
+    c.closeController()
+    stop.set()
+
+
+if __name__ == "__main__" and '--fake' in sys.argv:
+    # python sdc2130.py --fake to test polling and streaming against a simulated controller
+    testPolling()
+    testStreaming()
+
+elif __name__ == "__main__":
     c = SDC2130()
 
     speed = 0
     steering = 0
-    cmd = c.mixMotorCommand(speed, steering)
+    cmd = c.mixMotorCommand(speed, steering).result()
 
     for r in range(5):
         time.sleep(.9)
-        v, a = c.checkController()
-        print(v, a)
+        v, a, cnt = c.checkController()
+        print(v, a, cnt)
+    print(c.getStats())
 
     c.stopMotors()
     c.closeController()
\ No newline at end of file
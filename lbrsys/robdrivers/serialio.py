@@ -0,0 +1,301 @@
+"""
+serialio.py - asynchronous request / reply transport for line oriented serial devices
+    One I/O thread owns the port.  Callers queue commands and get back a
+    concurrent.futures.Future for the reply, so they never block on the port.
+    The thread writes queued commands in order and matches each line it reads
+    to the oldest outstanding request the line answers: the device's echo of a
+    command marks the request echoed, '+' or '-' answers a command and 'X=...'
+    answers a '?X' query.  Lines that answer no request, such as streamed query
+    results, go to the unsolicited line handler.  A request that gets no reply
+    within the timeout resolves to None.  Its echo or reply may still arrive
+    later, ahead of those of the requests after it, so for a while the late
+    lines are matched to the expired request and dropped, rather than taken
+    as the answer to a later one.
+
+    Round trip latency is kept per command, e.g. '!M' or '?V', as a histogram.
+"""
+
+__author__ = "Tal G. Ball"
+__copyright__ = "Copyright (C) 2024 Tal G. Ball"
+__license__ = "Apache License, Version 2.0"
+__version__ = "1.0"
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import os
+import time
+import bisect
+import logging
+import selectors
+import threading
+import collections
+from concurrent.futures import Future
+
+from serial import SerialException
+
+
+# histogram bucket upper bounds in ms
+LATENCY_BUCKETS = (1., 2., 5., 10., 20., 50., 100., 250., float('inf'))
+
+
+def commandKey(command):
+    """Histogram key for a command, e.g. '!M' for b'!M 100 -100\\r'"""
+    return command.split(b' ')[0].strip().decode(errors='replace')
+
+
+def answers(command, line):
+    """True if line is a reply to command"""
+    if command.startswith(b'?'):
+        return line.startswith(command[1:].split(b' ')[0].strip() + b'=')
+    return line in (b'+\r', b'-\r')
+
+
+class Request:
+    __slots__ = ('command', 'future', 'sent', 'echoed', 'expired')
+
+    def __init__(self, command, future, sent):
+        self.command = command
+        self.future = future
+        self.sent = sent
+        self.echoed = False
+        self.expired = 0.
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.replies = 0
+        self.timeouts = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, ms)] += 1
+        self.replies += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def stats(self):
+        buckets = {}
+        for bound, n in zip(LATENCY_BUCKETS, self.counts):
+            label = '<=%gms' % (bound,) if bound != float('inf') else '>%gms' % (LATENCY_BUCKETS[-2],)
+            buckets[label] = n
+        return {'replies': self.replies, 'timeouts': self.timeouts,
+                'avgMs': self.total / max(self.replies, 1), 'maxMs': self.max,
+                'buckets': buckets}
+
+
+class SerialTransport:
+    def __init__(self, port, timeout=0.250, unsolicited=None, name="Serial I/O"):
+        """
+        :param port: an open serial.Serial
+        :param timeout: seconds to wait for a reply
+        :param unsolicited: called on the I/O thread with each line that answers no request
+        """
+        self.port = port
+        self.timeout = timeout
+        self.unsolicited = unsolicited
+        self.lateWindow = timeout * 4     # s that an expired request's late reply is expected
+        self.writeQ = collections.deque()
+        self.inflight = collections.deque()
+        self.expired = collections.deque()  # requests that timed out, in case their replies arrive late
+        self.histograms = collections.defaultdict(LatencyHistogram)
+        self.counts = {'writes': 0, 'replies': 0, 'echoes': 0,
+                       'unsolicited': 0, 'timeouts': 0, 'late': 0}
+        self.error = None
+        # request and close agree on running, so nothing is queued after the thread exits
+        self.lock = threading.Lock()
+
+        # the I/O thread sleeps in select, so writers wake it through a pipe
+        self.wakeRead, self.wakeWrite = os.pipe()
+        os.set_blocking(self.wakeRead, False)
+        os.set_blocking(self.wakeWrite, False)
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def request(self, command, reply=True):
+        """
+        Queue command for writing.  The returned Future resolves to the reply
+        line, to None if there was no reply in time, or immediately after
+        writing when reply is False.
+        """
+        future = Future()
+        with self.lock:
+            if not self.running:
+                future.set_exception(SerialException(self.error or "Serial transport closed"))
+                return future
+            self.writeQ.append((command, future, reply))
+
+        try:
+            os.write(self.wakeWrite, b'\0')
+        except BlockingIOError:
+            pass    # the thread already has wakeups pending
+        return future
+
+    def write(self, command):
+        return self.request(command, reply=False)
+
+    def run(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.port.fileno(), selectors.EVENT_READ, 'port')
+        selector.register(self.wakeRead, selectors.EVENT_READ, 'wake')
+        pending = b''
+        try:
+            while self.running:
+                readable = False
+                for key, mask in selector.select(self.nextTimeout()):
+                    if key.data == 'wake':
+                        try:
+                            os.read(self.wakeRead, 4096)
+                        except BlockingIOError:
+                            pass
+                    else:
+                        readable = True
+
+                self.writeQueued()
+
+                if readable:
+                    # a read can end part way through a line
+                    pending += self.port.read(self.port.in_waiting or 1)
+                    *lines, pending = pending.split(b'\r')
+                    for line in lines:
+                        self.dispatch(line + b'\r')
+
+                self.expire()
+
+        except (SerialException, OSError) as e:
+            self.error = str(e)
+            msg = time.asctime() + " Serial I/O error on %s: %s" % (self.port.name, e)
+            print(msg)
+            logging.error(msg)
+        finally:
+            with self.lock:
+                self.running = False
+            selector.close()
+            self.failPending()
+
+    def nextTimeout(self):
+        if not self.inflight:
+            return None
+        return max(self.inflight[0].sent + self.timeout - time.time(), 0.)
+
+    def writeQueued(self):
+        while self.writeQ:
+            command, future, reply = self.writeQ.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                self.port.write(command)
+            except (SerialException, OSError) as e:
+                future.set_exception(SerialException(str(e)))
+                raise
+            self.counts['writes'] += 1
+            if reply:
+                self.inflight.append(Request(command, future, time.time()))
+            else:
+                future.set_result(None)
+
+    def dispatch(self, line):
+        now = time.time()
+        while self.expired and now - self.expired[0].expired >= self.lateWindow:
+            self.expired.popleft()
+
+        # lines arrive in the order of the commands, so expired requests come first
+        for r in self.expired:
+            if not r.echoed and line == r.command:
+                r.echoed = True
+                return
+        for r in self.inflight:
+            if not r.echoed and line == r.command:
+                r.echoed = True
+                self.counts['echoes'] += 1
+                return
+
+        for r in self.inflight:
+            if answers(r.command, line):
+                late = self.lateReply(line)
+                # a reply ahead of the request's own echo belongs to an earlier request
+                if late is not None and not r.echoed:
+                    self.expired.remove(late)
+                    self.counts['late'] += 1
+                    return
+                self.inflight.remove(r)
+                self.counts['replies'] += 1
+                self.histograms[commandKey(r.command)].add((time.time() - r.sent) * 1000.)
+                r.future.set_result(line)
+                return
+
+        late = self.lateReply(line)
+        if late is not None:
+            self.expired.remove(late)
+            self.counts['late'] += 1
+            return
+
+        self.counts['unsolicited'] += 1
+        if self.unsolicited:
+            try:
+                self.unsolicited(line)
+            except Exception as e:
+                logging.error("Error handling serial line %s: %s" % (line, e))
+
+    def lateReply(self, line):
+        """The oldest expired request that line could be the late reply to, if any"""
+        for r in self.expired:
+            if answers(r.command, line):
+                return r
+        return None
+
+    def expire(self):
+        now = time.time()
+        while self.inflight and now - self.inflight[0].sent >= self.timeout:
+            r = self.inflight.popleft()
+            self.counts['timeouts'] += 1
+            self.histograms[commandKey(r.command)].timeouts += 1
+            r.expired = now
+            self.expired.append(r)
+            r.future.set_result(None)
+
+    def failPending(self):
+        e = SerialException(self.error or "Serial transport closed")
+        while self.inflight:
+            self.inflight.popleft().future.set_exception(e)
+        while self.writeQ:
+            command, future, reply = self.writeQ.popleft()
+            if future.set_running_or_notify_cancel():
+                future.set_exception(e)
+
+    def stats(self):
+        return {'counts': dict(self.counts), 'inflight': len(self.inflight),
+                'latency': {k: h.stats() for k, h in list(self.histograms.items())}}
+
+    def close(self):
+        with self.lock:
+            wake = self.running
+            self.running = False
+        if wake:
+            try:
+                os.write(self.wakeWrite, b'\0')
+            except BlockingIOError:
+                pass
+        if self.thread is not threading.current_thread():
+            self.thread.join(self.timeout * 4)
+            if not self.thread.is_alive():
+                # fail anything the thread left behind, so no Future waits forever
+                self.failPending()
+        if self.wakeRead is not None:
+            os.close(self.wakeRead)
+            os.close(self.wakeWrite)
+            self.wakeRead = self.wakeWrite = None
@@ -23,15 +23,93 @@ __version__ = "1.0"
 #  limitations under the License.
 
 
+import os
+import pickle
 import sqlite3
-import time
 
 
-from lbrsys.settings import robot_name
+from lbrsys.settings import robot_name, dbfile as robotDbfile, CONFIG_SNAPSHOT, MESSAGE_CATALOG
+from lbrsys.robcom import msgcatalog
+
+
+def readConfig(dbfile, name):
+    """Read all of the robot's configuration tables in a single transaction"""
+    con = sqlite3.connect(dbfile, isolation_level=None)
+    con.row_factory = sqlite3.Row
+
+    def rows(sql, args=()):
+        return [dict(r) for r in con.execute(sql, args)]
+
+    try:
+        con.execute("begin")
+        robots = rows("select * from robot where name=?", (name,))
+        if not robots:
+            raise LookupError("No robot named %s in %s" % (name, dbfile))
+        robot_id = robots[0]['robot_id']
+
+        config = {
+            'robot': robots[0],
+            'move_config': rows("select * from move_config where robot_id=?", (robot_id,)),
+            'calibrations': rows("select * from calibration where robot_id=?", (robot_id,)),
+            'processes': rows(
+                "select distinct robot_process.* from robot_process \
+                join channel on (robot_process.process_id = channel.target_process_id \
+                or robot_process.process_id = channel.source_process_id) \
+                and robot_id = ?",
+                (robot_id,)),
+            'channels': rows("select * from channel where robot_id=?", (robot_id,)),
+            # message list is not robot-specfic for now
+            'messages': rows("select * from message order by name"),
+            'extcmds': rows("select * from extcmd where robot_id=?", (robot_id,)),
+        }
+        con.execute("commit")
+    finally:
+        con.close()
+
+    return config
+
+
+_snapshot = None
+
+
+def snapshot(dbfile=robotDbfile, name=robot_name, refresh=False):
+    """
+    The robot's configuration, read from the database only when it has changed.
+    A pickled snapshot is kept in CONFIG_SNAPSHOT and in memory, keyed on the
+    database file's mtime, so that most processes never open the database.
+    """
+    global _snapshot
+    key = (os.path.abspath(dbfile), name, os.stat(dbfile).st_mtime_ns)
+
+    if not refresh:
+        if _snapshot is not None and _snapshot['key'] == key:
+            return _snapshot['config']
+        try:
+            with open(CONFIG_SNAPSHOT, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['key'] == key:
+                _snapshot = cached
+                return _snapshot['config']
+        except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+            pass
+
+    _snapshot = {'key': key, 'config': readConfig(dbfile, name)}
+    try:
+        # write and rename, so other processes never load a partial snapshot
+        tmpfile = "%s.%d" % (CONFIG_SNAPSHOT, os.getpid())
+        with open(tmpfile, 'wb') as f:
+            pickle.dump(_snapshot, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpfile, CONFIG_SNAPSHOT)
+    except OSError as e:
+        print(f"Error saving config snapshot: {e}")
+
+    return _snapshot['config']
+
 
 class Robconfig:
     def __init__(self, dbfile, name=robot_name):
         self.name = name
+        self.dbfile = dbfile
         try:
             self.con = sqlite3.connect(dbfile)
         except:
@@ -40,57 +118,22 @@ class Robconfig:
         self.con.row_factory = sqlite3.Row
         self.cursor = self.con.cursor()
         try:
-            robrecords = self.cursor.execute(
-                "select * from robot where name=?", (self.name,))
-            self.robrecord = robrecords.fetchone()
+            config = snapshot(dbfile, name)
+            self.robrecord = config['robot']
             self.robot_id = self.robrecord['robot_id']
-
         except:
             print("Exception getting robot config")
             raise
 
-        try:
-            processRecords = self.cursor.execute(
-                "select distinct robot_process.* from robot_process \
-                join channel on (robot_process.process_id = channel.target_process_id \
-                or robot_process.process_id = channel.source_process_id) \
-                and robot_id = ?",
-                (self.robot_id,))
-
-            self.processList = []
-            for pr in processRecords:
-                prElement = {}
-                for k in list(pr.keys()):
-                    prElement[k] = pr[k]
-                self.processList.append(prElement)              
-        except:
-            print("Exception getting processes")
-            raise
+        self.processList = config['processes']
+        self.channelList = config['channels']
+        self.messages = config['messages']
 
         try:
-            channelRecords = self.cursor.execute(
-                "select * from channel where robot_id=?",
-                (self.robot_id,))
-
-            self.channelList = []
-            for cr in channelRecords:
-                crElement = {}
-                for k in list(cr.keys()):
-                    crElement[k] = cr[k]
-                self.channelList.append(crElement)
-        except:
-            print("Exception getting channels")
-            raise
-
-        try:
-            # message list is not robot-specfic for now
             # todo normalize the message data model accross language
-            messageRecords = self.cursor.execute(
-                "select * from message order by name")
-
             # todo generalize vs schema
             self.messageDict = {}
-            for m in messageRecords:
+            for m in config['messages']:
                 message = {'text': m['text'],
                            'purpose': m['purpose'],
                            'type': m['type'],
@@ -104,25 +147,12 @@ class Robconfig:
             print("Exception getting messages")
             raise
 
-        try:
-            self.extcmds = {}
-            for c in self.cursor.execute("select * from extcmd where robot_id=?",
-                                            (self.robot_id,)):
-                self.extcmds[c['cmd_name']] = c
-        except:
-            print("Exception getting external commands")
-            raise
+        self.extcmds = {c['cmd_name']: c for c in config['extcmds']}
 
 
-    def saveMessageDict(self, filename='./robmsgdict.py'):
-        with open(filename, 'w') as dictFile:
-            dictFile.write("# Slightly silly message dictionary\n# Auto Generated by robconfig at %s\n" %
-                           (time.asctime(),))
-            dictFile.write("#\n")
-            dictFile.write("\nmessageDict = {\n")
-            for m in self.messageDict.keys():
-                dictFile.write("'%s': %s, \n" % (m, self.messageDict[m]))
-            dictFile.write("}\n")
+    def saveMessageCatalog(self, filename=MESSAGE_CATALOG):
+        """Rebuild the message catalog if the message table has changed"""
+        return msgcatalog.build(self.messages, filename)
 
 
     def noteStarted(self):
@@ -136,7 +166,10 @@ class Robconfig:
         except:
             print("error noting start time")
             raise
-        
+
+        # refresh the snapshot now, rather than in every process started after this
+        snapshot(self.dbfile, self.name, refresh=True)
+
     def noteShutdown(self):
         try:
             self.cursor.execute(
@@ -155,7 +188,7 @@ if __name__ == '__main__':
         
     r = Robconfig(dbfile)
     print(r)
-    r.saveMessageDict()
+    print("message catalog rebuilt: %s" % (r.saveMessageCatalog(),))
     r.noteStarted()
     r.noteShutdown()
     
@@ -30,6 +30,8 @@ import subprocess
 import threading
 import time
 import pprint
+import queue
+from multiprocessing.connection import wait
 
 # setting the path here so that robot.py can be 
 #    executed interactively from here Shutdown
@@ -43,37 +45,59 @@ try:
     from lbrsys.settings import LAUNCH_NAVCAM
 except:
     LAUNCH_NAVCAM = False
+try:
+    from lbrsys.settings import START_METHOD, FORKSERVER_PRELOAD
+except:
+    START_METHOD = 'spawn'
+    FORKSERVER_PRELOAD = []
+try:
+    from lbrsys.settings import SERVICE_READY_TIMEOUT, SERVICE_READY_TIMEOUTS
+except:
+    SERVICE_READY_TIMEOUT = 15.
+    SERVICE_READY_TIMEOUTS = {}
 
 from lbrsys import power, nav
 from lbrsys import observeTurn, executeTurn, executeHeading, calibrateMagnetometer
-from lbrsys import speech, dance, feedback, exec_report
+from lbrsys import speech, dance, feedback, exec_report, ready
 from lbrsys import channelMap, command_map
 
-# These imports support dynamically launching robot processes during setup
-from lbrsys import robcom
-import robcom.robhttpservice
-import robcom.speechsrvcs
-import robcom.robcamservice
-import robops
-import robops.opsmgr
-import robops.mpops
-import robops.rangeops
-import robapps
-import robapps.iot
-import robapps.iot.robiot
-
 from lbrsys.robexec import robconfig
+from lbrsys.robexec import robtargets
+from lbrsys.robexec import robroutes
+from lbrsys.robcom import robcodec
+from lbrsys.robcom import shmring
 
 # Convention for interpreting queue setup configuration data
 QueueNotShared = -1
 
+# Channel direction for a route from one process straight into another's queue,
+#   named by share_queue, without passing through the executive.
+#   Only the source process is given the channel.
+DirectRoute = 'Direct'
+
+# Channel protocols implemented as queues
+QueueProtocols = ('JoinableQueue', 'EncodedQueue')
+
+# Channel protocol for high rate sensor streams.  The source process is the
+#   ring's single producer, so the executive doesn't put Shutdown on it.
+RingProtocol = 'RingBuffer'
+
+
+def makeQueue(c):
+    if c['protocol'] == 'EncodedQueue':
+        return robcodec.EncodedQueue()
+    if c['protocol'] == RingProtocol:
+        return shmring.RingBuffer('%s_ring_%d' % (robot_name, c['id']), create=True)
+    return multiprocessing.JoinableQueue()
+
 
 class Robot(object):
     def __init__(self, name=robot_name):
         logging.info('Configuring robot {0} at {1} .'.format(robot_name, time.asctime()))
 
         self.r = robconfig.Robconfig(dbfile, name)
-        self.r.saveMessageDict(os.path.join(BASE_DIR, 'lbrsys', 'robcom', 'robmsgdict.py'))
+        if self.r.saveMessageCatalog():
+            logging.info("Rebuilt the message catalog")
 
         '''
         The following section is a bit dense.  Here's how it works:
@@ -88,7 +112,7 @@ class Robot(object):
             3.2 Iterate over the channel list - i.e. channel meta data
             3.2.1 create the Queue if needed
             3.2.2 if the channel is for the current process, add it to the list
-            3.2.3 if the channel is for receiving, create a monitor thread
+            3.2.3 if the channel is for receiving, note it for the dispatcher
             3.3 create a tuple of the channels (Queues) suitable for passing
                   to Process SEE BUG NOTE BELOW
             3.4 create the Process and add it to the dictionary of Processes
@@ -102,6 +126,10 @@ class Robot(object):
         self.processes = {}
         self.extProcesses = {}
         self.monitorThreads = []
+        self.monitorChannels = {}   # channel id: queue, one entry per distinct queue
+        self.monitorCounts = {}     # channel id: messages handled
+        self.startTime = time.time()
+        self.startupStart = self.startTime
         firstPass = True
 
         for p in self.r.processList:
@@ -110,27 +138,22 @@ class Robot(object):
             for c in self.r.channelList:
                 if firstPass:
                     if c['share_queue'] == QueueNotShared:
-                        self.channels[c['id']] = multiprocessing.JoinableQueue()
+                        self.channels[c['id']] = makeQueue(c)
                     else:
                         if c['share_queue'] in self.channels:
                             self.channels[c['id']] = self.channels[c['share_queue']]
                             #print "share_queue: %s" % (self.channels[c['share_queue']])
 
                     if c['direction'] == 'Receive' and \
-                       c['target_process_id'] == 0: #target 0 means robot
-                        mt = threading.Thread(
-                            target=self.monitor,
-                            args=(self.channels[c['id']],),
-                            name='MonitorThread-{0}: {1}'.format(
-                                c['id'],
-                                c['description']
-                            )
-                        )
-                        mt.daemon = True
-                        self.monitorThreads.append(mt)
-                        
+                       c['target_process_id'] == 0 and \
+                       self.channels[c['id']] not in self.monitorChannels.values():
+                        # target 0 means robot; shared queues are monitored once
+                        self.monitorChannels[c['id']] = self.channels[c['id']]
+                        self.monitorCounts[c['id']] = 0
+
                 if c['source_process_id'] == p['process_id'] or \
-                   c['target_process_id'] == p['process_id']:
+                   (c['target_process_id'] == p['process_id'] and
+                    c['direction'] != DirectRoute):
                     channelListForProcess.append(self.channels[c['id']])
                     channelDescriptionsForProcess.append(c['description'])
 
@@ -141,7 +164,8 @@ class Robot(object):
 
             if p['protocol'] == 'pylocal':
                 self.processes[p['process_id']] = multiprocessing.Process(
-                    target=eval(p['target']),
+                    # imported in the child, so each process loads only what it runs
+                    target=robtargets.lazyTarget(p['target']),
                     name=p['name'],
                     args=p['channels']
                 )
@@ -154,29 +178,71 @@ class Robot(object):
                 if p['name'] == 'Robot Operations':
                     p['channels'][0].put("Hello from robot!")
 
+        # One dispatcher thread waits on every receive queue that has a pipe
+        #   underneath.  Others, such as ring buffers, get their own monitor thread.
+        self.dispatchReaders = {}
+        for cid, q in self.monitorChannels.items():
+            if hasattr(q, '_reader'):
+                self.dispatchReaders[q._reader] = (cid, q)
+            else:
+                mt = threading.Thread(
+                    target=self.monitor,
+                    args=(q, cid),
+                    name='MonitorThread-{0}'.format(cid)
+                )
+                mt.daemon = True
+                self.monitorThreads.append(mt)
+
+        if self.dispatchReaders:
+            mt = threading.Thread(target=self.dispatch, name='DispatchThread')
+            mt.daemon = True
+            self.monitorThreads.append(mt)
+
+        # services report ready once their devices are initialized
+        self.readyEvents = {pv.name: threading.Event() for pv in self.processes.values()}
+        self.readyTimes = {}
+
         # todo: merge this into one of the previous loops through the channels
         self.sendChannels = {}
         for c in self.r.channelList:
             if c['direction'] == 'Send' and c['source_process_id'] == 0:
                 self.sendChannels[c['id']] = [self.channels[c['id']], c]
                 #pprint.pprint(c)
+
+        # message type to queues, so execSend doesn't walk every channel per message
+        self.routes = robroutes.build_routes(self.sendChannels, channelMap)
         pass # useful breakpoint to examine robot configuration data in debugger
 
     def start(self):
         self.r.noteStarted()
+        self.startTime = time.time()
 
-        print()
-        for p in self.processes:
-            print("Starting", self.processes[p].name)
-            self.processes[p].start()
-            time.sleep(0.5)
-
+        # monitors first, so ready messages are handled as they arrive
         print()
         for mt in self.monitorThreads:
             print("Starting", mt.name)
             mt.start()
 
-        time.sleep(1)
+        print()
+        self.startupStart = time.time()
+        launchTimes = {}
+        for p in self.processes:
+            print("Starting", self.processes[p].name)
+            t0 = time.time()
+            self.processes[p].start()
+            launchTimes[self.processes[p].name] = time.time() - t0
+        logging.info("Service launch times: %s" % (pprint.pformat(launchTimes),))
+
+        notReady = self.waitForServices()
+        startupMsg = "%d of %d services ready in %.3fs using %s" % (
+            len(self.processes) - len(notReady), len(self.processes),
+            time.time() - self.startupStart, multiprocessing.get_start_method())
+        print(startupMsg)
+        logging.info(startupMsg)
+        logging.info("Service time to ready: %s" % (pprint.pformat(self.readyTimes),))
+        if notReady:
+            print("Services not ready: %s" % (str(notReady),))
+            logging.error("Services not ready: %s" % (str(notReady),))
 
         # pre-launch navcam
         if LAUNCH_NAVCAM and 'navcam' in self.r.extcmds:
@@ -184,6 +250,30 @@ class Robot(object):
 
         self.mainEmbodied()
 
+    def waitForServices(self, pollInterval=0.25):
+        """Wait for each service to report ready, giving up on it at its timeout or exit.
+        Returns the names of the services that aren't ready."""
+        notReady = []
+        for pv in self.processes.values():
+            deadline = self.startupStart + SERVICE_READY_TIMEOUTS.get(pv.name, SERVICE_READY_TIMEOUT)
+            event = self.readyEvents[pv.name]
+            while not event.wait(max(min(pollInterval, deadline - time.time()), 0)):
+                if time.time() >= deadline or not pv.is_alive():
+                    notReady.append(pv.name)
+                    break
+
+        return notReady
+
+    def noteReady(self, msg):
+        if msg.name not in self.readyEvents:
+            logging.warning("Ready from unknown service: %s" % (str(msg),))
+            return
+
+        self.readyTimes[msg.name] = time.time() - self.startupStart
+        self.readyEvents[msg.name].set()
+        logging.info("%s ready after %.3fs %s" % (msg.name, self.readyTimes[msg.name],
+                                                  str(msg.info) if msg.info else ''))
+
     def mainEmbodied(self):
         while True:
             print("")
@@ -257,38 +347,70 @@ class Robot(object):
         # if type(preparedCommand) is power:
         #     print(f"Robot Exec Processing {str(preparedCommand)}")
 
-        for c in list(self.sendChannels.values()):
-            if preparedCommand != 'Shutdown':
-                chanType = c[1]['type']
-                if type(preparedCommand) in channelMap[chanType]:
-                    # logging.debug("Robot Exec: Sending - {}".format(str(c)))
-                    c[0].put(preparedCommand)
-                    # print(f"put {preparedCommand} in {str(c[0])}, {c[1]['description']}")
+        # Shutdown is a str and so has no route.  end() delivers it to the channels.
+        robroutes.route(self.routes, preparedCommand)
 
-    def monitor(self,monitorQ):
+    def dispatch(self):
+        """Handle messages from all the receive queues in arrival order"""
+        readers = list(self.dispatchReaders)
         while True:
-            msg = monitorQ.get()
-            # print "msg: %s" % (str(msg),)
-            if msg:
-                # Executive Report here is a response to a request for information,
-                #   as opposed to a command to be further dispatched by default.
-                if type(msg) is exec_report:
-                    pprint.pp(f"Executive Report on {msg.name}: {str(msg.info)}", indent=4)
-                    monitorQ.task_done()
+            for r in wait(readers):
+                cid, monitorQ = self.dispatchReaders[r]
+                try:
+                    msg = monitorQ.get_nowait()
+                except queue.Empty:
                     continue
+                self.monitorCounts[cid] += 1
+                # one bad message must not stop monitoring of every channel
+                try:
+                    self.handleMessage(msg)
+                except Exception as e:
+                    logging.error("Robot Exec: error handling %s from channel %s: %s" %
+                                  (str(msg), cid, e), exc_info=True)
+                finally:
+                    monitorQ.task_done()
+
+    def monitor(self, monitorQ, cid):
+        while True:
+            msg = monitorQ.get()
+            self.monitorCounts[cid] += 1
+            # as in dispatch, a bad message must not stop the channel's monitor
+            try:
+                self.handleMessage(msg)
+            except Exception as e:
+                logging.error("Robot Exec: error handling %s from channel %s: %s" %
+                              (str(msg), cid, e), exc_info=True)
+            finally:
+                monitorQ.task_done()
+
+    def handleMessage(self, msg):
+        # print "msg: %s" % (str(msg),)
+        if msg:
+            # Executive Report here is a response to a request for information,
+            #   as opposed to a command to be further dispatched by default.
+            if type(msg) is exec_report:
+                pprint.pp(f"Executive Report on {msg.name}: {str(msg.info)}", indent=4)
+                return
+
+            if type(msg) is ready:
+                self.noteReady(msg)
+                return
+
+            #preparedCommand = self.prepare(str(msg))
+            preparedCommand = self.prepare(msg)
+            logging.debug("Robot-{0}:\n\t{1}".format(
+                threading.current_thread().name,
+                str(msg))
+            )
+            if preparedCommand and self.acceptedCommand(preparedCommand):
+                self.execSend(preparedCommand)
+
+    def monitorStats(self):
+        """Messages handled and average rate per receive channel since start"""
+        elapsed = max(time.time() - self.startTime, 1e-6)
+        return {cid: {'messages': n, 'rate': n / elapsed}
+                for cid, n in self.monitorCounts.items()}
 
-                #preparedCommand = self.prepare(str(msg))
-                preparedCommand = self.prepare(msg)
-                logging.debug("Robot-{0}:\n\t{1}".format(
-                    threading.current_thread().name,
-                    str(msg))
-                )
-                if preparedCommand and self.acceptedCommand(preparedCommand):
-                    self.execSend(preparedCommand)   
-            
-            monitorQ.task_done()
-            
-            
     def acceptedCommand(self, command):
         return True
 
@@ -380,7 +502,7 @@ class Robot(object):
         sys.stderr.flush()
         
         for c in self.r.channelList:
-            if c['protocol'] == 'JoinableQueue' and c['direction'] == 'Send':
+            if c['protocol'] in QueueProtocols and c['direction'] == 'Send':
                 self.channels[c['id']].put('Shutdown')
                 print("Shutdown to channel:",str(c['description']),str(c['id']))
                 
@@ -428,6 +550,16 @@ class Robot(object):
 
         print('Terminated processes')
 
+        logging.info("Receive channel counts: %s" % (pprint.pformat(self.monitorStats()),))
+
+        for c in self.r.channelList:
+            if c['protocol'] == RingProtocol and c['share_queue'] == QueueNotShared:
+                ring = self.channels[c['id']]
+                # reads and overruns are per consumer, so only meaningful where this process reads
+                stats = ring.stats() if c['id'] in self.monitorChannels else ring.sharedStats()
+                logging.info("Ring buffer channel %d: %s" % (c['id'], str(stats)))
+                ring.close()
+
         self.r.noteShutdown()
         self.r.con.close()
         
@@ -436,8 +568,10 @@ class Robot(object):
 
 
 if __name__ == '__main__':
-    # arrange for Process spawning instead of forking
-    multiprocessing.set_start_method('spawn')
+    # arrange for Process spawning or a forkserver instead of forking
+    multiprocessing.set_start_method(START_METHOD)
+    if START_METHOD == 'forkserver':
+        multiprocessing.set_forkserver_preload(FORKSERVER_PRELOAD)
 
     print("Configuring log file: %s" % robLogFile)
     logging.basicConfig(
@@ -0,0 +1,134 @@
+"""
+robtargets.py - lazily imported process targets
+    Process targets are named in robot_process.target as dotted paths,
+    e.g. 'robops.opsmgr.Opsmgr'.  A LazyTarget carries only that path, so it
+    pickles cheaply into a spawned process, and the target's module is imported
+    in the child that runs it rather than in the executive.  With spawn, every
+    child re-imports the executive's main module, so keeping service imports out
+    of it keeps each child from loading every other service's dependencies.
+
+    Each child logs how long its target took to import and its resident
+    memory afterwards.
+"""
+
+__author__ = "Tal G. Ball"
+__copyright__ = "Copyright (C) 2024 Tal G. Ball"
+__license__ = "Apache License, Version 2.0"
+__version__ = "1.0"
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import importlib
+import logging
+import multiprocessing
+import resource
+from time import perf_counter
+
+
+def rss():
+    """Current resident set size in KB, or peak if /proc isn't available"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def resolve(path):
+    """Import the module named by a dotted target path and return the target"""
+    moduleName, _, attr = path.rpartition('.')
+    if not moduleName:
+        raise ValueError("Process target '%s' is not a module attribute" % path)
+    return getattr(importlib.import_module(moduleName), attr)
+
+
+class LazyTarget:
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return "LazyTarget(%r)" % (self.path,)
+
+    def __call__(self, *args, **kwargs):
+        t0 = perf_counter()
+        target = resolve(self.path)
+        importTime = perf_counter() - t0
+        msg = "%s: imported %s in %.3fs, rss %d KB" % (
+            multiprocessing.current_process().name, self.path, importTime, rss())
+        print(msg)
+        logging.info(msg)
+        return target(*args, **kwargs)
+
+
+def measureImports(modules, results):
+    """Import modules in a fresh process and report time, rss and failures"""
+    t0 = perf_counter()
+    failed = []
+    for m in modules:
+        try:
+            importlib.import_module(m)
+        except Exception as e:
+            failed.append("%s (%s: %s)" % (m, type(e).__name__, e))
+    results.put((perf_counter() - t0, rss(), failed))
+
+
+registry = {}
+
+
+def lazyTarget(path):
+    """The registered LazyTarget for path, registering it on first use"""
+    if path not in registry:
+        registry[path] = LazyTarget(path)
+    return registry[path]
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+
+    sys.path.insert(1, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    sys.path.insert(2, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+    # what the executive imported at top level before targets were lazy
+    eagerModules = ['robcom.robhttpservice', 'robcom.speechsrvcs', 'robcom.robcamservice',
+                    'robops.opsmgr', 'robops.mpops', 'robops.rangeops', 'robapps.iot.robiot']
+    targets = ['robops.opsmgr.Opsmgr', 'robcom.robhttpservice.startService',
+               'robops.rangeops.Rangeservice', 'robcom.speechsrvcs.SpeechService',
+               'robops.mpops.MPservice', 'robapps.iot.robiot.RobIoTService',
+               'robcom.robcamservice.start_service']
+
+    def run(modules):
+        results = multiprocessing.Queue()
+        p = multiprocessing.Process(target=measureImports, args=(modules, results))
+        p.start()
+        p.join(60)
+        if results.empty():
+            p.terminate()
+            return 0., 0, ["%s (child exited with %s)" % (', '.join(modules), p.exitcode)]
+        return results.get()
+
+    multiprocessing.set_start_method('spawn')
+    # every child paid the same eager cost, whatever its target
+    eager = run(eagerModules)
+    failed = set(eager[2])
+    print("%-40s %12s %10s %12s %10s" % ('target', 'eager (s)', 'eager KB', 'lazy (s)', 'lazy KB'))
+    for t in targets:
+        lazy = run([t.rpartition('.')[0]])
+        failed.update(lazy[2])
+        print("%-40s %12.3f %10d %12.3f %10d" % (t, eager[0], eager[1], lazy[0], lazy[1]))
+    for f in sorted(failed):
+        print("not importable here: %s" % (f,))
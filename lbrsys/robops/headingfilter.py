@@ -0,0 +1,187 @@
+"""
+headingfilter.py - fused heading estimate from gyro, encoders and magnetometer
+    A two state Kalman filter, heading (degrees, clockwise like the compass)
+    and gyro z bias (degrees/s), run on every motion sensor reading:
+
+    - the bias corrected gyro rate carries the heading forward between
+      readings, so the heading is smooth and current at the sensor rate
+    - the magnetometer heading corrects the heading slowly, so it stays
+      anchored to the compass without taking on the magnetometer's noise
+    - the encoders' differential yaw rate is compared with the gyro rate to
+      correct the gyro bias, unless the two disagree by more than
+      encoderGate, when the wheels are taken to be slipping
+
+    The yaw rate published with the heading is the bias corrected gyro rate.
+"""
+
+__author__ = "Tal G. Ball"
+__copyright__ = "Copyright (C) 2024 Tal G. Ball"
+__license__ = "Apache License, Version 2.0"
+__version__ = "1.0"
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+from math import degrees
+
+from lbrsys import headingEstimate, move_config
+from lbrsys.robops.odometry import wheelScales
+
+
+def wrap(angle):
+    """angle in (-180, 180]"""
+    angle = angle % 360.
+    return angle - 360. if angle > 180. else angle
+
+
+class HeadingFilter:
+    # gyro z is counter clockwise positive for a z up sensor, headings are clockwise
+    gyroSign = -1.
+
+    qHeading = 0.5          # heading process noise, deg^2 per s
+    qBias = 0.01            # gyro bias random walk, (deg/s)^2 per s
+    rMag = 100.             # magnetometer heading variance, deg^2
+    rEncoder = 4.           # encoder yaw rate variance, (deg/s)^2
+    encoderGate = 30.       # deg/s of gyro / encoder disagreement taken as wheel slip
+    maxCountAge = 0.2       # s, older counts are not used
+    encoderWindow = 0.25    # s of counts per encoder rate, long enough to span several counts
+
+    def __init__(self, config=None):
+        self.config = config or move_config()
+        self.leftScale, self.rightScale = wheelScales(self.config)
+        self.heading = None
+        self.bias = 0.
+        self.P = [[self.rMag, 0.], [0., 1.]]
+        self.lastTime = None
+        self.lastCount = None
+        self.windowAngle = 0.   # gyro degrees turned since lastCount
+        self.windowTime = 0.
+        self.rate = 0.
+        self.stats = {'updates': 0, 'magUpdates': 0, 'encoderUpdates': 0, 'slips': 0}
+
+    def predict(self, rate, dt):
+        self.heading += (rate - self.bias) * dt
+        (p00, p01), (p10, p11) = self.P
+        self.P = [[p00 - dt * (p01 + p10) + dt * dt * p11 + self.qHeading * dt, p01 - dt * p11],
+                  [p10 - dt * p11, p11 + self.qBias * dt]]
+
+    def correctHeading(self, heading):
+        """Magnetometer heading measurement"""
+        (p00, p01), (p10, p11) = self.P
+        y = wrap(heading - self.heading)
+        s = p00 + self.rMag
+        k0, k1 = p00 / s, p10 / s
+        self.heading += k0 * y
+        self.bias += k1 * y
+        self.P = [[(1. - k0) * p00, (1. - k0) * p01],
+                  [p10 - k1 * p00, p11 - k1 * p01]]
+        self.stats['magUpdates'] += 1
+
+    def correctBias(self, gyroRate, encoderRate):
+        """The gyro rate less the encoder rate, over the same time, measures the gyro bias"""
+        (p00, p01), (p10, p11) = self.P
+        y = gyroRate - encoderRate - self.bias
+        if abs(y) > self.encoderGate:
+            self.stats['slips'] += 1
+            return
+        s = p11 + self.rEncoder
+        k0, k1 = p01 / s, p11 / s
+        self.heading += k0 * y
+        self.bias += k1 * y
+        self.P = [[p00 - k0 * p10, p01 - k0 * p11],
+                  [(1. - k1) * p10, (1. - k1) * p11]]
+        self.stats['encoderUpdates'] += 1
+
+    def encoderRate(self, c, t):
+        """Heading rate in deg/s over the last encoderWindow of fresh counts, or None"""
+        if c is None:
+            return None
+        last = self.lastCount
+        if last is None or c.time < last.time or t - c.time > self.maxCountAge:
+            self.startWindow(c)
+            return None
+        if c.time - last.time < self.encoderWindow:
+            return None
+        self.startWindow(c)
+        dl = (c.left - last.left) * self.leftScale
+        dr = (c.right - last.right) * self.rightScale
+        # odometry's theta is counter clockwise
+        return -degrees((dr - dl) / self.config.wheel_base) / (c.time - last.time)
+
+    def startWindow(self, c):
+        self.lastCount = c
+        self.windowAngle = 0.
+        self.windowTime = 0.
+
+    def update(self, m, c=None):
+        """
+        Filter an mpuData reading, with the latest encoder count if there is one.
+        Returns the headingEstimate.
+        """
+        self.stats['updates'] += 1
+        gyroRate = self.gyroSign * m.gyro.z
+        if self.heading is None:
+            self.heading = m.heading
+        else:
+            dt = m.time - self.lastTime
+            if dt > 0:
+                self.predict(gyroRate, dt)
+                self.windowAngle += gyroRate * dt
+                self.windowTime += dt
+            self.correctHeading(m.heading)
+        self.lastTime = m.time
+
+        windowAngle, windowTime = self.windowAngle, self.windowTime
+        encoderRate = self.encoderRate(c, m.time)
+        if encoderRate is not None and windowTime > 0:
+            self.correctBias(windowAngle / windowTime, encoderRate)
+
+        self.heading %= 360.
+        self.rate = gyroRate - self.bias
+        return headingEstimate(self.heading, self.rate, self.bias, m.time)
+
+
+if __name__ == '__main__':
+    import random
+    from lbrsys import mpuData, gyro, count
+
+    random.seed(1)
+    config = move_config()
+    leftScale, rightScale = wheelScales(config)
+    f = HeadingFilter(config)
+
+    # 60s at 100Hz: turn at 20 deg/s for 5s out of every 15s, with a biased
+    # gyro and a noisy magnetometer
+    rate, dt, gyroBias, magNoise = 20., 0.010, 1.5, 8.
+    heading, left, right = 90., 0., 0.
+    magErrors, filterErrors = [], []
+    for i in range(6000):
+        t = i * dt
+        turnRate = rate if (t % 15.) < 5. else 0.
+        heading = (heading + turnRate * dt) % 360.
+        # a clockwise turn drives the left wheel forward and the right back
+        dWheel = config.wheel_base / 2. * turnRate / 180. * 3.14159265 * dt
+        left += dWheel / leftScale
+        right -= dWheel / rightScale
+        z = -(turnRate + gyroBias) + random.gauss(0., 0.5)
+        magHeading = (heading + random.gauss(0., magNoise)) % 360.
+        m = mpuData(gyro(0., 0., z, t), heading=magHeading, time=t)
+        e = f.update(m, count(int(left), int(right), t) if i % 2 == 0 else None)
+        if t > 5.:
+            magErrors.append(wrap(magHeading - heading) ** 2)
+            filterErrors.append(wrap(e.heading - heading) ** 2)
+
+    print("RMS heading error, magnetometer: %.2f deg, filtered: %.2f deg" % (
+        (sum(magErrors) / len(magErrors)) ** 0.5, (sum(filterErrors) / len(filterErrors)) ** 0.5))
+    print("gyro bias: actual %.2f, estimated %.2f deg/s" % (gyroBias, f.bias))
+    print(f.stats)
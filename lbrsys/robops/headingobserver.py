@@ -25,7 +25,7 @@ import queue
 from time import time as robtimer # legacy naming issue
 import time
 
-from lbrsys import mpuData
+from lbrsys import mpuData, headingEstimate
 from lbrsys.settings import headingobserverLogFile
 from .opsmgr import calcDirection
 
@@ -88,7 +88,8 @@ class HeadingObserver(object):
 
     def update(self,reading):
 
-        if not isinstance(reading, mpuData):
+        # the fused heading estimate, or a raw mpuData reading
+        if not isinstance(reading, (headingEstimate, mpuData)):
             return
         else:
             mpuReading = reading
@@ -141,6 +142,14 @@ class HeadingObserver(object):
 
         return
 
+    def updateBatch(self, batch):
+        """Check each of a batch of mpbatch samples' fused heading, up to the one that decides"""
+        for row in batch:
+            if self.observed or self.missed:
+                break
+            self.update(headingEstimate(float(row['fusedHeading']), float(row['rate']),
+                                        0., float(row['time'])))
+
 
 if __name__ == '__main__':
     import sys
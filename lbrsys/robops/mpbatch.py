@@ -0,0 +1,218 @@
+"""
+mpbatch.py - high rate, batched motion sensor sampling
+    The BatchSampler reads the motion sensor at a fixed rate, 100-200 Hz,
+    into a preallocated numpy record array, one row per sample holding the
+    raw reading and the fused heading and yaw rate from the heading filter.
+    Observers then work through a whole batch at once, so a turn observation
+    integrates the yaw rate at the full sample rate, while registers and
+    broadcasts get one decimated summary reading per batch.
+
+    With a driver that samples into a FIFO, such as the MPU9150 with fifo
+    enabled, the sampler drains the FIFO once per batch period instead of
+    reading each sample, and the batch holds every sample the device took.
+
+    Run this module for a benchmark of the achievable sample rate and the CPU
+    time per sample, with a simulated sensor.
+"""
+
+__author__ = "Tal G. Ball"
+__copyright__ = "Copyright (C) 2024 Tal G. Ball"
+__license__ = "Apache License, Version 2.0"
+__version__ = "1.0"
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import time
+from time import time as robtimer
+
+import numpy as np
+
+from lbrsys import gyro, accel, mag, mpuData, headingEstimate
+
+
+SAMPLE_DTYPE = np.dtype([('time', 'f8'),
+                         ('gx', 'f8'), ('gy', 'f8'), ('gz', 'f8'),
+                         ('ax', 'f8'), ('ay', 'f8'), ('az', 'f8'),
+                         ('mx', 'f8'), ('my', 'f8'), ('mz', 'f8'),
+                         ('heading', 'f8'), ('temp', 'f8'),
+                         ('fusedHeading', 'f8'), ('rate', 'f8')])   # from the heading filter
+
+
+def summarize(batch, latest=None):
+    """
+    One mpuData reading for a batch: means of the readings, as of its last sample.
+    The orientation, such as the RIOX's AHRS quaternion, comes from latest, the
+    driver's latest reading, since the batch doesn't hold it.
+    """
+    t = float(batch['time'][-1])
+    h = np.radians(batch['heading'])
+    heading = np.degrees(np.arctan2(np.sin(h).mean(), np.cos(h).mean())) % 360.
+    means = [float(batch[name].mean()) for name in ('gx', 'gy', 'gz', 'ax', 'ay', 'az', 'mx', 'my', 'mz')]
+    summary = mpuData(gyro(*means[0:3], t), accel(*means[3:6]), mag(*means[6:9]),
+                      float(heading), float(batch['temp'].mean()), t)
+    if latest is not None:
+        summary = summary._replace(quat=latest.quat, qangle=latest.qangle)
+    return summary
+
+
+class BatchSampler:
+    def __init__(self, mpu, rate=200., batchSize=10, headingFilter=None, countRegister=None):
+        self.mpu = mpu
+        self.period = 1. / rate
+        self.fifo = getattr(mpu, 'fifo', False)
+        if self.fifo:
+            # the device sets the sample rate, and a drain can hold a whole FIFO
+            self.period = mpu.fifoPeriod
+            self.batchPeriod = batchSize * self.period
+            batchSize = max(batchSize, mpu.fifoCapacity)
+        self.batch = np.zeros(batchSize, dtype=SAMPLE_DTYPE)
+        self.headingFilter = headingFilter
+        self.countRegister = countRegister
+        self.estimate = headingEstimate()
+        self.nextSample = None
+        self.stats = {'samples': 0, 'badSamples': 0, 'batches': 0, 'lateSamples': 0,
+                      'sleepTime': 0., 'cpuTime': 0., 'startTime': robtimer()}
+
+    def sampleBatch(self):
+        """Read a batch of samples at the sample rate. Returns the rows of good readings."""
+        if self.fifo:
+            return self.drainBatch()
+
+        batch = self.batch
+        stats = self.stats
+        # one encoder count per batch is plenty for the heading filter's bias correction
+        c = self.countRegister.read() if self.countRegister else None
+        if self.nextSample is None:
+            self.nextSample = robtimer()
+
+        # a bad reading leaves its row out, so the batch still takes its usual time
+        n = 0
+        for i in range(len(batch)):
+            wait = self.nextSample - robtimer()
+            if wait > 0:
+                time.sleep(wait)
+                stats['sleepTime'] += wait
+            elif wait < -self.period:
+                # fell behind, so start the schedule over rather than read in a burst
+                stats['lateSamples'] += 1
+                self.nextSample = robtimer()
+            self.nextSample += self.period
+
+            cpu0 = time.process_time()
+            m = self.mpu.read()
+            if m.gyro.z is None:
+                stats['badSamples'] += 1
+                stats['cpuTime'] += time.process_time() - cpu0
+                continue
+            if self.headingFilter:
+                e = self.estimate = self.headingFilter.update(m, c)
+                c = None
+                fusedHeading, rate = e.heading, e.rate
+            else:
+                fusedHeading, rate = m.heading, m.gyro.z
+            g, a, mg = m.gyro, m.accel, m.mag
+            batch[n] = (m.time, g.x, g.y, g.z, a.x, a.y, a.z, mg.x, mg.y, mg.z,
+                        m.heading, m.temp, fusedHeading, rate)
+            n += 1
+            stats['cpuTime'] += time.process_time() - cpu0
+
+        stats['samples'] += n
+        stats['batches'] += 1
+        return batch[:n]
+
+    def drainBatch(self):
+        """Drain the device's FIFO once per batch period. Returns the samples."""
+        stats = self.stats
+        if self.nextSample is None:
+            self.nextSample = robtimer()
+        wait = self.nextSample - robtimer()
+        if wait > 0:
+            time.sleep(wait)
+            stats['sleepTime'] += wait
+        elif wait < -self.batchPeriod:
+            stats['lateSamples'] += 1
+            self.nextSample = robtimer()
+        self.nextSample += self.batchPeriod
+
+        cpu0 = time.process_time()
+        c = self.countRegister.read() if self.countRegister else None
+        samples = self.mpu.readFifo()
+        n = min(len(samples), len(self.batch))
+        samples = samples[-n:] if n else samples[:0]
+        batch = self.batch[:n]
+        for name in samples.dtype.names:
+            batch[name] = samples[name]
+
+        # the magnetometer is much slower, so the batch shares the latest reading
+        m = self.mpu.lastsu
+        batch['mx'], batch['my'], batch['mz'] = m.mag.x, m.mag.y, m.mag.z
+        batch['heading'] = m.heading
+        if self.headingFilter:
+            for row in batch:
+                t = float(row['time'])
+                e = self.estimate = self.headingFilter.update(
+                    mpuData(gyro(0., 0., float(row['gz']), t), heading=m.heading, time=t), c)
+                c = None
+                row['fusedHeading'], row['rate'] = e.heading, e.rate
+        else:
+            batch['fusedHeading'] = m.heading
+            batch['rate'] = batch['gz']
+
+        stats['samples'] += n
+        stats['batches'] += 1
+        stats['cpuTime'] += time.process_time() - cpu0
+        return batch
+
+    def getStats(self):
+        stats = dict(self.stats)
+        elapsed = max(robtimer() - stats.pop('startTime'), 1e-6)
+        stats['sampleRate'] = stats['samples'] / elapsed
+        stats['cpuPerSample'] = stats['cpuTime'] / max(stats['samples'], 1)
+        return stats
+
+
+if __name__ == '__main__':
+    import math
+    import queue
+    from lbrsys.robops import observer
+    from lbrsys.robops.headingfilter import HeadingFilter
+
+    class SimulatedMPU:
+        """Turning at 45 deg/s, with a short bus transaction per read"""
+        def read(self):
+            t = robtimer()
+            time.sleep(0.0004)     # blocked on the bus rather than using CPU
+            heading = (t * 45.) % 360.
+            return mpuData(gyro(0., 0., -45., t), accel(0., 0., 1.),
+                           mag(math.cos(math.radians(heading)), math.sin(math.radians(heading)), 0.),
+                           heading, 30., t)
+
+    print("%8s %6s %12s %12s %14s %10s" % ('rate', 'batch', 'samples/s', 'cpu/sample', 'cpu/s', 'late'))
+    for rate, batchSize in ((10., 1), (100., 10), (200., 10), (400., 20), (1000., 50)):
+        sampler = BatchSampler(SimulatedMPU(), rate, batchSize, HeadingFilter())
+        q = queue.Queue()
+        o = observer.Observer(3600., q)
+        t0 = robtimer()
+        cpu0 = time.process_time()
+        while robtimer() - t0 < 2.:
+            batch = sampler.sampleBatch()
+            o.updateBatch(batch)
+            summary = summarize(batch)
+        cpu = time.process_time() - cpu0
+        s = sampler.getStats()
+        print("%8.0f %6d %12.1f %10.1fus %12.1fms %10d" % (
+            rate, batchSize, s['sampleRate'], s['cpuPerSample'] * 1e6,
+            cpu / 2. * 1000., s['lateSamples']))
+        print("%15s turn integrated %.1f deg in %.3fs (%.1f deg/s)" % (
+            '', o.cumulativeAngle, o.totalTime, o.cumulativeAngle / max(o.totalTime, 1e-6)))
@@ -31,16 +31,27 @@ import multiprocessing
 import threading
 import queue
 
+import numpy as np
+
 if __name__ == '__main__':
     sys.path.append('..')
 
 from lbrsys import power, gyro, observeHeading, observeTurn
-from lbrsys import calibrateMagnetometer
+from lbrsys import calibrateMagnetometer, ready, telemetryRate
+import lbrsys
 from lbrsys.settings import mpLogFile
+try:
+    from lbrsys.settings import MP_HIGH_RATE, MP_SAMPLE_RATE, MP_BATCH_SIZE
+except ImportError:
+    MP_HIGH_RATE = False
 
 # import robdrivers.mpu9150rpi
 from lbrsys.robops import observer
 from lbrsys.robops import headingobserver
+from lbrsys.robops import headingfilter
+from lbrsys.robops import mpbatch
+from lbrsys.robcom import shmregister
+from lbrsys.robcom import telemetryrates
 
 from lbrsys.settings import RIOX_1216AHRS_Port
 
@@ -60,23 +71,28 @@ if proc.name  == 'Motion Processing Services':# or proc.name == 'MainProcess':
                         format='[%(levelname)s] (%(processName)-10s) %(message)s', )
 
 class MPservice(object):
-    def __init__(self, commandQ=None, broadcastQ=None):
+    def __init__(self, commandQ=None, broadcastQ=None, sampleQ=None):
         self.commandQ = commandQ
         self.broadcastQ = broadcastQ
+        self.sampleQ = sampleQ  # every reading, typically a RingBuffer channel
         # self.mpu       = robdrivers.mpu9150rpi.MPU9150_A()
         self.mpu = MPU_CLASS()
+        self.mpuRegister = shmregister.MpuRegister(create=True)
+        # observers and operations use the fused heading rather than raw readings
+        self.headingFilter = headingfilter.HeadingFilter(lbrsys.robot_move_config)
+        self.headingRegister = shmregister.HeadingRegister(create=True)
+        self.countRegister = shmregister.CountRegister()
         self.lastLogTime= 0
         self.observers  = []
         self.mpu.gyroPub.addSubscriber(self.genericSubscriber)
-        self.mpu.gyroPub.addSubscriber(self.updateObservers)
         self.mpu.mpuPub.addSubscriber(self.genericSubscriber)
-        self.mpu.mpuPub.addSubscriber(self.updateObservers)
         self.curtime = robtimer()
         # self.minLoopTime = 0.010
         self.minLoopTime = 0.100
         self.mpuLogInterval = 15.
-        self.mpuReportInterval = 2.
+        self.telemetryRates = telemetryrates.RateSubscriptions()
         self.lastMpuReportTime = 0.
+        self.sampler = None
 
         ta = time.asctime()
         startmsg = "%s: Starting Motion Processing Operations" % (ta,)
@@ -84,9 +100,14 @@ class MPservice(object):
         logging.debug(startmsg)
         logging.debug("commandQ = %s\nbroadcastQ = %s" %
                       (str(commandQ),str(broadcastQ)))
+        self.broadcastQ.put(ready(proc.name, robtimer()))
         self.start()
 
     def start(self):
+        if MP_HIGH_RATE:
+            self.startBatched()
+            return
+
         self.curtime = robtimer()
         
         opsStats = {'totalLoopTime':0, 'numLoops':0,
@@ -106,21 +127,21 @@ class MPservice(object):
             
             if gyroReading.z != None :
                 opsStats['successfulReadings'] += 1
-                if robtimer() - self.lastMpuReportTime > self.mpuReportInterval:
+                self.mpuRegister.write(mpuReading)
+                estimate = self.headingFilter.update(mpuReading, self.countRegister.read())
+                self.headingRegister.write(estimate)
+                self.updateObservers(estimate)
+                if self.sampleQ is not None:
+                    self.sampleQ.put(mpuReading)
+                if robtimer() - self.lastMpuReportTime > self.telemetryRates.interval('MPU'):
                     self.broadcastQ.put(mpuReading)
                     self.lastMpuReportTime = robtimer()
             else:
                 opsStats['badReadings'] += 1
             
-            if not self.commandQ.empty():
-                task = self.commandQ.get_nowait()
-                logging.debug("%s: mpops task is: %s" % (time.asctime(), str(task)))
-                self.commandQ.task_done()
-                self.execTask(task)
-                
-                if task == 'Shutdown':
-                    self.processStats(opsStats)
-                    break
+            if self.checkCommands():
+                self.processStats(opsStats)
+                break
 
             elapsedTime = robtimer() - loopStartTime
             waitTime = self.minLoopTime - elapsedTime
@@ -137,6 +158,52 @@ class MPservice(object):
             
         self.end()
 
+    def startBatched(self):
+        """
+        High rate mode: sample at MP_SAMPLE_RATE into batches of MP_BATCH_SIZE and
+        run the observers on each batch.  The registers, sampleQ and broadcasts get
+        one summary reading per batch.
+        """
+        self.sampler = mpbatch.BatchSampler(self.mpu, MP_SAMPLE_RATE, MP_BATCH_SIZE,
+                                            self.headingFilter, self.countRegister)
+        opsStats = {'totalLoopTime':0, 'numLoops':0, 'emptyBatches':0}
+
+        while True:
+            loopStartTime = robtimer()
+            opsStats['numLoops'] += 1
+
+            batch = self.sampler.sampleBatch()
+            if len(batch) > 0:
+                mpuReading = mpbatch.summarize(batch, self.mpu.lastsu)
+                self.mpuRegister.write(mpuReading)
+                self.headingRegister.write(self.sampler.estimate)
+                self.updateObservers(batch)
+                if self.sampleQ is not None:
+                    self.sampleQ.put(mpuReading)
+                if robtimer() - self.lastMpuReportTime > self.telemetryRates.interval('MPU'):
+                    self.broadcastQ.put(mpuReading)
+                    self.lastMpuReportTime = robtimer()
+            else:
+                opsStats['emptyBatches'] += 1
+
+            if self.checkCommands():
+                self.processStats(opsStats)
+                break
+
+            opsStats['totalLoopTime'] += robtimer() - loopStartTime
+
+        self.end()
+
+    def checkCommands(self):
+        """Execute a pending task, if any. Returns True on Shutdown."""
+        if self.commandQ.empty():
+            return False
+        task = self.commandQ.get_nowait()
+        logging.debug("%s: mpops task is: %s" % (time.asctime(), str(task)))
+        self.commandQ.task_done()
+        self.execTask(task)
+        return task == 'Shutdown'
+
         
     def genericSubscriber(self, msg):
         if self.lastLogTime == 0:
@@ -146,6 +213,7 @@ class MPservice(object):
             self.lastLogTime = time.time()
         if robtimer() - self.lastLogTime >= self.mpuLogInterval:
             logging.debug(str(msg))
+            logging.debug("mpu read errors: %s" % (self.mpu.getStats()['readErrors'],))
             self.lastLogTime = time.time()
 
  
@@ -161,6 +229,9 @@ class MPservice(object):
         if isinstance(task, observeHeading):
             headingObserver = self.addHeadingObserver(task.heading, self.broadcastQ)
 
+        if type(task) is telemetryRate:
+            self.telemetryRates.subscribe(task)
+
         if type(task) is calibrateMagnetometer:
             try:
                 self.mpu.calibrateMag(task.samples, task.source)
@@ -188,21 +259,32 @@ class MPservice(object):
             self.observers.remove(turnObserver)
 
     def updateObservers(self, reading):
+        # reading is a headingEstimate, or a batch of samples in high rate mode
         for turnObserver in self.observers:
             if not turnObserver.observed and not turnObserver.missed:
-                turnObserver.update(reading)
+                if isinstance(reading, np.ndarray):
+                    turnObserver.updateBatch(reading)
+                else:
+                    turnObserver.update(reading)
             else:
                 self.removeObserver(turnObserver)
         
     def processStats(self,opsStats):
         opsStats['AverageLoopTime'] = opsStats['totalLoopTime']/opsStats['numLoops']
-        if opsStats['numWaits'] != 0:
+        if opsStats.get('numWaits'):
             opsStats['AverageWaitTime:'] = opsStats['totalWaitTime']/opsStats['numWaits']
+        opsStats['headingFilter'] = dict(self.headingFilter.stats, bias=self.headingFilter.bias)
+        if self.sampler is not None:
+            opsStats['sampler'] = self.sampler.getStats()
+        opsStats['mpu'] = self.mpu.getStats()
         logging.debug("Motion Processing Services Operational Statistics")
         logging.debug("%s\n" % (pprint.pformat(opsStats)))
 
     def end(self):
         self.mpu.close()
+        self.mpuRegister.close()
+        self.headingRegister.close()
+        self.countRegister.close()
 
 
 
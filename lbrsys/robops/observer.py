@@ -28,7 +28,9 @@ import os
 import logging
 import queue
 
-from lbrsys import gyro
+import numpy as np
+
+from lbrsys import gyro, headingEstimate
 from lbrsys.settings import gyroLogFile
 
 
@@ -63,7 +65,10 @@ class Observer(object):
 
     def update(self, reading):
 
-        if not isinstance(reading, gyro):
+        if isinstance(reading, headingEstimate):
+            # the fused yaw rate, with the gyro bias removed
+            gyroReading = gyro(0, 0, reading.rate, reading.time)
+        elif not isinstance(reading, gyro):
             return
         else:
             gyroReading = reading
@@ -94,18 +99,56 @@ class Observer(object):
         self.lastTime = self.curtime
 
         if self.cumulativeAngle >= abs(self.targetAngle):
-            self.qOut.put(('Observed', self.cumulativeAngle, self.totalTime))
-            self.observed = True
-            reportStr = "Angle observed: %.2f, elapsed: %.4f, updates: %d, avg speed %.2f deg/sec"
-            logging.debug(reportStr % \
-                          (self.cumulativeAngle, self.totalTime,
-                           self.totalUpdates, self.speedSum/self.totalUpdates))
-            print(reportStr % \
-                          (self.cumulativeAngle, self.totalTime,
-                           self.totalUpdates, self.speedSum/self.totalUpdates))
-            print("Completed at", time.asctime())
-            
-            self.dLF.close()
+            self.reportObserved()
+
+    def updateBatch(self, batch):
+        """
+        Integrate a batch of mpbatch samples in one pass, with the fused yaw rate,
+        stopping at the sample where the angle is achieved.
+        """
+        if self.observed or len(batch) == 0:
+            return
+
+        speeds = np.abs(batch['rate'])
+        times = batch['time']
+        deltats = np.diff(times, prepend=self.lastTime)
+        angles = self.cumulativeAngle + np.cumsum(
+            (speeds + np.concatenate(([self.lastAngleSpeed], speeds[:-1]))) / 2.0 * deltats)
+
+        crossed = np.flatnonzero(angles >= abs(self.targetAngle))
+        n = crossed[0] + 1 if len(crossed) else len(batch)
+
+        if self.lastAngleSpeed == 0 and speeds[0] != 0:
+            print('Turn started after %f' % self.totalTime)
+
+        totalTimes = self.totalTime + np.cumsum(deltats[:n])
+        self.dLF.write(''.join('%d\t%2.2f\t%.4f\t%.4f\t%.4f\t%.4f\n' %
+                               (self.totalUpdates + i + 1, speeds[i], times[i],
+                                deltats[i], totalTimes[i], angles[i]) for i in range(n)))
+
+        self.totalUpdates += n
+        self.speedSum += float(speeds[:n].sum())
+        self.totalTime = float(totalTimes[-1])
+        self.cumulativeAngle = float(angles[n - 1])
+        self.lastAngleSpeed = float(speeds[n - 1])
+        self.curtime = self.lastTime = float(times[n - 1])
+
+        if len(crossed):
+            self.reportObserved()
+
+    def reportObserved(self):
+        self.qOut.put(('Observed', self.cumulativeAngle, self.totalTime))
+        self.observed = True
+        reportStr = "Angle observed: %.2f, elapsed: %.4f, updates: %d, avg speed %.2f deg/sec"
+        logging.debug(reportStr % \
+                      (self.cumulativeAngle, self.totalTime,
+                       self.totalUpdates, self.speedSum/self.totalUpdates))
+        print(reportStr % \
+                      (self.cumulativeAngle, self.totalTime,
+                       self.totalUpdates, self.speedSum/self.totalUpdates))
+        print("Completed at", time.asctime())
+
+        self.dLF.close()
 
             
     def getTestData(self):
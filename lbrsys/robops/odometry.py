@@ -0,0 +1,159 @@
+"""
+odometry.py - encoder odometry and pose estimation
+    Integrate wheel encoder counts into the robot's pose: x and y in cm from
+    where counting started, theta in radians counter clockwise from the
+    starting direction, and the linear (cm/s) and angular (rad/s) velocities.
+
+    Odometry.update integrates each count as it arrives from the motor
+    controller.  integrate does the same for a whole recording of counts at
+    once with numpy, for re-integrating count logs offline, e.g. to try other
+    wheel parameters.  Both use the same midpoint (arc) approximation, so they
+    agree on the same counts.
+"""
+
+__author__ = "Tal G. Ball"
+__copyright__ = "Copyright (C) 2024 Tal G. Ball"
+__license__ = "Apache License, Version 2.0"
+__version__ = "1.0"
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import re
+from math import pi, sin, cos
+
+import numpy as np
+
+from lbrsys import pose, move_config
+
+
+def wheelScales(config):
+    """cm travelled per count for the left and right wheels, signed so forward is positive"""
+    cmPerCount = pi * config.wheel_diameter / config.counts_per_rev
+    return cmPerCount * config.m1_direction, cmPerCount * config.m2_direction
+
+
+class Odometry:
+    def __init__(self, config=None):
+        self.config = config or move_config()
+        self.leftScale, self.rightScale = wheelScales(self.config)
+        self.lastCount = None
+        self.pose = pose()
+        self.updates = 0
+
+    def reset(self):
+        self.lastCount = None
+        self.pose = pose()
+
+    def update(self, c):
+        """Integrate the change since the last count. Returns the new pose."""
+        last, self.lastCount = self.lastCount, c
+        if last is None:
+            self.pose = self.pose._replace(time=c.time)
+            return self.pose
+
+        dl = (c.left - last.left) * self.leftScale
+        dr = (c.right - last.right) * self.rightScale
+        dt = c.time - last.time
+        ds = (dl + dr) / 2.
+        dTheta = (dr - dl) / self.config.wheel_base
+
+        p = self.pose
+        heading = p.theta + dTheta / 2.
+        v, omega = (ds / dt, dTheta / dt) if dt > 0 else (p.v, p.omega)
+        self.pose = pose(p.x + ds * cos(heading), p.y + ds * sin(heading),
+                         p.theta + dTheta, v, omega, c.time)
+        self.updates += 1
+        return self.pose
+
+
+def integrate(counts, config=None, start=None):
+    """
+    Vectorized odometry over a recording of counts.
+    :param counts: array like of (left, right, time) rows, in time order
+    :param config: move_config
+    :param start: pose at the first count, default the origin
+    :return: structured array with a pose field for each count
+    """
+    config = config or move_config()
+    start = start or pose()
+    counts = np.asarray(counts, dtype=float)
+    leftScale, rightScale = wheelScales(config)
+
+    dl = np.diff(counts[:, 0]) * leftScale
+    dr = np.diff(counts[:, 1]) * rightScale
+    dt = np.diff(counts[:, 2])
+    ds = (dl + dr) / 2.
+    dTheta = (dr - dl) / config.wheel_base
+
+    theta = start.theta + np.concatenate(([0.], np.cumsum(dTheta)))
+    heading = theta[:-1] + dTheta / 2.
+
+    result = np.zeros(len(counts), dtype=[(f, float) for f in pose._fields])
+    result['x'] = start.x + np.concatenate(([0.], np.cumsum(ds * np.cos(heading))))
+    result['y'] = start.y + np.concatenate(([0.], np.cumsum(ds * np.sin(heading))))
+    result['theta'] = theta
+    result['time'] = counts[:, 2]
+
+    # velocities carry forward over repeated timestamps, as in Odometry.update
+    with np.errstate(divide='ignore', invalid='ignore'):
+        v = np.where(dt > 0, ds / dt, np.nan)
+        omega = np.where(dt > 0, dTheta / dt, np.nan)
+    for field, rates, first in (('v', v, start.v), ('omega', omega, start.omega)):
+        rates = np.concatenate(([first], rates))
+        valid = ~np.isnan(rates)
+        result[field] = rates[np.maximum.accumulate(np.where(valid, np.arange(len(rates)), 0))]
+
+    return result
+
+
+countPattern = re.compile(r"'left': (-?\d+), 'right': (-?\d+), 'time': ([\d.e+-]+)")
+
+
+def loadCounts(logfile):
+    """(left, right, time) rows from the Count telemetry recorded in an ops log"""
+    with open(logfile) as f:
+        rows = [m.groups() for m in map(countPattern.search, f) if m]
+    return np.array(rows, dtype=float).reshape(-1, 3)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    from lbrsys import count
+
+    config = move_config()
+    if len(sys.argv) > 1:
+        counts = loadCounts(sys.argv[1])
+    else:
+        # a curving drive at 50Hz: right wheel a little faster than the left
+        n = 30000
+        t = np.arange(n) * 0.020
+        left = np.cumsum(np.full(n, 10)) * config.m1_direction
+        right = np.cumsum(np.full(n, 12)) * config.m2_direction
+        counts = np.column_stack((left, right, t))
+
+    t0 = time.perf_counter()
+    poses = integrate(counts, config)
+    tVector = time.perf_counter() - t0
+
+    o = Odometry(config)
+    t0 = time.perf_counter()
+    for left, right, t in counts:
+        p = o.update(count(left, right, t))
+    tLoop = time.perf_counter() - t0
+
+    last = poses[-1]
+    assert np.allclose([last[f] for f in pose._fields], p, rtol=1e-6, atol=1e-6), (last, p)
+    print("%d counts, final pose: %s" % (len(counts), p))
+    print("integrate: %.1fms, update loop: %.1fms" % (tVector * 1000., tLoop * 1000.))
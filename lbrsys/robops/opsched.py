@@ -0,0 +1,125 @@
+"""
+opsched.py - deadline scheduler for operations loops
+    Periodic jobs each have their own period.  A loop asks the scheduler how
+    long it may sleep, waits for that long or until a command arrives, and then
+    runs whichever jobs are due.  Each job keeps statistics on how late it ran
+    relative to its deadline (wake latency) and how long it took.
+"""
+
+__author__ = "Tal G. Ball"
+__copyright__ = "Copyright (C) 2024 Tal G. Ball"
+__license__ = "Apache License, Version 2.0"
+__version__ = "1.0"
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+import heapq
+import itertools
+from time import time as robtimer
+
+
+class Job:
+    def __init__(self, name, period, func):
+        self.name = name
+        self.period = period
+        self.func = func
+        self.runs = 0
+        self.skipped = 0        # periods missed entirely because the job ran late
+        self.totalLate = 0.
+        self.maxLate = 0.
+        self.totalTime = 0.
+        self.maxTime = 0.
+
+    def stats(self):
+        runs = max(self.runs, 1)
+        return {'period': self.period, 'runs': self.runs, 'skipped': self.skipped,
+                'avgLate': self.totalLate / runs, 'maxLate': self.maxLate,
+                'avgTime': self.totalTime / runs, 'maxTime': self.maxTime}
+
+
+class DeadlineScheduler:
+    def __init__(self):
+        self.jobs = {}
+        self.deadlines = []     # heap of (deadline, sequence, job)
+        self.sequence = itertools.count()
+
+    def add(self, name, period, func, first=None):
+        """Run func every period seconds, first at time first (default now)"""
+        job = Job(name, period, func)
+        self.jobs[name] = job
+        heapq.heappush(self.deadlines,
+                       (robtimer() if first is None else first, next(self.sequence), job))
+        return job
+
+    def nextDeadline(self):
+        return self.deadlines[0][0] if self.deadlines else None
+
+    def timeout(self):
+        """Seconds until the next deadline, or None if there are no jobs"""
+        deadline = self.nextDeadline()
+        return None if deadline is None else max(deadline - robtimer(), 0.)
+
+    def runDue(self):
+        """Run each job whose deadline has passed. Returns the number run."""
+        n = 0
+        now = robtimer()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, seq, job = heapq.heappop(self.deadlines)
+            late = now - deadline
+            job.func()
+            t = robtimer()
+
+            job.runs += 1
+            job.totalLate += late
+            job.maxLate = max(job.maxLate, late)
+            job.totalTime += t - now
+            job.maxTime = max(job.maxTime, t - now)
+
+            # keep to the original cadence, skipping periods that were missed
+            nextDeadline = deadline + job.period
+            if nextDeadline <= t:
+                missed = int((t - nextDeadline) / job.period) + 1
+                job.skipped += missed
+                nextDeadline += missed * job.period
+            heapq.heappush(self.deadlines, (nextDeadline, next(self.sequence), job))
+
+            n += 1
+            now = t
+
+        return n
+
+    def stats(self):
+        return {name: job.stats() for name, job in self.jobs.items()}
+
+
+if __name__ == '__main__':
+    import time
+    import pprint
+
+    s = DeadlineScheduler()
+    s.add('fast', 0.010, lambda: None)
+    s.add('medium', 0.050, lambda: None)
+    s.add('slow', 0.500, lambda: time.sleep(0.002))
+
+    t0 = robtimer()
+    idle = 0.
+    while robtimer() - t0 < 3.:
+        timeout = s.timeout()
+        w = robtimer()
+        time.sleep(timeout)
+        idle += robtimer() - w
+        s.runDue()
+
+    pprint.pprint(s.stats())
+    print("idle: %.1f%%" % (idle / (robtimer() - t0) * 100.,))
@@ -28,19 +28,36 @@ import pprint
 import logging
 import multiprocessing
 import threading
+import queue
+from multiprocessing.connection import wait
 
+import lbrsys
 from lbrsys.settings import opsLogFile
+try:
+    from lbrsys.settings import VELOCITY_CONTROL
+except ImportError:
+    VELOCITY_CONTROL = False
+try:
+    from lbrsys.settings import TELEMETRY_RATE
+except ImportError:
+    TELEMETRY_RATE = 10.
 from lbrsys import power, nav, voltages, amperages, count
 from lbrsys import gyro, accel, mag, mpuData
 from lbrsys import observeTurn, executeTurn, observeHeading, executeHeading
 from lbrsys import calibrateMagnetometer
-from lbrsys import observeRange, feedback
+from lbrsys import observeRange, feedback, ready, telemetryRate
 
 import robdrivers
 import robdrivers.sdc2130
 import robdrivers.agmbat
 from robops import movepa
 from robops import opsrules
+from robops import opsched
+from robops import odometry
+from robops import velocity
+from robops import telemetry
+from lbrsys.robcom import shmregister
+from lbrsys.robcom import telemetryrates
 
 printTests = False
 
@@ -59,11 +76,15 @@ class Opsmgr(object):
     def __init__(self,
                  commandQ=None, broadcastQ=None,  # todo avoid calling with positional args
                  rangecq=None, rangebq=None,
-                 mpucq=None, mpubq=None
+                 mpucq=None, mpubq=None,
+                 telemetryQ=None
                  ):
 
         self.commandQ   = commandQ
         self.broadcastQ = broadcastQ
+        # telemetryQ is a direct route to the telemetry consumer, bypassing the executive
+        self.telemetryQ = telemetryQ
+        self.telemetry  = telemetry.TelemetryAggregator(self.sendTelemetry)
         self.mpucq     = mpucq
         self.mpubq     = mpubq
         #self.mpucq     = None
@@ -75,7 +96,14 @@ class Opsmgr(object):
         self.initializeDevices()
 
         self.bat                = robdrivers.agmbat.Agmbat()
-        self.mover              = movepa.Movepa(self.devices['motorController'])
+        if VELOCITY_CONTROL:
+            self.velocityController = velocity.VelocityController(
+                self.motorController, lbrsys.robot_move_config, lbrsys.robot_calibrations)
+            self.motorController.count_pub.addSubscriber(self.velocityController.updateCount)
+            self.mover          = movepa.Movepa(self.velocityController)
+        else:
+            self.velocityController = None
+            self.mover          = movepa.Movepa(self.devices['motorController'])
         self.startTime          = robtimer()
         self.lastLogTime        = 0
         self.lastForwardRange   = -1
@@ -101,6 +129,7 @@ class Opsmgr(object):
         self.lastAmps           = amperages(0, 0, "")
         self.last_count         = count(0, 0, 0.)
         self.first_count_reported = False
+        self.lastPose           = None
         self.rangeRules         = opsrules.RangeRules()
         self.adjustedTask       = power(0., 0.)
         self.lastPower          = power(0., 0.)
@@ -117,8 +146,35 @@ class Opsmgr(object):
         self.lastMpuTime        = 0
         self.mpuInterval        = 2
 
+        # report intervals follow the rates consumers subscribe to
+        self.telemetryRates     = telemetryrates.RateSubscriptions()
+        self.ampsQueryRate      = self.motorController.queryRates['amps']
+        self.applyTelemetryRates()
+
+        # latest readings, written by the sensor processes on every read
+        self.rangeRegister      = shmregister.RangeRegister()
+        self.mpuRegister        = shmregister.MpuRegister()
+        self.headingRegister    = shmregister.HeadingRegister()
+        # encoder counts for the heading filter in motion processing
+        self.countRegister      = shmregister.CountRegister(create=True)
+        self.lastRegisterRangeTime = 0.
+        self.lastRegisterMpuTime   = 0.
+
+        # periods of the jobs run by the ops loop's deadline scheduler
+        self.controllerInterval = 0.020
+        self.registerInterval   = 0.020
+        self.adjustInterval     = 0.050
+        self.velocityInterval   = 0.020
+        self.velocityReportInterval = 0.5
+        self.telemetryInterval  = 1. / TELEMETRY_RATE
+        self.telemetryRatesInterval = 1.
+        self.opsStatsInterval   = 60.
+        self.pollInterval       = 0.010  # for command queues without a pipe to wait on
+        self.scheduler          = opsched.DeadlineScheduler()
+
         logging.info("Instantiated Robot Operations")
         if self.commandQ:
+            self.broadcastQ.put(ready(multiprocessing.current_process().name, robtimer()))
             self.start()
         else:
             logging.info(f"Ops not starting. No command queue.")
@@ -133,6 +189,8 @@ class Opsmgr(object):
         self.motorController.voltagePub.addSubscriber(self.voltageMonitor)
         self.motorController.voltagePub.addSubscriber(self.reportBat)
         self.motorController.count_pub.addSubscriber(self.report_count)
+        self.odometry = odometry.Odometry(lbrsys.robot_move_config)
+        self.motorController.count_pub.addSubscriber(self.reportPose)
         self.motorController.ampsPub.addSubscriber(self.genericSubscriber)
         self.motorController.ampsPub.addSubscriber(self.reportAmps)
         self.motorController.motorControlPub.addSubscriber(self.genericSubscriber)
@@ -148,6 +206,11 @@ class Opsmgr(object):
         if printTests:
             print("executing task: " + str(task))
 
+        # range and motion processing report readiness through operations
+        if type(task) is ready:
+            self.broadcastQ.put(task)
+            return
+
         if type(task) is power:
             self.lastPower = task
             self.requestedPower = task
@@ -176,9 +239,18 @@ class Opsmgr(object):
 
         if type(task) is mpuData:
             self.mpuData = task
-            self.curHeading = task.heading
+            if self.headingRegister.read() is None:
+                self.curHeading = task.heading
             self.reportMpu(task)
 
+        if type(task) is telemetryRate:
+            self.telemetryRates.subscribe(task)
+            self.applyTelemetryRates()
+            # motion and range processing report their own telemetry
+            for q in (self.mpucq, self.rangecq):
+                if q:
+                    q.put(task)
+
         if type(task) is observeTurn:
             self.mpucq.put(task)
 
@@ -194,6 +266,7 @@ class Opsmgr(object):
 
         if type(task) is executeHeading:
             if task.heading >= 0. and task.heading <= 360.:
+                self.readRegisters()
                 mpuTask = observeHeading(task.heading)
                 self.mpucq.put(mpuTask)
                 pa = calcDirection(self.curHeading, task.heading)[0]
@@ -228,6 +301,19 @@ class Opsmgr(object):
 
         logging.debug("execTask:  end of function")
 
+    def readRegisters(self):
+        """Pick up the freshest range and heading, which arrive by queue only periodically"""
+        ranges = self.rangeRegister.read()
+        if ranges is not None and ranges['Timestamp'] > self.lastRegisterRangeTime:
+            self.forwardRange = ranges['Ranges']['Forward']
+            self.lastRegisterRangeTime = ranges['Timestamp']
+
+        # prefer the fused heading to the raw magnetometer heading
+        h = self.headingRegister.read() or self.mpuRegister.read()
+        if h is not None and h.time > self.lastRegisterMpuTime:
+            self.curHeading = h.heading
+            self.lastRegisterMpuTime = h.time
+
     def adjustTask(self):
         result = "no move result"
         if self.lastPower.level > 0:
@@ -244,16 +330,37 @@ class Opsmgr(object):
                 print("adjust - level: %.2f, range: %d" % \
                 (self.adjustedTask.level,self.forwardRange))
 
+    def autoAdjustTask(self):
+        if self.autoAdjust:
+            self.adjustTask()
+
     def processStats(self,opsStats):
-        opsStats['AverageLoopTime'] = opsStats['totalLoopTime']/opsStats['numLoops']
-        if opsStats['numWaits'] > 0:
-            opsStats['AverageWaitTime:'] = opsStats['totalWaitTime']/opsStats['numWaits']
-        else:
-            opsStats['AverageWaitTime:'] = 0.
+        elapsed = max(robtimer() - opsStats['startTime'], 1e-6)
+        opsStats['idleFraction'] = opsStats['idleTime'] / elapsed
+        opsStats['cpuFraction'] = (time.process_time() - opsStats['startCpu']) / elapsed
+        opsStats['jobs'] = self.scheduler.stats()
+        opsStats['controller'] = self.motorController.getStats()
+        opsStats['telemetry'] = self.telemetry.stats()
+        opsStats['telemetryRates'] = self.telemetryRates.stats()
         #self.broadcastQ.put(opsStats)
         logging.info("Operations Stats\n%s\n" % (pprint.pformat(opsStats)))
         #pprint.pformat(opsStats)
 
+    def broadcastTelemetry(self, t):
+        """Merge a telemetry dict into the next aggregated telemetry frame"""
+        self.telemetry.update(t)
+
+    def sendTelemetry(self, t):
+        """
+        Send a telemetry frame directly to its consumer when a direct route is
+        configured.  The consumer expects the feedback wrapping that the executive
+        would otherwise have added.  Without a direct route, go via the executive.
+        """
+        if self.telemetryQ:
+            self.telemetryQ.put(feedback(t))
+        else:
+            self.broadcastQ.put(t)
+
     def genericSubscriber(self, msg):
         if self.lastLogTime == 0:
             logging.info('\n\nInitiating controller logging.')
@@ -270,18 +377,43 @@ class Opsmgr(object):
         if v.mainBattery < self.voltageMonitorThreshold:
             if robtimer() - self.lastVoltageAlarm >= self.alarmInterval:
                 vdictj = {'voltages': v._asdict()}
-                self.broadcastQ.put(vdictj)
+                self.broadcastTelemetry(vdictj)
                 self.lastVoltageAlarm = robtimer()
 
     def report_count(self, c):
+        self.countRegister.write(c)
         if not self.first_count_reported or \
                 c.left != self.last_count.left or c.right != self.last_count.right:
             self.last_count = c
             count_dict = {'Count': {'left': c.left, 'right': c.right, 'time': c.time}}
-            self.broadcastQ.put(count_dict)
+            self.broadcastTelemetry(count_dict)
             logging.debug(str(count_dict))
             self.first_count_reported = True
 
+    def reportPose(self, c):
+        p = self.odometry.update(c)
+        if self.lastPose is None or p[:5] != self.lastPose[:5]:
+            self.lastPose = p
+            self.broadcastTelemetry({'Pose': p._asdict()})
+
+    def applyTelemetryRates(self):
+        """Set report intervals, and the controller's amps query rate, from the subscribed rates"""
+        rates = self.telemetryRates
+        self.rangeInterval = rates.interval('Ranges')
+        self.mpuInterval = rates.interval('MPU')
+        self.ampsInterval = rates.interval('amperages')
+        self.voltageInterval = rates.interval('Bat')
+        # idle, amps are only queried at the floor rate, but subscribers get them
+        #   at least as fresh as the controller's own query rate
+        ampsRate = rates.rate('amperages')
+        if rates.subscribed('amperages'):
+            ampsRate = max(self.ampsQueryRate, ampsRate)
+        self.motorController.queryRates['amps'] = ampsRate
+
+    def reportVelocity(self):
+        if self.velocityController.errorSamples:
+            self.broadcastTelemetry(self.velocityController.telemetry())
+
     def reportBat(self, v):
         if robtimer() - self.lastVoltageTime >= self.voltageInterval:
             if abs(v.mainBattery-self.lastVoltage.mainBattery) > self.voltageNoise:
@@ -289,7 +421,7 @@ class Opsmgr(object):
                 blD = {'Bat': {'voltage':bl.voltage,
                                 'level':bl.level,
                                 'source':bl.source}}
-                self.broadcastQ.put(blD)
+                self.broadcastTelemetry(blD)
                 self.lastVoltageTime = robtimer()
                 self.lastVoltage = v
                 logging.debug("Reported Battery Level: %s" % \
@@ -301,7 +433,7 @@ class Opsmgr(object):
             ampsD = {'amperages':   {'leftMotor':  a.channel1,
                                      'rightMotor': a.channel2,
                                      'time':       a.time}}
-            self.broadcastQ.put(ampsD)
+            self.broadcastTelemetry(ampsD)
             self.lastAmpsTime = robtimer()
             self.lastAmps = a
             logging.debug('Amperages: %s\n' % (str(a)))
@@ -335,7 +467,7 @@ class Opsmgr(object):
                        abs(b-lastb) > self.rangeNoise or \
                        abs(btm-lastbtm) > self.rangeNoise:
                     '''
-                    self.broadcastQ.put(info)
+                    self.broadcastTelemetry(info)
                     self.lastRangeTime = robtimer()
                     self.lastRanges = info
         
@@ -349,7 +481,7 @@ class Opsmgr(object):
         if robtimer() - self.lastMpuTime >= self.mpuInterval:
             try:
                 mpuDict = {'MPU':m._asdict()}
-                self.broadcastQ.put(mpuDict)
+                self.broadcastTelemetry(mpuDict)
                 self.lastMpuTime = robtimer()
                 self.lastMpu = m
             except KeyError as e:
@@ -363,69 +495,95 @@ class Opsmgr(object):
         self.commandQ.put(power(0,0))
 
 
-    def start(self):
-        printRange = True
-        # minLoopTime = 0.050 # todo look at variablizing minLoopTime to be able to speed up or slow down as needed
-        minLoopTime = 0.010
-        opsStats = {'totalLoopTime':0, 'numLoops':0,
-                    'totalWaitTime':0, 'numWaits':0,
-                    'excessiveTimes':0}
-        while True:
-            loopStartTime = robtimer()
-            if not self.commandQ.empty():
-                task = self.commandQ.get_nowait()
-                logging.debug(f"Ops has task: {task}")
-                self.commandQ.task_done() # ensures queue doesn't hang
-
-                if task == 'Shutdown':
-                    self.mover.movepa(power(0.,0))
-                    print("Executing Shutdown..")
-                    self.processStats(opsStats)
-                    break
-
-                # since Ranges come in json dictionaries instead of named tuples,
-                #   handle separately for now.
-                if isinstance(task, dict):
-                    if 'Ranges' in task:
-                        self.forwardRange = task['Ranges']['Forward']
-                        self.reportRange(task)
-                        #logging.debug("range = %d" % (self.forwardRange,))
-                        if printRange:
-                            print(("Initial Forward Range = %dcm" % (self.forwardRange,)))
-                            printRange = False
+    def handleCommand(self, task):
+        """Execute a command from the command queue. Returns False on Shutdown."""
+        logging.debug(f"Ops has task: {task}")
+        self.commandQ.task_done() # ensures queue doesn't hang
 
-                self.execTask(task)
+        if task == 'Shutdown':
+            self.mover.movepa(power(0.,0))
+            print("Executing Shutdown..")
+            return False
 
-            self.checkController()
+        # since Ranges come in json dictionaries instead of named tuples,
+        #   handle separately for now.
+        if isinstance(task, dict):
+            if 'Ranges' in task:
+                self.forwardRange = task['Ranges']['Forward']
+                self.reportRange(task)
+                #logging.debug("range = %d" % (self.forwardRange,))
+                if self.printRange:
+                    print(("Initial Forward Range = %dcm" % (self.forwardRange,)))
+                    self.printRange = False
 
-            dt = robtimer() - loopStartTime
-            if dt > 1.0:
-                print("Long operations loop: %f after checking controller" % (dt,))
+        self.execTask(task)
+        return True
 
-            if self.autoAdjust:
-                self.adjustTask()
+    def start(self):
+        """
+        Sleep until the next scheduled job is due or a command arrives, whichever
+        is first, then handle any commands and run the jobs that are due.
+        """
+        self.printRange = True
+        opsStats = {'startTime': robtimer(), 'startCpu': time.process_time(),
+                    'wakes': 0, 'commandWakes': 0, 'commands': 0,
+                    'idleTime': 0., 'excessiveTimes': 0}
+
+        self.scheduler.add('checkController', self.controllerInterval, self.checkController)
+        self.scheduler.add('readRegisters', self.registerInterval, self.readRegisters)
+        self.scheduler.add('adjustTask', self.adjustInterval, self.autoAdjustTask)
+        if self.velocityController:
+            self.scheduler.add('velocity', self.velocityInterval, self.velocityController.update)
+            self.scheduler.add('velocityReport', self.velocityReportInterval, self.reportVelocity)
+        self.scheduler.add('telemetry', self.telemetryInterval, self.telemetry.flush)
+        self.scheduler.add('telemetryRates', self.telemetryRatesInterval, self.applyTelemetryRates)
+        self.scheduler.add('opsStats', self.opsStatsInterval, lambda: self.processStats(opsStats),
+                           first=robtimer() + self.opsStatsInterval)
+
+        reader = getattr(self.commandQ, '_reader', None)
+        running = True
+        while running:
+            timeout = self.scheduler.timeout()
+            waitStart = robtimer()
+            if reader is not None:
+                wait([reader], timeout)
+            elif self.commandQ.empty():
+                time.sleep(min(timeout, self.pollInterval))
+            wakeTime = robtimer()
+            opsStats['idleTime'] += wakeTime - waitStart
+            opsStats['wakes'] += 1
+
+            commands = 0
+            while running:
+                try:
+                    task = self.commandQ.get_nowait()
+                except queue.Empty:
+                    break
+                commands += 1
+                running = self.handleCommand(task)
 
-            elapsedTime = robtimer() - loopStartTime
-            waitTime = minLoopTime - elapsedTime
+            if commands:
+                opsStats['commandWakes'] += 1
+                opsStats['commands'] += commands
 
-            opsStats['totalLoopTime'] += elapsedTime
-            opsStats['numLoops'] += 1
-            if waitTime > 0:
-                opsStats['totalWaitTime'] += waitTime
-                opsStats['numWaits'] += 1
-            
-            if elapsedTime < minLoopTime and self.commandQ.empty():
-                time.sleep(waitTime)
+            if running:
+                self.scheduler.runDue()
 
+            elapsedTime = robtimer() - wakeTime
             if elapsedTime > 1.0:
                 logging.debug("Excessive operations loop time: %f" % (elapsedTime))
                 opsStats['excessiveTimes'] += 1
 
+        self.processStats(opsStats)
         self.end()
 
 
     def end(self):
         self.devices['motorController'].closeController()
+        self.rangeRegister.close()
+        self.mpuRegister.close()
+        self.headingRegister.close()
+        self.countRegister.close()
         # self.devices['motorController'].closeController()
 
         # self.devices['motorController'].cFront.closeController()
@@ -31,10 +31,12 @@ import threading
 import queue
 
 from lbrsys.settings import rangeLogFile
-from lbrsys import observeRange
+from lbrsys import observeRange, ready, telemetryRate
 
 import robdrivers.p8x32lbr
 from robops import rangeobserver
+from lbrsys.robcom import shmregister
+from lbrsys.robcom import telemetryrates
 
 proc = multiprocessing.current_process()
 
@@ -51,10 +53,11 @@ class Rangeservice(object):
         self.broadcastQ = broadcastQ
         # self.extQ       = extQ
         self.rangemcu   = robdrivers.p8x32lbr.P8X32()
+        self.rangeRegister = shmregister.RangeRegister(create=True)
         self.lastLogTime= 0
         self.logInterval= 2.0
         self.lastExtSend= 0
-        self.rangeReportInterval = 0.5
+        self.telemetryRates = telemetryrates.RateSubscriptions()
         self.lastRangeReportTime = 0.
         self.extInterval= 1
         self.waitTime   = 0.100 # the mb1220 range sensors have a 10Hz read rate
@@ -67,6 +70,7 @@ class Rangeservice(object):
         startmsg = "\n\n%s: Starting Range Operations" % (ta,)
         #print startmsg
         logging.debug(startmsg)
+        self.broadcastQ.put(ready(proc.name, robtimer(), {'acked': self.rangemcu.acked}))
         self.start()
 
     def start(self):
@@ -86,7 +90,8 @@ class Rangeservice(object):
             if good:
                 # print("Range: %d" % ranges['Ranges']['Forward'])
                 opsStats['successfulReadings'] += 1
-                if robtimer() - self.lastRangeReportTime > self.rangeReportInterval:
+                self.rangeRegister.write(ranges)
+                if robtimer() - self.lastRangeReportTime > self.telemetryRates.interval('Ranges'):
                     self.broadcastQ.put(ranges)
                     self.lastRangeReportTime = robtimer()
             else:
@@ -135,6 +140,9 @@ class Rangeservice(object):
         if type(task) is observeRange:
             self.addObserver(task.nav, self.broadcastQ)
 
+        if type(task) is telemetryRate:
+            self.telemetryRates.subscribe(task)
+
 
     def addObserver(self, navdata, qOut):
         rangeObserver = rangeobserver.RangeObserver(navdata, qOut)
@@ -162,6 +170,7 @@ class Rangeservice(object):
 
     def end(self):
         self.rangemcu.close()
+        self.rangeRegister.close()
 
 if __name__ == '__main__':
     cq = multiprocessing.JoinableQueue()
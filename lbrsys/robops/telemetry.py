@@ -0,0 +1,90 @@
+"""
+telemetry.py - aggregate telemetry into fixed rate frames
+    Operations reports each reading as a small telemetry dict as it arrives,
+    encoder counts on every change while moving.  Rather than sending each one
+    on, the aggregator merges them into the latest value per key, and on each
+    flush, at a fixed rate, sends one frame holding the latest values of the
+    keys that changed since the previous frame.  Consumers merge frames into
+    their own view of the telemetry, as the http service does, so an unchanged
+    key, or a one-off event such as a low voltage alarm, isn't resent.  Each
+    frame's 'Frame' entry carries a sequence number, so a consumer can tell if
+    it missed a frame, and the keys the frame holds.
+"""
+
+__author__ = "Tal G. Ball"
+__copyright__ = "Copyright (C) 2024 Tal G. Ball"
+__license__ = "Apache License, Version 2.0"
+__version__ = "1.0"
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+from time import time as robtimer
+
+
+class TelemetryAggregator:
+    def __init__(self, send):
+        """:param send: called with each frame dict"""
+        self.send = send
+        self.latest = {}
+        self.changed = set()
+        self.sequence = 0
+        self.updates = 0
+        self.keysSent = 0
+
+    def update(self, t):
+        """Merge a telemetry dict into the next frame"""
+        self.updates += 1
+        for k, v in t.items():
+            if k not in self.latest or self.latest[k] != v:
+                self.latest[k] = v
+                self.changed.add(k)
+
+    def flush(self):
+        """Send a frame if anything changed since the last one. Returns True if sent."""
+        if not self.changed:
+            return False
+        self.sequence += 1
+        frame = {k: self.latest[k] for k in self.changed}
+        frame['Frame'] = {'seq': self.sequence, 'changed': sorted(self.changed),
+                          'time': robtimer()}
+        self.keysSent += len(self.changed)
+        self.changed = set()
+        self.send(frame)
+        return True
+
+    def stats(self):
+        return {'updates': self.updates, 'frames': self.sequence,
+                'updatesPerFrame': self.updates / max(self.sequence, 1),
+                'keysPerFrame': self.keysSent / max(self.sequence, 1)}
+
+
+if __name__ == '__main__':
+    frames = []
+    a = TelemetryAggregator(frames.append)
+
+    # 10s of moving: counts at 50Hz, ranges at 2Hz, amps at 1Hz, flushed at 10Hz
+    for i in range(500):
+        t = i * 0.020
+        a.update({'Count': {'left': i, 'right': -i, 'time': t}})
+        if i % 25 == 0:
+            a.update({'Ranges': {'Forward': 100 - i // 25}, 'Timestamp': t})
+        if i % 50 == 0:
+            a.update({'Amps': {'channel1': 1.2, 'channel2': 1.3}})
+        if i % 5 == 4:
+            a.flush()
+
+    print(a.stats())
+    print(frames[-1])
+    print("frames with Ranges: %d, with Amps: %d" % (
+        sum('Ranges' in f for f in frames), sum('Amps' in f for f in frames)))
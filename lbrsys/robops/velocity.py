@@ -0,0 +1,214 @@
+"""
+velocity.py - closed loop wheel velocity control
+    In velocity control mode, Movepa's throttle and steering become target
+    speeds for each wheel instead of open loop power levels.  A PID per wheel
+    runs at a fixed rate from the ops loop, comparing each target with the
+    wheel speed measured from encoder count deltas over speedWindow, and corrects the motor
+    command so the robot holds its speed as the battery drains or the floor
+    changes.  The command is the target's share of maxSpeed, as open loop
+    power would have been, plus the PID's correction.
+
+    Gains and the full power wheel speed are calibration settings for the
+    robot (see calibrationDefaults), so they can be tuned without code changes.
+    The tracking error, the RMS difference between target and measured speed,
+    is reported in telemetry.
+"""
+
+__author__ = "Tal G. Ball"
+__copyright__ = "Copyright (C) 2024 Tal G. Ball"
+__license__ = "Apache License, Version 2.0"
+__version__ = "1.0"
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+from math import sqrt
+from time import time as robtimer
+import collections
+
+from lbrsys import move_config
+from robops.odometry import wheelScales
+
+
+# calibration table settings and their defaults
+calibrationDefaults = {
+    'VEL_KP': 10.0,             # motor command units per cm/s of error
+    'VEL_KI': 40.0,
+    'VEL_KD': 0.0,
+    'VEL_MAX_SPEED': 60.0,      # cm/s of a wheel at full power
+}
+
+MAX_COMMAND = 1000      # sdc2130 channel command range is -1000 to +1000
+
+
+class PID:
+    def __init__(self, kp, ki, kd, limit=MAX_COMMAND):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.limit = limit
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.
+        self.lastError = None
+
+    def update(self, error, dt):
+        derivative = 0. if self.lastError is None or dt <= 0 else (error - self.lastError) / dt
+        self.lastError = error
+        integral = self.integral + error * dt
+        output = self.kp * error + self.ki * integral + self.kd * derivative
+        # only keep integrating while the output isn't saturated (anti-windup)
+        if -self.limit < output < self.limit:
+            self.integral = integral
+        return max(-self.limit, min(self.limit, output))
+
+
+class VelocityController:
+    """
+    Stands in for the motor controller as Movepa's controller, so Movepa's
+    commands set the targets, and drives the motor controller from update.
+    """
+    # s of counts per speed measurement.  A single count is about 0.43cm, so a
+    #   20ms delta would quantize speeds to 21.5cm/s steps.
+    speedWindow = 0.2
+
+    def __init__(self, controller, config=None, calibrations=None):
+        self.controller = controller
+        self.config = config or move_config()
+        self.leftScale, self.rightScale = wheelScales(self.config)
+
+        settings = {}
+        for name, default in calibrationDefaults.items():
+            settings[name] = calibrations.get_setting(name, default)[0] if calibrations else default
+        self.maxSpeed = settings['VEL_MAX_SPEED']
+        self.pids = [PID(settings['VEL_KP'], settings['VEL_KI'], settings['VEL_KD'])
+                     for wheel in ('left', 'right')]
+
+        self.targets = [0., 0.]     # cm/s
+        self.speeds = [0., 0.]      # measured, cm/s
+        self.outputs = [0, 0]
+        self.counts = collections.deque()
+        self.lastUpdate = None
+        self.resetError()
+
+    def resetError(self):
+        self.errorSquares = 0.
+        self.errorSamples = 0
+
+    def mixMotorCommand(self, speed=0, direction=0, motorCommand=None):
+        """Movepa's throttle and steering set target wheel speeds, mixed as the controller would"""
+        m1 = max(-MAX_COMMAND, min(MAX_COMMAND, speed + direction))
+        m2 = max(-MAX_COMMAND, min(MAX_COMMAND, speed - direction))
+        self.targets = [m1 * self.maxSpeed / MAX_COMMAND, m2 * self.maxSpeed / MAX_COMMAND]
+        if m1 == 0 and m2 == 0:
+            # stop now rather than at the next update
+            return self.update()
+        return self.targets
+
+    def updateCount(self, c):
+        """Measure wheel speeds from the count deltas over the last speedWindow"""
+        counts = self.counts
+        if counts and c.time <= counts[-1].time:
+            if c.time < counts[-1].time:
+                counts.clear()      # the counts started over
+                counts.append(c)
+            return
+        counts.append(c)
+        # keep the newest count that is at least speedWindow old as the window's start
+        while len(counts) > 2 and c.time - counts[1].time >= self.speedWindow:
+            counts.popleft()
+        if len(counts) < 2:
+            return
+        last = counts[0]
+        dt = c.time - last.time
+        self.speeds = [(c.left - last.left) * self.leftScale / dt,
+                       (c.right - last.right) * self.rightScale / dt]
+
+    def update(self, now=None):
+        """Run the wheel PIDs and command the motors. Runs at a fixed rate from the ops loop."""
+        now = robtimer() if now is None else now
+        dt = 0. if self.lastUpdate is None else now - self.lastUpdate
+        self.lastUpdate = now
+
+        if self.targets == [0., 0.]:
+            for pid in self.pids:
+                pid.reset()
+            self.outputs = [0, 0]
+        else:
+            errors = [t - s for t, s in zip(self.targets, self.speeds)]
+            self.errorSquares += sum(e * e for e in errors)
+            self.errorSamples += 2
+            self.outputs = [int(max(-MAX_COMMAND, min(MAX_COMMAND,
+                                    t * MAX_COMMAND / self.maxSpeed + pid.update(e, dt))))
+                            for t, e, pid in zip(self.targets, errors, self.pids)]
+
+        return self.controller.generalMotorCommand(*self.outputs)
+
+    def trackingError(self):
+        return sqrt(self.errorSquares / self.errorSamples) if self.errorSamples else 0.
+
+    def telemetry(self):
+        """Velocity telemetry, with the tracking error since the last report"""
+        t = {'Velocity': {'targetLeft': self.targets[0], 'targetRight': self.targets[1],
+                          'left': self.speeds[0], 'right': self.speeds[1],
+                          'outputLeft': self.outputs[0], 'outputRight': self.outputs[1],
+                          'trackingError': self.trackingError(),
+                          'time': robtimer()}}
+        self.resetError()
+        return t
+
+
+if __name__ == '__main__':
+    from lbrsys import count
+
+    class SimulatedDrive:
+        """Wheels whose speed lags the command and falls off with a weak battery"""
+        def __init__(self, config, efficiency):
+            self.leftScale, self.rightScale = wheelScales(config)
+            self.efficiency = efficiency
+            self.commands = (0, 0)
+            self.position = [0., 0.]
+            self.speed = [0., 0.]
+
+        def generalMotorCommand(self, chan1=0, chan2=0):
+            self.commands = (chan1, chan2)
+
+        def step(self, dt):
+            for i, c in enumerate(self.commands):
+                full = c * calibrationDefaults['VEL_MAX_SPEED'] / MAX_COMMAND * self.efficiency
+                self.speed[i] += (full - self.speed[i]) * min(dt / 0.1, 1.)
+                self.position[i] += self.speed[i] * dt
+
+        def count(self, t):
+            # the controller reports whole counts
+            return count(int(self.position[0] / self.leftScale), int(self.position[1] / self.rightScale), t)
+
+    config = move_config()
+    for efficiency in (1.0, 0.8, 0.6):
+        drive = SimulatedDrive(config, efficiency)
+        v = VelocityController(drive, config)
+        v.mixMotorCommand(500, 100)
+        t = 0.
+        for i in range(150):            # 3s at 50Hz
+            drive.step(0.020)
+            t += 0.020
+            v.updateCount(drive.count(t))
+            v.update(t)
+            if i == 49:
+                startError = v.trackingError()
+                v.resetError()          # the last 2s are the steady state
+        print("efficiency %.1f: targets %s, wheel speeds %s, measured %s, "
+              "tracking error %.2f cm/s starting, %.2f cm/s steady" % (
+            efficiency, ['%.1f' % s for s in v.targets], ['%.1f' % s for s in drive.speed],
+            ['%.1f' % s for s in v.speeds], startError, v.trackingError()))
@@ -4,21 +4,28 @@ specific ports and configuration options
 """
 
 import os
-import socket
 from collections import OrderedDict
 
 
 robot_name = 'lbr6'
 
-# set the port for use in the http service and find the ip address
-# for the robot
+# set the port for use in the http service
 robhttpPort = 9145
-# usual approach not working on the rpi: robhttpAddress = (socket.gethostbyname_ex('')[2][0],robhttpPort)
-# hack to reliably get ip address on Linux, pending better solution
-_s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-_s.connect(("8.8.8.8", 80))
-robhttpAddress = (_s.getsockname()[0], robhttpPort)
-_s.close()
+
+# network interface for the http service address, e.g. 'wlan0'.
+#   None uses the first interface with a non-loopback IPv4 address.
+robhttpInterface = None
+
+
+def __getattr__(name):
+    # robhttpAddress is found from the local interfaces on first use, so importing
+    #   settings does no network I/O.  See robcom/netaddr.py
+    if name == 'robhttpAddress':
+        from lbrsys.robcom import netaddr
+        address = (netaddr.localAddress(robhttpInterface), robhttpPort)
+        globals()['robhttpAddress'] = address
+        return address
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
 
@@ -30,6 +37,29 @@ USE_SSL = True
 
 # set the port for connecting to a Roboteq SDC2130 motor controller
 SDC2130_Port = '/dev/ttyACM1'
+# set SDC2130_STREAMING = True to have the controller stream counts, amps and voltages
+#   instead of being polled for them
+SDC2130_STREAMING = False
+# set VELOCITY_CONTROL = True to hold wheel speeds with encoder feedback
+#   instead of driving the motors open loop (see robops/velocity.py)
+VELOCITY_CONTROL = False
+# set MP_HIGH_RATE = True to sample the motion sensor at MP_SAMPLE_RATE Hz in batches of
+#   MP_BATCH_SIZE samples instead of every 100ms (see robops/mpbatch.py)
+MP_HIGH_RATE = False
+MP_SAMPLE_RATE = 200.
+MP_BATCH_SIZE = 10
+
+# frames per second of aggregated telemetry from operations (see robops/telemetry.py)
+TELEMETRY_RATE = 10.
+
+# telemetry report rates in Hz when no consumer has subscribed to a faster rate
+#   with a telemetryRate message (see robcom/telemetryrates.py)
+TELEMETRY_FLOOR_RATES = {'Ranges': 0.1, 'MPU': 0.05, 'amperages': 0.1, 'Bat': 1. / 60.}
+# http clients that poll telemetry without subscribing, such as the web UI, are
+#   subscribed at these rates for as long as they keep polling
+TELEMETRY_POLL_RATES = {'Ranges': 2., 'MPU': 0.5, 'amperages': 1., 'Bat': 1. / 15.}
+# seconds until a telemetry rate subscription lapses unless renewed
+TELEMETRY_SUBSCRIPTION_TTL = 60.
 
 # set the port for getting range and potentially other sensor data
 #   In the default case, a Parallax Propeller P8X32 microcontroller is
@@ -40,10 +70,40 @@ P8X32_1_Port = '/dev/ttyACM0'
 
 # For robots using i2c, address for mpu9150 motion processing device
 MPU9150_ADDRESS = 0x68
+# set MPU9150_FIFO = True to sample the mpu9150 into its FIFO at MPU9150_FIFO_RATE Hz
+#   and drain it in bulk, instead of reading one sample at a time
+MPU9150_FIFO = False
+MPU9150_FIFO_RATE = 200.
 
 # For robots using Riox (for AHRS and other io extender capabilities)
 # Set to None if not using RIOX
 RIOX_1216AHRS_Port = '/dev/ttyACM2'
+# set RIOX_STREAMING = True to have the RIOX stream MEMS readings at RIOX_MEMS_RATE Hz
+#   instead of being queried for each one.  The AHRS is queried at RIOX_AHRS_RATE Hz.
+RIOX_STREAMING = False
+RIOX_MEMS_RATE = 10.
+RIOX_AHRS_RATE = 10.
+
+# names of the shared memory registers holding the latest sensor readings
+#   (see robcom/shmregister.py)
+RANGE_REGISTER = robot_name + '_range'
+MPU_REGISTER = robot_name + '_mpu'
+COUNT_REGISTER = robot_name + '_count'
+HEADING_REGISTER = robot_name + '_heading'
+
+# multiprocessing start method for the robot services, 'spawn' or 'forkserver'
+#   With 'forkserver', each service is forked from a server process that has
+#   already imported the modules in FORKSERVER_PRELOAD, instead of starting
+#   from a cold interpreter.  Modules are preloaded under the names services
+#   import them by.
+START_METHOD = 'spawn'
+FORKSERVER_PRELOAD = ['lbrsys', 'lbrsys.settings', 'lbrsys.robcom.publisher', 'robcom.publisher',
+                      'lbrsys.robcom.robcodec', 'pyquaternion', 'numpy']
+
+# seconds the executive waits for each service to report that it is ready,
+#   with optional overrides by process name
+SERVICE_READY_TIMEOUT = 15.
+SERVICE_READY_TIMEOUTS = {'Speech Services': 30.}
 
 # directional and rotational conventions
 #   Motion processing device driver observes these conventions
@@ -101,6 +161,12 @@ if not os.path.isdir(LOG_DIR):
 
 MAG_CALIBRATION_DIR = os.path.join(LOG_DIR, 'mag_calibration')
 
+# cached snapshot of the robot's configuration from dbfile (see robexec/robconfig.py)
+CONFIG_SNAPSHOT = os.path.join(LOG_DIR, 'robot_config.pickle')
+
+# standard message catalog compiled from the message table (see robcom/msgcatalog.py)
+MESSAGE_CATALOG = os.path.join(LOG_DIR, 'messages.cat')
+
 robLogFile     = os.path.join(LOG_DIR, 'robot.log')
 opsLogFile     = os.path.join(LOG_DIR, 'ops.log')
 mpLogFile      = os.path.join(LOG_DIR, 'mpu.log')